@@ -1,20 +1,41 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import uvicorn
+import asyncio
+import logging
 import os
-import json
+import secrets
+import time
 import uuid
 from pathlib import Path
 from datetime import datetime
 
-from app.services.pdf_service import PDFService
+from app.services.pdf_service import PDFService, PREVIEW_FORMATS, PREVIEW_SIZES, PREVIEW_TILED_SIZE
 from app.services.template_service import TemplateService
 from app.services.render_service import RenderService
-from app.services.auth_service import AuthService
+from app.services.render_plan import FORM_FILL_OFF, FORM_FILL_MODES
+from app.services.auth_service import AuthService, BCRYPT_ROUNDS
+from app.services.blob_store import BlobStore, UploadTooLarge
+from app.services.password_hasher import PasswordHasher, PasswordHasherSaturated
+from app.services.template_analysis import TemplateAnalyzer
+from app.services.storage import FileTemplateStore, FileUserStore, SQLiteStore, VersionConflict
+from app.services.pdf_cache import TemplatePDFCache
+from app.services.render_executor import RenderExecutor, RenderPoolSaturated
+from app.services.metrics import RenderMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.services.job_queue import RenderJobQueue, RenderJobRunner, JOB_DONE, JOB_QUEUED, JOB_RUNNING
+from app.services.result_cache import RenderResultCache, result_cache_key
+from app.services.log import configure_logging
+
+# Structured logging: LOG_LEVEL (DEBUG, INFO, WARNING, ERROR), LOG_FORMAT ("text" or "json")
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "text"))
+logger = logging.getLogger(__name__)
+
+# Usernames allowed to use admin-only features (render profiling)
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
 
 app = FastAPI(
     title="PDF Template Automation Engine",
@@ -64,6 +85,25 @@ if cors_origins == ["*"]:
 else:
     allow_origins = [origin.strip() for origin in cors_origins]
 
+# Registered first: CORS (added last) stays outermost, so 413 responses carry CORS headers
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads (UPLOAD_LIMITS) before Starlette spools the whole body to disk
+
+    Chunked uploads carry no Content-Length: they are still limited while the
+    file is stored (blob_store.store), after parsing.
+    """
+    max_bytes = UPLOAD_LIMITS.get(request.url.path) if request.method == "POST" else None
+    if max_bytes is not None:
+        try:
+            length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})
+        if length > max_bytes + MULTIPART_OVERHEAD:
+            return JSONResponse(status_code=413, content={"detail": str(UploadTooLarge(max_bytes))})
+    return await call_next(request)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
@@ -78,16 +118,144 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 UPLOADS_DIR = BASE_DIR / "uploads"
 IMAGES_DIR = BASE_DIR / "uploads" / "images"
 USERS_DIR = BASE_DIR / "users"
+JOBS_DIR = BASE_DIR / "jobs"
+CACHE_DIR = BASE_DIR / "cache"
+DATA_DIR = BASE_DIR / "data"
+BLOBS_DIR = BASE_DIR / "blobs"
 TEMPLATES_DIR.mkdir(exist_ok=True)
 UPLOADS_DIR.mkdir(exist_ok=True)
 IMAGES_DIR.mkdir(exist_ok=True)
 USERS_DIR.mkdir(exist_ok=True)
 
+# Template PDF cache (shared by rendering and preview)
+template_pdf_cache = TemplatePDFCache(
+    max_entries=int(os.getenv("TEMPLATE_PDF_CACHE_ENTRIES", "32")),
+    max_bytes=int(os.getenv("TEMPLATE_PDF_CACHE_MB", "256")) * 1024 * 1024,
+)
+
+# Rendered result cache (identical requests are served without rendering again)
+# Kept outside uploads/ so cached documents are never publicly served
+result_cache = RenderResultCache(
+    CACHE_DIR / "results",
+    max_disk_bytes=int(os.getenv("RESULT_CACHE_MB", "512")) * 1024 * 1024,
+    max_memory_bytes=int(os.getenv("RESULT_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_memory_item_bytes=int(os.getenv("RESULT_CACHE_MEMORY_ITEM_KB", "256")) * 1024,
+)
+
+# Uploaded PDFs and images: streamed to disk, identical files stored once
+# Blobs are kept outside uploads/ (publicly served); they must be on the same
+# filesystem and mount as uploads/ to be shared by hard links, otherwise files are copied
+blob_store = BlobStore(BLOBS_DIR)
+blob_store.adopt(UPLOADS_DIR / "blobs")  # Location before blobs were moved out of uploads/
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_MB", "10")) * 1024 * 1024
+# Upload routes -> file size limit, also checked against Content-Length before the form is parsed
+UPLOAD_LIMITS = {"/api/templates": UPLOAD_MAX_BYTES, "/api/images": IMAGE_UPLOAD_MAX_BYTES}
+MULTIPART_OVERHEAD = 64 * 1024  # Boundaries and part headers around the file
+
+# Template and user storage: "sqlite" (default) or "file" (templates/*.json, users/users.json)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+if STORAGE_BACKEND == "sqlite":
+    storage = SQLiteStore(DATA_DIR / "storage.db")
+    # Existing template and user files are imported on first start
+    storage.migrate_from_files(FileTemplateStore(TEMPLATES_DIR), FileUserStore(USERS_DIR))
+    template_store, user_store = storage, storage
+elif STORAGE_BACKEND == "file":
+    template_store, user_store = FileTemplateStore(TEMPLATES_DIR), FileUserStore(USERS_DIR)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
 # Initialize services
-pdf_service = PDFService()
-template_service = TemplateService(TEMPLATES_DIR)
-render_service = RenderService(TEMPLATES_DIR, UPLOADS_DIR)
-auth_service = AuthService(USERS_DIR)
+pdf_service = PDFService(pdf_cache=template_pdf_cache)
+template_service = TemplateService(TEMPLATES_DIR, store=template_store)
+render_service = RenderService(TEMPLATES_DIR, UPLOADS_DIR, pdf_cache=template_pdf_cache, template_service=template_service)
+# Password hashing pool (logins must not stall renders running on the event loop)
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv("BCRYPT_ROUNDS", str(BCRYPT_ROUNDS))),
+    workers=int(os.getenv("AUTH_HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("AUTH_HASH_QUEUE_SIZE", "32")),
+)
+auth_service = AuthService(
+    USERS_DIR,
+    store=user_store,
+    trust_token_claims=os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() in ("1", "true", "yes"),
+    hasher=password_hasher,
+)
+# Full PDF analysis runs in the background after upload
+template_analyzer = TemplateAnalyzer(pdf_service, template_service, UPLOADS_DIR)
+# Saved or deleted template: its cached results can no longer be requested
+template_service.add_change_listener(result_cache.invalidate_template)
+
+# Render stage timings, cache hit rates and queue depth (Prometheus text format on /metrics)
+render_metrics = RenderMetrics()
+# Scrapers send "Authorization: Bearer <token>"; empty disables /metrics (it exposes usage and queue state)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Render worker processes (renders are CPU-bound and must not block the event loop)
+render_executor = RenderExecutor(
+    render_service,
+    workers=int(os.getenv("RENDER_WORKERS", str(min(2, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("RENDER_QUEUE_SIZE", "16")),
+    retry_after=int(os.getenv("RENDER_RETRY_AFTER", "5")),
+    metrics=render_metrics,
+)
+
+# Asynchronous render jobs (persisted in a local SQLite database)
+job_queue = RenderJobQueue(
+    JOBS_DIR / "jobs.db",
+    JOBS_DIR / "results",
+    lease_seconds=float(os.getenv("RENDER_JOB_LEASE_SECONDS", "60")),
+)
+job_runner = RenderJobRunner(
+    job_queue,
+    render_executor,
+    template_service,
+    concurrency=int(os.getenv("RENDER_JOB_CONCURRENCY", "1")),
+    chunk_records=int(os.getenv("RENDER_JOB_CHUNK_RECORDS", "200")),
+)
+
+# Values kept by other components, read when /metrics is scraped
+def _result_cache_requests() -> Dict[tuple, int]:
+    stats = result_cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+
+def _result_cache_bytes() -> Dict[tuple, int]:
+    stats = result_cache.stats()
+    return {("disk",): stats["disk_bytes"], ("memory",): stats["memory_bytes"]}
+
+
+_metrics_registry = render_metrics.registry
+_metrics_registry.gauge("render_queue_depth", "Renders running or waiting for a worker",
+                        lambda: render_executor.pending)
+_metrics_registry.gauge("render_queue_capacity", "Maximum renders running or waiting",
+                        lambda: render_executor.capacity)
+_metrics_registry.gauge("render_rejected_total", "Renders rejected because the queue was full",
+                        lambda: render_executor.rejected, kind="counter")
+_metrics_registry.gauge("render_result_cache_requests_total", "Rendered result cache lookups",
+                        _result_cache_requests, ("result",), kind="counter")
+_metrics_registry.gauge("render_result_cache_bytes", "Size of cached rendered results",
+                        _result_cache_bytes, ("tier",))
+_metrics_registry.gauge("render_jobs", "Render jobs waiting or running",
+                        lambda: {(status,): job_queue.count(status) for status in (JOB_QUEUED, JOB_RUNNING)},
+                        ("status",))
+_metrics_registry.gauge("auth_hash_queue_depth", "Password hashes running or waiting",
+                        lambda: password_hasher.stats()["pending"])
+
+
+@app.on_event("startup")
+async def start_render_workers():
+    render_executor.start()
+    job_runner.start()
+    # Blobs left unreferenced by an interrupted delete or upload
+    asyncio.get_running_loop().run_in_executor(None, blob_store.collect)
+
+
+@app.on_event("shutdown")
+async def stop_render_workers():
+    await job_runner.stop()
+    render_executor.shutdown()
+    password_hasher.shutdown()
 
 # Static file serving (uploaded images)
 app.mount("/api/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
@@ -156,6 +324,77 @@ class RenderRequest(BaseModel):
         }
 
 
+class BatchRenderRequest(BaseModel):
+    """Request model for batch PDF rendering
+    
+    Each record is a data object like the body of `/api/render/{template_id}`.
+    
+    Example:
+        {
+            "records": [
+                {"customer": {"name": "John Doe"}, "total": 10000},
+                {"customer": {"name": "Jane Doe"}, "total": 20000}
+            ],
+            "format": "pdf"  # "pdf" (one concatenated PDF) or "zip" (one PDF per record)
+        }
+    """
+    records: List[Dict[str, Any]]
+    format: str = "pdf"
+
+
+class RenderJobRequest(BaseModel):
+    """Request model for asynchronous render jobs
+    
+    Provide either `data` (one record) or `records` (many records).
+    
+    Example:
+        {
+            "records": [
+                {"customer": {"name": "John Doe"}},
+                {"customer": {"name": "Jane Doe"}}
+            ],
+            "format": "pdf",  # "pdf" (one concatenated PDF) or "zip" (one PDF per record)
+            "elements": null  # Optional: override template elements
+        }
+    """
+    data: Optional[Dict[str, Any]] = None
+    records: Optional[List[Dict[str, Any]]] = None
+    format: str = "pdf"
+    elements: Optional[List[Dict[str, Any]]] = None
+
+
+class MappingPatchRequest(BaseModel):
+    """Request model for element-level template mapping changes
+    
+    Operations are applied in order, all or nothing. `base_version` is the
+    template `version` the client last loaded; if the template was saved
+    since then the patch is rejected with `409`.
+    
+    Example:
+        {
+            "base_version": 7,
+            "ops": [
+                {"op": "add", "element": {"id": "elem_2", "type": "text", "page": 1, "bbox": {...}}},
+                {"op": "update", "id": "elem_1", "element": {"data_path": "customer.name"}},
+                {"op": "remove", "id": "elem_3"}
+            ],
+            "pages": null,  # Optional: replace page list
+            "form_fill": null  # Optional: "off", "fill" or "flatten"
+        }
+    """
+    base_version: int
+    ops: List[Dict[str, Any]] = []
+    pages: Optional[List[Dict[str, Any]]] = None
+    form_fill: Optional[str] = None
+
+
+# Maximum records per batch render request
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", "1000"))
+
+# Preview images only change when the template PDF is replaced (ETag changes too)
+PREVIEW_CACHE_CONTROL = f"private, max-age={int(os.getenv('PREVIEW_MAX_AGE', '3600'))}"
+
+
 # ===== Authentication Helper Functions =====
 from fastapi import Depends, Header
 from typing import Optional
@@ -168,17 +407,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> Optio
     try:
         # Extract token from "Bearer <token>" format
         token = authorization.replace("Bearer ", "")
-        payload = auth_service.verify_token(token)
-        if payload:
-            username = payload.get("sub")
-            if username:
-                user_data = auth_service.get_user(username)
-                if user_data:
-                    return {
-                        "user_id": user_data["user_id"],
-                        "username": user_data["username"],
-                        "email": user_data["email"],
-                    }
+        return auth_service.user_from_token(token)
     except:
         pass
     return None
@@ -197,21 +426,20 @@ async def require_auth(authorization: Optional[str] = Header(None)) -> Dict:
 async def register(request: RegisterRequest):
     """User registration"""
     try:
-        user = auth_service.register_user(
+        user = await auth_service.register_user(
             username=request.username,
             email=request.email,
             password=request.password
         )
         return {"status": "success", "user": user}
+    except PasswordHasherSaturated as e:
+        raise HTTPException(status_code=503, detail="Too many registration requests, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
     except ValueError as e:
-        import traceback
-        print(f"ValueError in register: {str(e)}")
-        print(traceback.format_exc())
+        logger.info("Registration rejected", extra={"username": request.username, "error": str(e)})
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        import traceback
-        print(f"Exception in register: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Registration failed", extra={"username": request.username})
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -219,12 +447,16 @@ async def register(request: RegisterRequest):
 @app.post("/api/auth/login")
 async def login(request: LoginRequest):
     """User login"""
-    user = auth_service.authenticate_user(request.username, request.password)
+    try:
+        user = await auth_service.authenticate_user(request.username, request.password)
+    except PasswordHasherSaturated as e:
+        raise HTTPException(status_code=503, detail="Too many login requests, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Create JWT token
-    token_data = {"sub": user["username"]}
+    # Create JWT token (user_id/email claims are used when AUTH_TRUST_TOKEN_CLAIMS is on)
+    token_data = {"sub": user["username"], "user_id": user["user_id"], "email": user["email"]}
     access_token = auth_service.create_access_token(token_data)
     
     return {
@@ -244,45 +476,66 @@ async def get_current_user_info(current_user: Dict = Depends(require_auth)):
 
 # ===== Template Upload =====
 @app.post("/api/templates")
-async def upload_template(file: UploadFile = File(...), current_user: Dict = Depends(require_auth)):
+async def upload_template(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                          current_user: Dict = Depends(require_auth)):
     """Upload PDF template (authentication required)"""
     try:
         template_id = str(uuid.uuid4())
         
-        # Save PDF file
+        # Save PDF file (streamed in chunks; shares storage with identical earlier uploads)
         file_path = UPLOADS_DIR / f"{template_id}.pdf"
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        pdf_sha256, _, _ = await asyncio.to_thread(blob_store.store, file.file, file_path, UPLOAD_MAX_BYTES)
+        template_pdf_cache.invalidate(file_path)
         
-        # Extract PDF information
-        pdf_info = pdf_service.extract_info(file_path)
+        # Cheap format check (the document itself is read by the background analysis)
+        with open(file_path, "rb") as f:
+            if b"%PDF-" not in f.read(1024):
+                blob_store.release(file_path, pdf_sha256)
+                raise HTTPException(status_code=400, detail="PDF files only")
         
         # Create basic template structure (including user_id)
+        # Page sizes, form fields, fonts and images are filled in by the background analysis
         template = {
             "template_id": template_id,
             "user_id": current_user["user_id"],
             "username": current_user["username"],
             "filename": file.filename,
-            "page_size": pdf_info.get("page_size"),
-            "pages": pdf_info.get("pages", []),
+            "pdf_sha256": pdf_sha256,
+            "pages": [],
             "elements": [],
-            "created_at": str(pdf_info.get("created_at", "")),
+            "analysis": template_analyzer.pending(),
+            "created_at": datetime.now().isoformat(),
         }
         
         template_service.save_template(template_id, template)
         
+        # Analysis and page previews run after the response is sent
+        template_analyzer.claim(template_id)
+        background_tasks.add_task(template_analyzer.run_with_previews, template_id)
+        
         return {
             "template_id": template_id,
             "filename": file.filename,
-            "page_count": pdf_info.get("page_count", 1),
-            "page_size": pdf_info.get("page_size"),
+            "analysis_status": template["analysis"]["status"],
         }
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 # ===== Save Template Mapping =====
+def _check_form_fill(form_fill: Optional[str]) -> str:
+    """Validate template form_fill setting (null means "off")"""
+    if form_fill is None:
+        return FORM_FILL_OFF
+    if form_fill not in FORM_FILL_MODES:
+        raise HTTPException(status_code=400, detail=f"form_fill must be one of: {', '.join(FORM_FILL_MODES)}")
+    return form_fill
+
+
 @app.put("/api/templates/{template_id}/mapping")
 async def save_template_mapping(template_id: str, mapping: Dict[str, Any], current_user: Dict = Depends(require_auth)):
     """Save template mapping information (authentication required)"""
@@ -297,7 +550,10 @@ async def save_template_mapping(template_id: str, mapping: Dict[str, Any], curre
         
         # Update mapping information
         template["elements"] = mapping.get("elements", [])
-        template["pages"] = mapping.get("pages", template.get("pages", []))
+        # Empty page list: editor was opened before the background analysis finished
+        template["pages"] = mapping.get("pages") or template.get("pages", [])
+        if "form_fill" in mapping:
+            template["form_fill"] = _check_form_fill(mapping["form_fill"])
         
         template_service.save_template(template_id, template)
         
@@ -308,6 +564,41 @@ async def save_template_mapping(template_id: str, mapping: Dict[str, Any], curre
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ===== Patch Template Mapping =====
+@app.patch("/api/templates/{template_id}/mapping")
+async def patch_template_mapping(template_id: str, request: MappingPatchRequest,
+                                 current_user: Dict = Depends(require_auth)):
+    """Add, update and remove single elements (authentication required)"""
+    try:
+        owner = template_service.get_template_owner(template_id)
+        if owner is None:
+            raise HTTPException(status_code=404, detail="Template not found")
+        
+        # Verify user ownership
+        if owner != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        fields = {}
+        if request.pages is not None:
+            fields["pages"] = request.pages
+        if request.form_fill is not None:
+            fields["form_fill"] = _check_form_fill(request.form_fill)
+        version = template_service.patch_template(template_id, request.base_version, request.ops, fields or None)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Template not found")
+        
+        return {"status": "success", "template_id": template_id, "version": version}
+    except VersionConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "current_version": e.current_version},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # ===== Get Template =====
 @app.get("/api/templates/{template_id}")
 async def get_template(template_id: str, current_user: Dict = Depends(require_auth)):
@@ -323,6 +614,31 @@ async def get_template(template_id: str, current_user: Dict = Depends(require_au
     return template
 
 
+# ===== Template Analysis Status =====
+@app.get("/api/templates/{template_id}/analysis")
+async def get_template_analysis(template_id: str, background_tasks: BackgroundTasks,
+                                current_user: Dict = Depends(require_auth)):
+    """Status of the background PDF analysis (authentication required)
+    
+    `status` is `pending`, `running`, `done` or `failed`. Once done, the response
+    also lists `form_fields` (all pages), `fonts` and `images` (with the pages
+    they appear on); page sizes are saved in the template's `pages`.
+    """
+    template = template_service.get_template(template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    # Verify user ownership
+    if template.get("user_id") != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # Analysis interrupted (e.g. by a restart): start it again
+    if template_analyzer.needs_restart(template) and template_analyzer.claim(template_id):
+        background_tasks.add_task(template_analyzer.run, template_id)
+    
+    return {"template_id": template_id, **template_analyzer.status(template)}
+
+
 # ===== List Templates =====
 @app.get("/api/templates")
 async def list_templates(current_user: Dict = Depends(require_auth)):
@@ -333,8 +649,19 @@ async def list_templates(current_user: Dict = Depends(require_auth)):
 
 # ===== PDF Preview (Image) =====
 @app.get("/api/templates/{template_id}/preview")
-async def preview_template(template_id: str, page: int = 1, current_user: Dict = Depends(require_auth)):
-    """Template page preview (image) (authentication required)"""
+async def preview_template(template_id: str, page: int = 1, size: str = "editor", format: str = "png",
+                           tile: Optional[str] = None, current_user: Dict = Depends(require_auth),
+                           if_none_match: Optional[str] = Header(None)):
+    """Template page preview (image) (authentication required)
+    
+    - `size`: `thumb` (36 DPI), `editor` (150 DPI, default) or `zoom` (300 DPI)
+    - `format`: `png` (default), `jpeg` or `webp`
+    - `tile`: `col,row` of a 512px tile of the zoom image (`size=zoom` only);
+      zoom responses report the tile grid in `X-Preview-Tiles` (`cols,rows`)
+    
+    Previews are cached until the template PDF changes. Responses carry an ETag;
+    a matching If-None-Match returns 304 without reading the image.
+    """
     try:
         # Verify template ownership
         template = template_service.get_template(template_id)
@@ -348,9 +675,35 @@ async def preview_template(template_id: str, page: int = 1, current_user: Dict =
         if not pdf_path.exists():
             raise HTTPException(status_code=404, detail="PDF file not found")
         
-        image_path = pdf_service.render_page_as_image(pdf_path, page - 1)
+        if size not in PREVIEW_SIZES:
+            raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(PREVIEW_SIZES)}")
+        if format not in PREVIEW_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(PREVIEW_FORMATS)}")
+        tile_pos = None
+        if tile is not None:
+            if size != PREVIEW_TILED_SIZE:
+                raise HTTPException(status_code=400, detail=f"tile requires size={PREVIEW_TILED_SIZE}")
+            try:
+                col, row = (int(part) for part in tile.split(","))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="tile must be 'col,row'")
+            if col < 0 or row < 0:
+                raise HTTPException(status_code=400, detail="tile must be 'col,row'")
+            tile_pos = (col, row)
+        
+        headers = {
+            "ETag": pdf_service.preview_etag(pdf_path, page - 1, size, format, tile_pos),
+            "Cache-Control": PREVIEW_CACHE_CONTROL,
+        }
+        if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        
+        # Cached preview is served as is; rendering (first request only) runs off the event loop
+        image_path = await asyncio.to_thread(pdf_service.render_page_as_image, pdf_path, page - 1, size, format, tile_pos)
+        if size == PREVIEW_TILED_SIZE and tile_pos is None:
+            headers["X-Preview-Tiles"] = "%d,%d" % await asyncio.to_thread(pdf_service.tile_grid, pdf_path, page - 1)
         
-        return FileResponse(image_path, media_type="image/png")
+        return FileResponse(image_path, media_type=PREVIEW_FORMATS[format][1], headers=headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -360,7 +713,7 @@ async def preview_template(template_id: str, page: int = 1, current_user: Dict =
 # ===== PDF Rendering =====
 @app.post(
     "/api/render/{template_id}",
-    response_class=FileResponse,
+    response_class=Response,
     summary="Generate PDF from Template",
     description="""
     Generate a completed PDF by mapping field data to a saved template.
@@ -380,6 +733,13 @@ async def preview_template(template_id: str, page: int = 1, current_user: Dict =
     Include `_elements` in the request body to override template elements for testing.
     This allows you to test rendering without saving changes to the template.
     
+    ### Optional: Profiling (admin only)
+    
+    With `?profile=true` the request is rendered under cProfile (the result cache is
+    bypassed) and a JSON report is returned instead of the PDF: stage and per-element
+    timings plus the top functions by cumulative time. Requires a user listed in
+    `ADMIN_USERS`.
+    
     ## Response
     
     Returns the generated PDF file as a binary stream with `application/pdf` content type.
@@ -432,6 +792,14 @@ async def preview_template(template_id: str, page: int = 1, current_user: Dict =
                     "example": {"detail": "Template not found"}
                 }
             }
+        },
+        503: {
+            "description": "Render queue is full - retry after the number of seconds in the Retry-After header",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Render queue is full, please retry later"}
+                }
+            }
         }
     },
     tags=["PDF Rendering"]
@@ -439,6 +807,7 @@ async def preview_template(template_id: str, page: int = 1, current_user: Dict =
 async def render_pdf(
     template_id: str,
     data: RenderRequest,
+    profile: bool = False,
     current_user: Dict = Depends(require_auth)
 ):
     """
@@ -447,6 +816,7 @@ async def render_pdf(
     **Parameters:**
     - `template_id`: UUID of the template to use for rendering
     - `data`: JSON object containing field values to map to template fields
+    - `profile`: Return a profiling report instead of the PDF (admin only)
     
     **Returns:**
     - PDF file (application/pdf)
@@ -464,7 +834,11 @@ async def render_pdf(
       --output result.pdf
     ```
     """
+    started = time.perf_counter()
     try:
+        if profile and current_user.get("username") not in ADMIN_USERS:
+            raise HTTPException(status_code=403, detail="Profiling requires an admin account")
+        
         # Verify template ownership
         template = template_service.get_template(template_id)
         if not template:
@@ -479,27 +853,215 @@ async def render_pdf(
         # Use _elements if provided, otherwise use saved template
         elements_override = data_dict.pop("_elements", None)
         
-        if elements_override is not None:
-            # Use temporary template (when elements are provided)
-            # Temporarily update elements for rendering
-            temp_template = template.copy()
-            temp_template["elements"] = elements_override
-            output_path = await render_service.render_with_template(temp_template, data_dict, template_id)
-        else:
-            # Use saved template (existing method)
-            output_path = await render_service.render(template_id, data_dict)
+        if profile:
+            if elements_override is not None:
+                temp_template = template.copy()
+                temp_template["elements"] = elements_override
+                report = await render_executor.profile(temp_template, data_dict, template_id)
+            else:
+                report = await render_executor.profile(template, data_dict, template_id, cache_plan=True)
+            logger.info("Render profiled", extra={
+                "template_id": template_id, "username": current_user["username"],
+                "render_seconds": round(report["render_seconds"], 4),
+            })
+            return JSONResponse(report)
         
-        return FileResponse(
-            output_path,
+        # Identical request already rendered: serve cached result
+        cache_key = result_cache_key(template, UPLOADS_DIR / f"{template_id}.pdf", data_dict, elements_override)
+        pdf_bytes = await asyncio.to_thread(result_cache.get, cache_key)
+        cache_status = "hit"
+        
+        if pdf_bytes is None:
+            cache_status = "miss"
+            if elements_override is not None:
+                # Use temporary template (when elements are provided)
+                # Temporarily update elements for rendering
+                temp_template = template.copy()
+                temp_template["elements"] = elements_override
+                pdf_bytes = await render_executor.render(temp_template, data_dict, template_id)
+            else:
+                # Use saved template (compiled render plan is cached per version)
+                pdf_bytes = await render_executor.render(template, data_dict, template_id, cache_plan=True)
+            await asyncio.to_thread(result_cache.put, cache_key, pdf_bytes)
+        render_metrics.observe_request("render", cache_status, time.perf_counter() - started)
+        
+        # Rendered in memory - send bytes directly (no file on disk)
+        return Response(
+            content=pdf_bytes,
             media_type="application/pdf",
-            filename=f"rendered_{template_id}.pdf"
+            headers={
+                "Content-Disposition": f'attachment; filename="rendered_{template_id}.pdf"',
+                "X-Render-Cache": cache_status,
+            }
+        )
+    except RenderPoolSaturated as e:
+        raise HTTPException(status_code=503, detail="Render queue is full, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ===== Batch PDF Rendering =====
+@app.post(
+    "/api/render/{template_id}/batch",
+    response_class=Response,
+    summary="Generate PDFs for Many Records",
+    description="""
+    Render many data records against one template in a single call.
+    
+    The template, render plan, fonts and template PDF resources are loaded once and
+    reused for every record.
+    
+    - `format: "pdf"` returns one PDF with the rendered pages of all records in order
+    - `format: "zip"` returns a ZIP archive with one PDF per record
+    """,
+    tags=["PDF Rendering"]
+)
+async def render_pdf_batch(
+    template_id: str,
+    request: BatchRenderRequest,
+    current_user: Dict = Depends(require_auth)
+):
+    """Generate completed PDFs for a list of data records (authentication required)"""
+    started = time.perf_counter()
+    try:
+        # Verify template ownership
+        template = template_service.get_template(template_id)
+        if not template:
+            raise HTTPException(status_code=404, detail="Template not found")
+        
+        if template.get("user_id") != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        if request.format not in ("pdf", "zip"):
+            raise HTTPException(status_code=400, detail="format must be 'pdf' or 'zip'")
+        if not request.records:
+            raise HTTPException(status_code=400, detail="records must not be empty")
+        if len(request.records) > BATCH_MAX_RECORDS:
+            raise HTTPException(status_code=400, detail=f"Too many records (max {BATCH_MAX_RECORDS})")
+        
+        cache_key = result_cache_key(template, UPLOADS_DIR / f"{template_id}.pdf", request.records,
+                                     output_format=f"batch-{request.format}")
+        output = await asyncio.to_thread(result_cache.get, cache_key)
+        cache_status = "hit"
+        if output is None:
+            cache_status = "miss"
+            output = await render_executor.render_batch(
+                template, request.records, template_id, request.format, cache_plan=True
+            )
+            await asyncio.to_thread(result_cache.put, cache_key, output)
+        render_metrics.observe_request("batch", cache_status, time.perf_counter() - started)
+        
+        if request.format == "zip":
+            media_type = "application/zip"
+            filename = f"rendered_{template_id}.zip"
+        else:
+            media_type = "application/pdf"
+            filename = f"rendered_{template_id}.pdf"
+        
+        return Response(
+            content=output,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Render-Cache": cache_status}
         )
+    except RenderPoolSaturated as e:
+        raise HTTPException(status_code=503, detail="Render queue is full, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ===== Asynchronous Render Jobs =====
+def _job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public job information"""
+    return {
+        "job_id": job["job_id"],
+        "template_id": job["template_id"],
+        "status": job["status"],
+        "format": job["format"],
+        "total": job["total"],
+        "done": job["done"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "status_url": f"/api/jobs/{job['job_id']}",
+        "result_url": f"/api/jobs/{job['job_id']}/result",
+    }
+
+
+def _get_user_job(job_id: str, current_user: Dict) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["user_id"] != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
+
+@app.post("/api/jobs/render/{template_id}", status_code=202, tags=["PDF Rendering"])
+async def create_render_job(template_id: str, request: RenderJobRequest, current_user: Dict = Depends(require_auth)):
+    """Queue a render job and return its id immediately (authentication required)
+    
+    Use for renders that take longer than a request may stay open (large repeat
+    tables, many records). Poll `status_url` and download from `result_url` when
+    the status is `done`.
+    """
+    template = template_service.get_template(template_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    if template.get("user_id") != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if request.format not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail="format must be 'pdf' or 'zip'")
+    if (request.data is None) == (request.records is None):
+        raise HTTPException(status_code=400, detail="Provide either data or records")
+    
+    records = request.records if request.records is not None else [request.data]
+    if not records:
+        raise HTTPException(status_code=400, detail="records must not be empty")
+    if len(records) > BATCH_MAX_RECORDS:
+        raise HTTPException(status_code=400, detail=f"Too many records (max {BATCH_MAX_RECORDS})")
+    
+    job = job_queue.create(current_user["user_id"], template_id, records, request.format, request.elements)
+    job_runner.notify()
+    return _job_response(job)
+
+
+@app.get("/api/jobs/{job_id}", tags=["PDF Rendering"])
+async def get_render_job(job_id: str, current_user: Dict = Depends(require_auth)):
+    """Render job status and progress (authentication required)"""
+    return _job_response(_get_user_job(job_id, current_user))
+
+
+@app.get("/api/jobs/{job_id}/result", tags=["PDF Rendering"])
+async def get_render_job_result(job_id: str, current_user: Dict = Depends(require_auth)):
+    """Download finished render job output (authentication required)"""
+    job = _get_user_job(job_id, current_user)
+    if job["status"] != JOB_DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    result_path = Path(job["result_path"])
+    if not result_path.exists():
+        raise HTTPException(status_code=404, detail="Job result not found")
+    
+    if job["format"] == "zip":
+        media_type = "application/zip"
+    else:
+        media_type = "application/pdf"
+    return FileResponse(
+        result_path,
+        media_type=media_type,
+        filename=f"rendered_{job['template_id']}{result_path.suffix}"
+    )
+
+
 # ===== Delete Template =====
 @app.delete("/api/templates/{template_id}")
 async def delete_template(template_id: str, current_user: Dict = Depends(require_auth)):
@@ -515,14 +1077,12 @@ async def delete_template(template_id: str, current_user: Dict = Depends(require
         
         template_service.delete_template(template_id)
         pdf_path = UPLOADS_DIR / f"{template_id}.pdf"
-        if pdf_path.exists():
-            pdf_path.unlink()
+        template_pdf_cache.invalidate(pdf_path)
+        # Shared PDF content is deleted with its last template
+        blob_store.release(pdf_path, template.get("pdf_sha256"))
         
-        # Also delete preview images
-        preview_dir = UPLOADS_DIR / "previews"
-        if preview_dir.exists():
-            for preview_file in preview_dir.glob(f"{template_id}_*.png"):
-                preview_file.unlink()
+        # Also delete preview images (all sizes, formats and tiles)
+        pdf_service.delete_previews(pdf_path)
         
         return {"status": "success"}
     except HTTPException:
@@ -544,23 +1104,21 @@ async def delete_all_templates(current_user: Dict = Depends(require_auth)):
             template_id = template.get("template_id")
             if template_id:
                 try:
+                    # Summaries have no pdf_sha256; without it release() would hash the file
+                    template = template_service.get_template(template_id) or {}
                     template_service.delete_template(template_id)
                     pdf_path = UPLOADS_DIR / f"{template_id}.pdf"
-                    if pdf_path.exists():
-                        pdf_path.unlink()
+                    template_pdf_cache.invalidate(pdf_path)
+                    blob_store.release(pdf_path, template.get("pdf_sha256"))
                     deleted_count += 1
                 except:
                     pass
         
-        # Clean up preview directory (only current user's templates)
-        preview_dir = UPLOADS_DIR / "previews"
-        if preview_dir.exists():
-            # Delete preview files based on template ID list
-            for template in templates:
-                template_id = template.get("template_id")
-                if template_id:
-                    for preview_file in preview_dir.glob(f"{template_id}_*.png"):
-                        preview_file.unlink()
+        # Clean up preview images (only current user's templates)
+        for template in templates:
+            template_id = template.get("template_id")
+            if template_id:
+                pdf_service.delete_previews(UPLOADS_DIR / f"{template_id}.pdf")
         
         return {"status": "success", "deleted_count": deleted_count}
     except Exception as e:
@@ -581,18 +1139,33 @@ async def upload_image(file: UploadFile = File(...), current_user: Dict = Depend
         ext = Path(file.filename).suffix if file.filename else '.png'
         image_path = IMAGES_DIR / f"{image_id}{ext}"
         
-        with open(image_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Streamed in chunks; identical images are stored once
+        await asyncio.to_thread(blob_store.store, file.file, image_path, IMAGE_UPLOAD_MAX_BYTES)
         
         # Return relative path (uploads/images/image_id.ext)
         relative_path = f"images/{image_id}{ext}"
         
         return {"image_path": relative_path, "image_id": image_id}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ===== Metrics =====
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Render metrics in Prometheus text format (requires METRICS_TOKEN)"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled (METRICS_TOKEN is not set)")
+    if not secrets.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    content = await asyncio.to_thread(render_metrics.registry.render)
+    return Response(content=content, media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/")
 async def root():
     return {"message": "PDF Template Automation Engine API", "version": "1.0.0"}
@@ -1,10 +1,14 @@
-import json
 import hashlib
+import logging
 from pathlib import Path
 from typing import Dict, Optional
 from datetime import datetime
 from jose import JWTError, jwt
-import bcrypt
+
+from app.services.password_hasher import PasswordHasher
+from app.services.storage import FileUserStore, UserStore
+
+logger = logging.getLogger(__name__)
 
 # bcrypt rounds (default: 12)
 BCRYPT_ROUNDS = 12
@@ -17,78 +21,41 @@ ALGORITHM = "HS256"
 class AuthService:
     """Authentication and user management service"""
     
-    def __init__(self, users_dir: Path):
+    def __init__(self, users_dir: Path, store: Optional[UserStore] = None, trust_token_claims: bool = False,
+                 max_cached_identities: int = 10000, hasher: Optional[PasswordHasher] = None):
         self.users_dir = users_dir
-        self.users_dir.mkdir(parents=True, exist_ok=True)
-        self.users_file = users_dir / "users.json"
-        self._ensure_users_file()
-    
-    def _ensure_users_file(self):
-        """Create users file if it doesn't exist"""
-        if not self.users_file.exists():
-            with open(self.users_file, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-    
-    def _load_users(self) -> Dict:
-        """Load user list"""
-        with open(self.users_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    
-    def _save_users(self, users: Dict):
-        """Save user list"""
-        with open(self.users_file, "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
-    
-    def _hash_password(self, password: str) -> str:
-        """Hash password (auto truncate if exceeds 72 bytes) - using bcrypt directly"""
-        # Encode to UTF-8 bytes
-        password_bytes = password.encode('utf-8')
-        # Auto truncate if exceeds 72 bytes (bcrypt limit)
-        if len(password_bytes) > 72:
-            password_bytes = password_bytes[:72]
-        
-        # Hash with bcrypt (using bytes directly)
-        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
-        hashed = bcrypt.hashpw(password_bytes, salt)
-        # Return as string (bcrypt hash is always ASCII)
-        return hashed.decode('ascii')
-    
-    def _verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify password (auto truncate if exceeds 72 bytes) - using bcrypt directly"""
-        # Encode to UTF-8 bytes
-        password_bytes = plain_password.encode('utf-8')
-        # Auto truncate if exceeds 72 bytes (bcrypt limit)
-        if len(password_bytes) > 72:
-            password_bytes = password_bytes[:72]
-        
-        # Verify with bcrypt (using bytes directly)
-        hashed_bytes = hashed_password.encode('ascii')
-        return bcrypt.checkpw(password_bytes, hashed_bytes)
+        # Storage backend (default: users/users.json)
+        self.store = store if store is not None else FileUserStore(users_dir)
+        # bcrypt runs in its own bounded thread pool, never on the event loop
+        self.hasher = hasher if hasher is not None else PasswordHasher(rounds=BCRYPT_ROUNDS)
+        # Take user_id/email from a valid token instead of looking the user up
+        self.trust_token_claims = trust_token_claims
+        # Identities of recently authenticated users (dropped when the user store changes)
+        self.max_cached_identities = max_cached_identities
+        self._identities: Dict[str, Dict] = {}
+        self._identities_version = None
     
-    def register_user(self, username: str, email: str, password: str) -> Dict:
+    async def register_user(self, username: str, email: str, password: str) -> Dict:
         """Register user"""
-        users = self._load_users()
-        
-        # Check for duplicates
-        if username in users:
+        # Check for duplicates (checked again atomically by the store)
+        if self.store.get_user(username):
             raise ValueError("Username already exists")
         
         # Check email duplicates
-        for user_data in users.values():
-            if user_data.get("email") == email:
-                raise ValueError("Email already exists")
+        if self.store.get_user_by_email(email):
+            raise ValueError("Email already exists")
         
         # Create new user
         user_id = str(hashlib.md5(username.encode()).hexdigest())
-        users[username] = {
+        hashed_password = await self.hasher.hash_async(password)
+        self.store.add_user({
             "user_id": user_id,
             "username": username,
             "email": email,
-            "hashed_password": self._hash_password(password),
+            "hashed_password": hashed_password,
             "created_at": datetime.now().isoformat(),
-        }
-        
-        self._save_users(users)
+        })
+        self._identities_version = None
         
         return {
             "user_id": user_id,
@@ -96,17 +63,22 @@ class AuthService:
             "email": email,
         }
     
-    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
-        """Authenticate user"""
-        users = self._load_users()
-        
-        if username not in users:
+    async def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
+        """Authenticate user (rehashes the password if BCRYPT_ROUNDS changed since it was hashed)"""
+        user = self.store.get_user(username)
+        if user is None:
             return None
         
-        user = users[username]
-        if not self._verify_password(password, user["hashed_password"]):
+        if not await self.hasher.verify_async(password, user["hashed_password"]):
             return None
         
+        if self.hasher.needs_rehash(user["hashed_password"]):
+            try:
+                self.store.update_password(username, await self.hasher.hash_async(password))
+            except Exception as e:
+                # Login still succeeds with the old hash
+                logger.warning("Password rehash failed", extra={"username": username, "error": str(e)})
+        
         return {
             "user_id": user["user_id"],
             "username": user["username"],
@@ -115,8 +87,40 @@ class AuthService:
     
     def get_user(self, username: str) -> Optional[Dict]:
         """Get user information"""
-        users = self._load_users()
-        return users.get(username)
+        return self.store.get_user(username)
+    
+    def get_identity(self, username: str) -> Optional[Dict]:
+        """user_id, username and email of a user (cached until the user store changes)"""
+        version = self.store.users_version()
+        if version != self._identities_version or len(self._identities) >= self.max_cached_identities:
+            self._identities = {}
+            self._identities_version = version
+        
+        identity = self._identities.get(username)
+        if identity is None:
+            user = self.store.get_user(username)
+            if not user:
+                return None
+            identity = self._identities[username] = {
+                "user_id": user["user_id"],
+                "username": user["username"],
+                "email": user["email"],
+            }
+        return dict(identity)
+    
+    def user_from_token(self, token: str) -> Optional[Dict]:
+        """Current user of a JWT access token (None if the token or user is invalid)"""
+        payload = self.verify_token(token)
+        if not payload or not payload.get("sub"):
+            return None
+        if self.trust_token_claims and payload.get("user_id") and "email" in payload:
+            # Signed claims are taken as is (no user lookup)
+            return {
+                "user_id": payload["user_id"],
+                "username": payload["sub"],
+                "email": payload["email"],
+            }
+        return self.get_identity(payload["sub"])
     
     def create_access_token(self, data: Dict) -> str:
         """Create JWT access token"""
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+
+# Read/write/hash uploads in pieces of this size
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the size limit"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File is too large (limit: {max_bytes // (1024 * 1024)} MB)")
+        self.max_bytes = max_bytes
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed storage of uploaded files
+
+    Every distinct file content is stored once as blobs/{sha[:2]}/{sha}. The
+    per-template/per-image paths the rest of the app uses (uploads/{id}.pdf,
+    uploads/images/{id}.png) are hard links to the blob, so the link count
+    of the blob is its reference count: a blob whose only remaining link is
+    itself is no longer used and is deleted. If hard links are not supported
+    the file is copied instead (no sharing, same behaviour otherwise).
+    """
+
+    def __init__(self, blobs_dir: Path):
+        self.blobs_dir = blobs_dir
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+
+    def adopt(self, old_dir: Path):
+        """Move blobs from an earlier blobs directory here
+
+        Blobs that can't be moved (another filesystem) are dropped from the
+        old directory: the paths linking to them keep their content, they
+        just no longer share it with new uploads.
+        """
+        if not old_dir.is_dir():
+            return
+        for blob in old_dir.glob("??/*"):
+            target = self.blob_path(blob.name)
+            try:
+                target.parent.mkdir(exist_ok=True)
+                if target.exists():
+                    blob.unlink()
+                else:
+                    os.rename(blob, target)
+            except OSError:
+                blob.unlink(missing_ok=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / sha256
+
+    def store(self, source: BinaryIO, target: Path, max_bytes: Optional[int] = None) -> Tuple[str, int, bool]:
+        """Stream source into target (hashing along the way), sharing content with earlier uploads
+
+        Returns (sha256, size, deduplicated). Raises UploadTooLarge when more
+        than max_bytes are read; nothing is stored then.
+        """
+        tmp_path = self.blobs_dir / f"upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise UploadTooLarge(max_bytes)
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            deduplicated = self._link(tmp_path, sha256, target)
+            return sha256, size, deduplicated
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _link(self, tmp_path: Path, sha256: str, target: Path) -> bool:
+        """Point target at the blob for sha256 (creating it from tmp_path if new)"""
+        blob = self.blob_path(sha256)
+        blob.parent.mkdir(exist_ok=True)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(3):
+            try:
+                os.link(tmp_path, blob)
+                existed = False
+            except FileExistsError:
+                existed = True
+            except OSError:
+                # No hard links on this filesystem
+                shutil.copyfile(tmp_path, target)
+                return False
+            try:
+                os.link(blob, target)
+                return existed
+            except FileNotFoundError:
+                # Blob was released by a concurrent delete - create it again
+                continue
+            except OSError:
+                shutil.copyfile(tmp_path, target)
+                return False
+        shutil.copyfile(tmp_path, target)
+        return False
+
+    def release(self, target: Path, sha256: Optional[str] = None):
+        """Delete target and its blob if no other path uses the blob any more"""
+        try:
+            st = target.stat()
+        except FileNotFoundError:
+            return
+        if st.st_nlink > 1 and sha256 is None:
+            sha256 = file_sha256(target)
+        target.unlink(missing_ok=True)
+        if sha256 is None:
+            return
+        blob = self.blob_path(sha256)
+        try:
+            blob_st = blob.stat()
+        except FileNotFoundError:
+            return
+        if blob_st.st_ino == st.st_ino and blob_st.st_nlink == 1:
+            blob.unlink(missing_ok=True)
+
+    def collect(self) -> int:
+        """Delete blobs no path links to any more (e.g. after a crash), returns number deleted"""
+        deleted = 0
+        for blob in self.blobs_dir.glob("??/*"):
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+        # Leftovers of interrupted uploads (recent ones may still be written by another process)
+        for tmp_path in self.blobs_dir.glob("upload-*.tmp"):
+            try:
+                if tmp_path.stat().st_mtime < time.time() - 3600:
+                    tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+        return deleted
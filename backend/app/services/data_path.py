@@ -0,0 +1,97 @@
+import re
+from functools import lru_cache
+from typing import Any, Tuple, Union
+
+# Returned by DataPath.resolve when the path does not exist in the data
+MISSING = object()
+
+# One path segment: key, [index] or ["quoted key"]
+_SEGMENT_RE = re.compile(r'\.?([^.\[\]]+)|\[(-?\d+)\]|\[\s*(["\'])(.*?)\3\s*\]')
+
+
+def _parse(path: str) -> Tuple[Union[str, int], ...]:
+    """Split data path into keys and list indexes
+
+    "customer.name" -> ("customer", "name")
+    "items[0].price" -> ("items", 0, "price")
+    'meta["a.b"]' -> ("meta", "a.b")
+    """
+    steps = []
+    pos = 0
+    while pos < len(path):
+        match = _SEGMENT_RE.match(path, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"Invalid data path: {path}")
+        key, index, _, quoted = match.groups()
+        if index is not None:
+            steps.append(int(index))
+        elif quoted is not None:
+            steps.append(quoted)
+        elif key.isdigit():
+            steps.append(int(key))  # "items.0.price" is the same as "items[0].price"
+        else:
+            steps.append(key)
+        pos = match.end()
+    return tuple(steps)
+
+
+class DataPath:
+    """Compiled data path accessor (parsed once, resolved per record)"""
+
+    __slots__ = ("path", "steps")
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            self.steps = _parse(path) if path else ()
+        except ValueError:
+            # Malformed path: plain dot split (resolves to nothing rather than failing the render)
+            self.steps = tuple(path.split("."))
+
+    def __bool__(self) -> bool:
+        return bool(self.steps)
+
+    def __repr__(self) -> str:
+        return f"DataPath({self.path!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DataPath) and other.path == self.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def resolve(self, data: Any, default: Any = None) -> Any:
+        """Get value from data (default if the path does not exist or a value on the way is None)
+
+        A None value at the end of the path is returned as None.
+        """
+        if not self.steps:
+            return default
+
+        value = data
+        for step in self.steps:
+            if type(step) is int:
+                if isinstance(value, list):
+                    if -len(value) <= step < len(value):
+                        value = value[step]
+                    else:
+                        return default
+                elif isinstance(value, dict):
+                    value = value.get(str(step), MISSING)  # Numeric object key
+                else:
+                    return default
+            elif isinstance(value, dict):
+                value = value.get(step, MISSING)
+            else:
+                return default
+
+            if value is MISSING:
+                return default
+
+        return value
+
+
+@lru_cache(maxsize=4096)
+def compile_data_path(path: str) -> DataPath:
+    """Shared compiled accessor for a data path string"""
+    return DataPath(path or "")
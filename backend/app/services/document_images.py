@@ -0,0 +1,111 @@
+import re
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from app.services.pdf_cache import FileBytesCache
+
+_REFERENCE = re.compile(r"\b(\d+) 0 R\b")
+
+
+class EncodedImageObject(NamedTuple):
+    """One PDF object of an encoded image (the image itself, its SMask, ...)"""
+    xref: int  # Object number in the holder document (referenced by the other objects)
+    objdef: str
+    stream: Optional[bytes]  # Raw (still encoded) stream, None for plain objects
+    stream_keys: Tuple[Tuple[str, str], ...]  # Filter/DecodeParms of the stream
+
+
+class EncodedImage(NamedTuple):
+    """An image file decoded and encoded as PDF objects, ready to be copied into documents"""
+    xref: int  # Image XObject among objects
+    objects: Tuple[EncodedImageObject, ...]
+
+
+class EncodedImageCache(FileBytesCache):
+    """Bounded LRU cache of images encoded as PDF objects
+
+    Decoding an image file and encoding it as an image XObject (with its
+    transparency mask) is the expensive part of insert_image. It is done once
+    per process per file version; documents then get a copy of the encoded
+    objects. Entries are keyed and validated like FileBytesCache (path +
+    mtime/size), sizes count the encoded streams.
+    """
+
+    def get_image(self, path: Path) -> EncodedImage:
+        """Return the encoded image of a file (from cache if file is unchanged)"""
+        return self._get(path)
+
+    def _load(self, path: Path) -> Tuple[EncodedImage, int]:
+        holder = fitz.open()
+        try:
+            page = holder.new_page()
+            page.insert_image(page.rect, filename=str(path))
+            # Round trip so that objects hold their final (compressed) streams
+            holder = fitz.open("pdf", holder.tobytes(garbage=3, deflate=True))
+            root = holder[0].get_images(full=True)[0][0]
+            objects: List[EncodedImageObject] = []
+            pending, seen = [root], {root}
+            while pending:
+                xref = pending.pop()
+                objdef = holder.xref_object(xref, compressed=True)
+                for ref in map(int, _REFERENCE.findall(objdef)):
+                    if ref not in seen:
+                        seen.add(ref)
+                        pending.append(ref)
+                stream, stream_keys = None, ()
+                if holder.xref_is_stream(xref):
+                    stream = holder.xref_stream_raw(xref)
+                    stream_keys = tuple(
+                        (key, value) for key in ("Filter", "DecodeParms")
+                        for kind, value in [holder.xref_get_key(xref, key)] if kind != "null"
+                    )
+                objects.append(EncodedImageObject(xref, objdef, stream, stream_keys))
+        finally:
+            holder.close()
+        size = sum(len(obj.objdef) + len(obj.stream or b"") for obj in objects)
+        return EncodedImage(root, tuple(objects)), size
+
+
+class DocumentImages:
+    """Tracks images embedded in one output document
+
+    The first placement of an image file copies its encoded objects from the
+    process-wide image cache into the document (no decoding or re-encoding);
+    later placements on any page of the same document reference the embedded
+    image by xref.
+    """
+
+    def __init__(self, image_cache: EncodedImageCache, doc: fitz.Document):
+        self.image_cache = image_cache
+        self.doc = doc
+        self._xrefs: Dict[str, int] = {}  # Image file path -> image xref in doc
+
+    def insert(self, page: fitz.Page, rect: fitz.Rect, file_path: Path) -> int:
+        """Place image on page (embed on first use only), returns image xref"""
+        key = str(file_path)
+        xref = self._xrefs.get(key)
+        if xref is None:
+            xref = self._xrefs[key] = self._embed(self.image_cache.get_image(file_path))
+        page.insert_image(rect, xref=xref)
+        return xref
+
+    def _embed(self, image: EncodedImage) -> int:
+        """Copy encoded image objects into the document, returns the image xref"""
+        doc = self.doc
+        numbers: Dict[int, int] = {obj.xref: doc.get_new_xref() for obj in image.objects}
+
+        def renumber(match: Any) -> str:
+            ref = int(match.group(1))
+            return f"{numbers.get(ref, ref)} 0 R"
+
+        for obj in image.objects:
+            xref = numbers[obj.xref]
+            doc.update_object(xref, _REFERENCE.sub(renumber, obj.objdef))
+            if obj.stream is not None:
+                # Raw copy: update_stream drops the filter keys, which still apply to the data
+                doc.update_stream(xref, obj.stream, compress=False)
+                for name, value in obj.stream_keys:
+                    doc.xref_set_key(xref, name, value)
+        return numbers[image.xref]
@@ -0,0 +1,125 @@
+from functools import lru_cache
+from typing import Dict, FrozenSet, Mapping, Optional, Tuple
+
+from app.services.font_registry import FontRegistry
+
+# Script keys used for font candidates
+SCRIPT_JAPANESE = "japanese"
+SCRIPT_KOREAN = "korean"
+SCRIPT_UNICODE = "unicode"  # Other non-ASCII text
+SCRIPT_ASCII = "ascii"
+
+# Script codes in detection priority order (a string's script is its highest code)
+_SCRIPT_CODES = (SCRIPT_ASCII, SCRIPT_UNICODE, SCRIPT_KOREAN, SCRIPT_JAPANESE)
+_CODE_ASCII, _CODE_UNICODE, _CODE_KOREAN, _CODE_JAPANESE = range(4)
+
+# Codepoint ranges per script (everything else above ASCII is SCRIPT_UNICODE)
+SCRIPT_RANGES = [
+    (0x1100, 0x11FF, SCRIPT_KOREAN),  # Hangul Jamo
+    (0x3040, 0x309F, SCRIPT_JAPANESE),  # Hiragana
+    (0x30A0, 0x30FF, SCRIPT_JAPANESE),  # Katakana
+    (0x3130, 0x318F, SCRIPT_KOREAN),  # Hangul Compatibility Jamo
+    (0x4E00, 0x9FAF, SCRIPT_JAPANESE),  # CJK Unified Ideographs (Kanji)
+    (0xAC00, 0xD7A3, SCRIPT_KOREAN),  # Hangul Syllables
+    (0xFF65, 0xFF9F, SCRIPT_JAPANESE),  # Halfwidth Katakana
+]
+
+FontChoice = Tuple[Optional[str], bool]  # (font name, simulate bold)
+TextRun = Tuple[str, Optional[str], bool]  # (text, font name, simulate bold)
+
+
+def _build_script_table() -> str:
+    """BMP codepoint -> script code, as a str.translate table (one C-level pass per string)"""
+    table = bytearray([_CODE_UNICODE]) * 0x10000
+    table[:0x80] = bytes([_CODE_ASCII]) * 0x80
+    for start, end, script in SCRIPT_RANGES:
+        code = _SCRIPT_CODES.index(script)
+        table[start:end + 1] = bytes([code]) * (end - start + 1)
+    return table.decode("latin-1")
+
+
+_SCRIPT_TABLE = _build_script_table()
+
+
+def _script_codes(text: str) -> str:
+    """Script code of every character (codepoints beyond the BMP count as other Unicode)"""
+    codes = text.translate(_SCRIPT_TABLE)
+    if max(codes) > "\x03":
+        # Characters outside the BMP are not in the table and come back unchanged
+        codes = "".join(c if c <= "\x03" else "\x01" for c in codes)
+    return codes
+
+
+def detect_script(text: str) -> str:
+    """Language detection for font selection (Japanese > Korean > other Unicode > ASCII)"""
+    if not text or text.isascii():
+        return SCRIPT_ASCII
+    return _SCRIPT_CODES[ord(max(_script_codes(text)))]
+
+
+class FontFallback:
+    """Font selection for one set of per-script font choices
+
+    The string's script picks the primary font (as before). Characters the
+    primary font has no glyph for fall back to the font chosen for their own
+    script, then to any registered font that covers them. Consecutive
+    characters with the same font form one run. Results are memoized, so
+    repeated values (e.g. table column values) are split only once.
+    """
+
+    def __init__(self, registry: FontRegistry, choices: Mapping[str, FontChoice], memo_size: int = 4096):
+        self.registry = registry
+        self.choices = choices
+        self.runs = lru_cache(maxsize=memo_size)(self._split)
+
+    def __getitem__(self, script: str) -> FontChoice:
+        return self.choices[script]
+
+    def _split(self, text: str) -> Tuple[TextRun, ...]:
+        """Split text into runs, each drawn with one font"""
+        if not text or text.isascii():
+            return ((text,) + self.choices[SCRIPT_ASCII],)
+
+        codes = _script_codes(text)
+        primary = self.choices[_SCRIPT_CODES[ord(max(codes))]]
+        primary_coverage = self.registry.coverage(primary[0])
+        if primary_coverage is None or primary_coverage.issuperset(map(ord, text)):
+            # No font to fall back from, or primary font covers everything
+            return ((text,) + primary,)
+
+        runs = []
+        run_start = 0
+        run_choice = None
+        for i, char in enumerate(text):
+            choice = self._choose(char, codes[i], primary, primary_coverage)
+            if choice != run_choice:
+                if run_choice is not None:
+                    runs.append((text[run_start:i],) + run_choice)
+                run_start = i
+                run_choice = choice
+        runs.append((text[run_start:],) + run_choice)
+        return tuple(runs)
+
+    def _choose(self, char: str, code: str, primary: FontChoice, primary_coverage: FrozenSet[int]) -> FontChoice:
+        cp = ord(char)
+        if cp in primary_coverage:
+            return primary
+        # Font chosen for the character's own script
+        own = self.choices[_SCRIPT_CODES[ord(code)]]
+        own_coverage = self.registry.coverage(own[0])
+        if own_coverage is not None and cp in own_coverage:
+            return own
+        # Any registered font with the glyph
+        for font_name in self.registry.names:
+            if cp in self.registry.coverage(font_name):
+                return (font_name, primary[1])
+        return primary  # No font has the glyph
+
+
+def font_fallback(registry: FontRegistry, choices: Dict[str, FontChoice]) -> FontFallback:
+    """Shared FontFallback for the given font choices (memo is shared by all plans using them)"""
+    key = tuple(sorted(choices.items()))
+    fallback = registry.fallbacks.get(key)
+    if fallback is None:
+        fallback = registry.fallbacks[key] = FontFallback(registry, choices)
+    return fallback
@@ -0,0 +1,263 @@
+import io
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Set
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Glyph subsetting uses fontTools (optional dependency)
+try:
+    from fontTools.subset import Options as SubsetOptions, Subsetter
+    from fontTools.ttLib import TTFont
+    HAS_FONTTOOLS = True
+except ImportError:
+    HAS_FONTTOOLS = False
+
+# Subset font files kept per (font, codepoints): the same template mostly draws the same characters
+SUBSET_CACHE_SIZE = 64
+
+
+# Registered font name -> candidate file names in the font directory (first match wins)
+FONT_CANDIDATES = [
+    # Japanese fonts (priority: MS Gothic > MS Mincho > Noto Sans JP)
+    # MS Gothic (ゴシック体) - Most common in Japanese government documents
+    ("MSGothic", ["msgothic.ttc", "msgothic.ttf", "MS-Gothic.ttf", "msgothic.otf"]),
+    # MS Mincho (明朝体) - For formal documents
+    ("MSMincho", ["msmincho.ttc", "msmincho.ttf", "MS-Mincho.ttf", "msmincho.otf"]),
+    # Noto Sans JP (fallback for Japanese)
+    ("NotoSansJP", ["NotoSansJP-VF.ttf"]),
+    ("NotoSansJP-Bold", ["NotoSansJP-Bold.ttf"]),
+    # Korean fonts (priority: Malgun Gothic > Nanum Gothic > Noto Sans KR)
+    # Malgun Gothic (맑은 고딕) - Windows default, common in Korean documents
+    ("MalgunGothic", ["malgun.ttf", "malgun.ttc", "malgun.otf", "Malgun-Gothic.ttf"]),
+    # Nanum Gothic (나눔고딕) - Common in public institutions
+    ("NanumGothic", ["NanumGothic.ttf", "NanumGothic-Regular.ttf", "NanumGothic.otf"]),
+    # Noto Sans KR (fallback for Korean)
+    ("NotoSansKR", ["NotoSansKR-VF.ttf"]),
+    ("NotoSansKR-Bold", ["NotoSansKR-Bold.ttf"]),
+    ("NanumGothic-Bold", ["NanumGothic-Bold.ttf"]),
+]
+
+
+class FontRegistry:
+    """Process-wide font registry (font files are found and loaded once)
+
+    Holds loaded fitz.Font objects by registered font name. Fonts are not
+    embedded anywhere until a document actually draws text with them
+    (see DocumentFonts).
+    """
+
+    def __init__(self, fonts_dir: Path):
+        self.fonts_dir = fonts_dir
+        self.paths: Dict[str, Path] = {}  # Font name -> font file path
+        self.fonts: Dict[str, fitz.Font] = {}  # Font name -> loaded font
+        self._buffers: Dict[str, bytes] = {}  # Font name -> font file bytes (for embedding)
+        self._coverage: Dict[str, FrozenSet[int]] = {}  # Font name -> codepoints with a glyph (built on first use)
+        self.fallbacks: Dict[Any, Any] = {}  # Shared FontFallback objects (see font_fallback.font_fallback)
+        self._advances: Dict[Optional[str], Dict[int, float]] = {}  # Font name -> glyph advance by codepoint (None: Helvetica)
+        self._helv: Optional[fitz.Font] = None
+        # Width at font size 1 per (font, text): aligned values such as totals repeat a lot
+        self._unit_length = lru_cache(maxsize=16384)(self._measure)
+        self._subset = lru_cache(maxsize=SUBSET_CACHE_SIZE)(self._build_subset)
+        self._load()
+
+    def _load(self):
+        """Find font files in font directory and load them"""
+        if not self.fonts_dir.exists():
+            return
+
+        for font_name, file_names in FONT_CANDIDATES:
+            for file_name in file_names:
+                font_path = self.fonts_dir / file_name
+                if not font_path.exists():
+                    continue
+                try:
+                    font = fitz.Font(fontfile=str(font_path))
+                    self.paths[font_name] = font_path
+                    self.fonts[font_name] = font
+                    self._buffers[font_name] = font.buffer
+                    logger.info("Font loaded", extra={"font": font_name, "path": str(font_path)})
+                except Exception as e:
+                    logger.warning("Font load failed", extra={"font": font_name, "error": str(e)})
+                break
+
+    def __contains__(self, font_name: str) -> bool:
+        return font_name in self.fonts
+
+    def __bool__(self) -> bool:
+        return bool(self.fonts)
+
+    @property
+    def names(self) -> List[str]:
+        """Registered font names (in registration priority order)"""
+        return list(self.fonts.keys())
+
+    def get_font(self, font_name: str) -> Optional[fitz.Font]:
+        """Return loaded font by registered name"""
+        return self.fonts.get(font_name)
+
+    def get_buffer(self, font_name: str) -> Optional[bytes]:
+        """Return font file bytes by registered name"""
+        return self._buffers.get(font_name)
+
+    def coverage(self, font_name: Optional[str]) -> Optional[FrozenSet[int]]:
+        """Codepoints the font has glyphs for (None if font is not registered)"""
+        coverage = self._coverage.get(font_name)
+        if coverage is None:
+            font = self.fonts.get(font_name) if font_name else None
+            if font is None:
+                return None
+            coverage = self._coverage[font_name] = frozenset(font.valid_codepoints())
+        return coverage
+
+    def text_length(self, text: str, font_name: Optional[str], font_size: float) -> float:
+        """Measure text width with a registered font (Helvetica if font_name is None)"""
+        if font_name not in self.fonts:
+            font_name = None
+        return self._unit_length(font_name, text) * font_size
+
+    def _font_or_helv(self, font_name: Optional[str]) -> fitz.Font:
+        if font_name is not None:
+            return self.fonts[font_name]
+        if self._helv is None:
+            self._helv = fitz.Font("helv")
+        return self._helv
+
+    def _measure(self, font_name: Optional[str], text: str) -> float:
+        """Text width at font size 1: sum of glyph advances (looked up once per font and codepoint)"""
+        advances = self._advances.get(font_name)
+        if advances is None:
+            advances = self._advances[font_name] = {}
+        try:
+            return sum(map(advances.__getitem__, map(ord, text)))
+        except KeyError:
+            font = self._font_or_helv(font_name)
+            for cp in set(map(ord, text)).difference(advances):
+                advances[cp] = font.glyph_advance(cp)
+            return sum(map(advances.__getitem__, map(ord, text)))
+
+    def subset_buffer(self, font_name: str, codepoints: FrozenSet[int]) -> Optional[bytes]:
+        """Font file bytes reduced to the glyphs of codepoints (None if it can't be subset)"""
+        if not HAS_FONTTOOLS or font_name not in self._buffers:
+            return None
+        return self._subset(font_name, codepoints)
+
+    def _build_subset(self, font_name: str, codepoints: FrozenSet[int]) -> bytes:
+        buffer = self._buffers[font_name]
+        # Collections (.ttc): MuPDF embeds the first font
+        font = TTFont(io.BytesIO(buffer), fontNumber=0 if buffer[:4] == b"ttcf" else -1, lazy=False)
+        options = SubsetOptions()
+        # Text is drawn with glyph ids (Identity-H): keep every glyph at its id, empty if unused
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.layout_features = []  # Text is not shaped
+        subsetter = Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        output = io.BytesIO()
+        font.save(output)
+        return output.getvalue()
+
+    def for_document(self, doc: fitz.Document) -> "DocumentFonts":
+        """Create font usage tracker for one output document"""
+        return DocumentFonts(self, doc)
+
+
+class DocumentFonts:
+    """Font usage of one output document
+
+    A font is inserted on a page only when text is drawn with it there. MuPDF
+    reuses the same font object for identical font buffers, so each font is
+    embedded once per document; subset() then replaces the embedded font
+    files by subsets holding only the glyphs of the drawn text.
+    """
+
+    def __init__(self, registry: FontRegistry, doc: fitz.Document):
+        self.registry = registry
+        self.doc = doc
+        self._page_fonts: Dict[int, Set[str]] = {}  # Page xref -> font names inserted on that page
+        self._codepoints: Dict[str, Set[int]] = {}  # Font name -> codepoints drawn with it
+
+    def __contains__(self, font_name: str) -> bool:
+        return font_name in self.registry
+
+    def __bool__(self) -> bool:
+        return bool(self.registry)
+
+    @property
+    def names(self) -> List[str]:
+        return self.registry.names
+
+    @property
+    def used(self) -> Set[str]:
+        """Font names used anywhere in the document"""
+        used = set()
+        for names in self._page_fonts.values():
+            used.update(names)
+        return used
+
+    def use(self, page: fitz.Page, font_name: str, text: str = "") -> bool:
+        """Make font available on page (insert on first use only) for drawing text"""
+        page_fonts = self._page_fonts.setdefault(page.xref, set())
+        if font_name in page_fonts:
+            self._codepoints[font_name].update(map(ord, text))
+            return True
+
+        buffer = self.registry.get_buffer(font_name)
+        if buffer is None:
+            return False
+        try:
+            page.insert_font(fontname=font_name, fontbuffer=buffer)
+        except Exception as e:
+            logger.warning("Font registration failed", extra={"font": font_name, "error": str(e)})
+            return False
+        page_fonts.add(font_name)
+        self._codepoints.setdefault(font_name, set()).update(map(ord, text))
+        return True
+
+    def _font_files(self) -> Dict[str, Set[int]]:
+        """Font name -> xrefs of its embedded font file streams"""
+        files: Dict[str, Set[int]] = {}
+        for page in self.doc:
+            names = self._page_fonts.get(page.xref)
+            if not names:
+                continue
+            for xref, _ext, font_type, _basefont, name, _encoding in page.get_fonts():
+                if name in names and font_type == "Type0":
+                    file_xref = self._font_file(xref)
+                    if file_xref:
+                        files.setdefault(name, set()).add(file_xref)
+        return files
+
+    def _font_file(self, font_xref: int) -> int:
+        """FontFile2 stream of a Type0 font (0 if not found)"""
+        kind, descendants = self.doc.xref_get_key(font_xref, "DescendantFonts")
+        if kind != "array" or not descendants.strip("[]").strip():
+            return 0
+        descendant = int(descendants.strip("[]").split()[0])
+        kind, descriptor = self.doc.xref_get_key(descendant, "FontDescriptor")
+        if kind != "xref":
+            return 0
+        kind, font_file = self.doc.xref_get_key(int(descriptor.split()[0]), "FontFile2")
+        return int(font_file.split()[0]) if kind == "xref" else 0
+
+    def subset(self):
+        """Replace embedded fonts by subsets of the glyphs actually drawn
+
+        Done in-process on the registry's font buffers (subsets are cached
+        there), so concurrent renders share no files.
+        """
+        if not self._page_fonts or not HAS_FONTTOOLS:
+            return
+        for font_name, file_xrefs in self._font_files().items():
+            try:
+                data = self.registry.subset_buffer(font_name, frozenset(self._codepoints.get(font_name, ())))
+                if data is None:
+                    continue
+                for file_xref in file_xrefs:
+                    self.doc.update_stream(file_xref, data)
+                    self.doc.xref_set_key(file_xref, "Length1", str(len(data)))
+            except Exception as e:
+                logger.warning("Font subsetting failed", extra={"font": font_name, "error": str(e)})
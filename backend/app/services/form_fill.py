@@ -0,0 +1,120 @@
+from typing import Any, Dict, List, Tuple
+
+import fitz  # PyMuPDF
+
+from app.services.data_path import MISSING
+
+
+def page_widgets(page: fitz.Page) -> Dict[str, fitz.Widget]:
+    """Form field widgets of a page by field name"""
+    return {widget.field_name: widget for widget in page.widgets() if widget.field_name}
+
+
+def fill_text(widget: fitz.Widget, value: Any) -> bool:
+    """Write value into a text field (False if the field can't show it and it must be drawn instead)"""
+    if widget.field_type != fitz.PDF_WIDGET_TYPE_TEXT:
+        return False
+    if value is None:
+        return True  # No data: keep the template's value
+    text = str(value)
+    try:
+        # Field appearances use the form's fonts (base-14, WinAnsi): no CJK glyphs
+        text.encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    widget.field_value = text
+    widget.update()
+    return True
+
+
+def fill_checkbox(widget: fitz.Widget, value: Any) -> bool:
+    """Check (or uncheck for a false/empty value) a checkbox field"""
+    if widget.field_type != fitz.PDF_WIDGET_TYPE_CHECKBOX:
+        return False
+    checked = value is MISSING or bool(value)
+    widget.field_value = widget.on_state() if checked else "Off"
+    widget.update()
+    return True
+
+
+def _pdf_numbers(value: str) -> List[float]:
+    return [float(v) for v in value.strip("[]").split()]
+
+
+def _set_key(doc: fitz.Document, xref: int, path: str, value: str):
+    """xref_set_key() for a path whose dictionaries may be indirect objects"""
+    keys = path.split("/")
+    while len(keys) > 1:
+        kind, ref = doc.xref_get_key(xref, keys[0])
+        if kind != "xref":
+            break
+        xref = int(ref.split()[0])
+        keys = keys[1:]
+    doc.xref_set_key(xref, "/".join(keys), value)
+
+
+def _flatten_page(doc: fitz.Document, page: fitz.Page) -> bool:
+    """Draw widget appearances as page content and remove the widgets"""
+    if doc.xref_get_key(page.xref, "Resources")[0] == "null":
+        return False  # Inherited resources: keep the page interactive
+    commands = []
+    widgets = list(page.widgets())
+    for widget in widgets:
+        ap_xref = _appearance_xref(doc, widget)
+        if ap_xref:
+            command = _place_appearance(doc, page, widget, ap_xref)
+            if command:
+                commands.append(command)
+
+    for widget in widgets:
+        page.delete_widget(widget)
+    if commands:
+        content_xref = doc.get_new_xref()
+        doc.update_object(content_xref, "<<>>")
+        doc.update_stream(content_xref, "\n".join(commands).encode())
+        contents = page.get_contents() + [content_xref]
+        doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{xref} 0 R" for xref in contents) + "]")
+    return True
+
+
+def _appearance_xref(doc: fitz.Document, widget: fitz.Widget) -> int:
+    """Normal appearance stream of widget (of its current state for checkboxes), 0 if none"""
+    kind, ref = doc.xref_get_key(widget.xref, "AP/N")
+    if kind == "dict":
+        state_kind, state = doc.xref_get_key(widget.xref, "AS")
+        if state_kind != "name":
+            return 0
+        kind, ref = doc.xref_get_key(widget.xref, f"AP/N/{state.lstrip('/')}")
+    return int(ref.split()[0]) if kind == "xref" else 0
+
+
+def _place_appearance(doc: fitz.Document, page: fitz.Page, widget: fitz.Widget, ap_xref: int) -> str:
+    """Register appearance stream as page XObject, return content drawing it over the widget rect"""
+    rect = _pdf_numbers(doc.xref_get_key(widget.xref, "Rect")[1])  # PDF coordinates (bottom-up)
+    bbox = _pdf_numbers(doc.xref_get_key(ap_xref, "BBox")[1])
+    bbox_w, bbox_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    if len(rect) != 4 or bbox_w <= 0 or bbox_h <= 0:
+        return ""
+    # Map the appearance BBox onto the annotation rect (PDF 12.5.5)
+    scale_x = (rect[2] - rect[0]) / bbox_w
+    scale_y = (rect[3] - rect[1]) / bbox_h
+    offset_x = rect[0] - bbox[0] * scale_x
+    offset_y = rect[1] - bbox[1] * scale_y
+    name = f"FlatAP{ap_xref}"
+    _set_key(doc, page.xref, f"Resources/XObject/{name}", f"{ap_xref} 0 R")
+    return f"q {scale_x:g} 0 0 {scale_y:g} {offset_x:g} {offset_y:g} cm /{name} Do Q"
+
+
+def flatten_form(doc: fitz.Document) -> Tuple[int, int]:
+    """Replace all form fields by their appearance (returns pages flattened, pages kept interactive)"""
+    flattened = kept = 0
+    for page in doc:
+        if page.first_widget is None:
+            continue
+        if _flatten_page(doc, page):
+            flattened += 1
+        else:
+            kept += 1
+    if flattened and not kept:
+        doc.xref_set_key(doc.pdf_catalog(), "AcroForm", "null")
+    return flattened, kept
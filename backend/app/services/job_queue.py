@@ -0,0 +1,375 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import fitz  # PyMuPDF
+
+from app.services.render_executor import RenderExecutor, RenderPoolSaturated
+
+logger = logging.getLogger(__name__)
+
+# Job status values
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    template_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    output_format TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id);
+"""
+
+# Columns added after the first release (added to existing databases on open)
+LEASE_COLUMNS = ("owner", "lease_until")
+
+
+class RenderJobQueue:
+    """Persistent render job queue (local SQLite database, no external broker)
+
+    Several processes may share one database. A claimed job is leased to its
+    process (owner) for lease_seconds and the lease is renewed while the job
+    runs; jobs whose lease expired (the process stopped or died) are queued
+    again. Updates by a process that lost its lease are ignored.
+    """
+
+    def __init__(self, db_path: Path, results_dir: Path, lease_seconds: float = 60.0):
+        self.db_path = db_path
+        self.results_dir = results_dir
+        self.lease_seconds = lease_seconds
+        # Unique per queue object: a restarted process never owns its predecessor's jobs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column in LEASE_COLUMNS:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    def _lease_until(self) -> str:
+        return (datetime.now() + timedelta(seconds=self.lease_seconds)).isoformat()
+
+    def _row_to_job(self, row: sqlite3.Row, with_payload: bool = False) -> Dict[str, Any]:
+        job = {
+            "job_id": row["job_id"],
+            "user_id": row["user_id"],
+            "template_id": row["template_id"],
+            "status": row["status"],
+            "format": row["output_format"],
+            "total": row["total"],
+            "done": row["done"],
+            "progress": round(row["done"] / row["total"], 4) if row["total"] else 0.0,
+            "error": row["error"],
+            "result_path": row["result_path"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if with_payload:
+            job["payload"] = json.loads(row["payload"])
+        return job
+
+    def create(self, user_id: str, template_id: str, records: List[Dict[str, Any]], output_format: str = "pdf",
+               elements: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Queue a render job (one or more data records)"""
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        payload = json.dumps({"records": records, "elements": elements}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, user_id, template_id, status, output_format, payload, total, done, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (job_id, user_id, template_id, JOB_QUEUED, output_format, payload, len(records), now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str, with_payload: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row, with_payload) if row else None
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued job and mark it running (leased to this queue's owner)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, done = 0, owner = ?, lease_until = ?, updated_at = ? WHERE job_id = ?",
+                    (JOB_RUNNING, self.owner, self._lease_until(), datetime.now().isoformat(), row["job_id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row, with_payload=True)
+        job["status"] = JOB_RUNNING
+        return job
+
+    def _update_owned(self, job_id: str, assignments: str, values: tuple) -> bool:
+        """Update a running job leased to this owner (False if the lease was lost)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ? AND status = ? AND owner = ?",
+                values + (datetime.now().isoformat(), job_id, JOB_RUNNING, self.owner),
+            )
+            return cursor.rowcount > 0
+
+    def renew(self, job_id: str) -> bool:
+        """Extend the lease of a running job"""
+        return self._update_owned(job_id, "lease_until = ?", (self._lease_until(),))
+
+    def set_progress(self, job_id: str, done: int) -> bool:
+        return self._update_owned(job_id, "done = ?, lease_until = ?", (done, self._lease_until()))
+
+    def complete(self, job_id: str, result_path: Path) -> bool:
+        return self._update_owned(
+            job_id, "status = ?, done = total, result_path = ?, payload = '{}', lease_until = NULL",
+            (JOB_DONE, str(result_path)),
+        )
+
+    def fail(self, job_id: str, error: str) -> bool:
+        return self._update_owned(
+            job_id, "status = ?, error = ?, payload = '{}', lease_until = NULL", (JOB_FAILED, error)
+        )
+
+    def requeue_expired(self) -> int:
+        """Queue running jobs again whose lease expired (their process stopped or died)"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, done = 0, owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (JOB_QUEUED, now, JOB_RUNNING, now),
+            )
+            return cursor.rowcount
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def purge_finished(self, older_than: timedelta) -> int:
+        """Delete finished jobs (and their result files) older than the given age"""
+        cutoff = (datetime.now() - older_than).isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, result_path FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_DONE, JOB_FAILED, cutoff),
+            ).fetchall()
+            for row in rows:
+                if row["result_path"]:
+                    Path(row["result_path"]).unlink(missing_ok=True)
+                self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (row["job_id"],))
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RenderJobRunner:
+    """Background task that renders queued jobs through the render executor
+
+    Records are rendered in chunks so job progress can be reported between
+    chunks. Chunk outputs are combined into one PDF or ZIP. Queue calls
+    (SQLite) run in threads, off the event loop.
+    """
+
+    def __init__(self, queue: RenderJobQueue, executor: RenderExecutor, template_service,
+                 concurrency: int = 1, chunk_records: int = 200, result_ttl: timedelta = timedelta(hours=24)):
+        self.queue = queue
+        self.executor = executor
+        self.template_service = template_service
+        self.concurrency = max(concurrency, 1)
+        self.chunk_records = max(chunk_records, 1)
+        self.result_ttl = result_ttl
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Start background workers (call from the running event loop)"""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake up workers (a job was queued)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _maintain(self):
+        """Requeue jobs whose lease expired and purge old results (periodically)"""
+        last_purge: Optional[datetime] = None
+        while True:
+            try:
+                requeued = await asyncio.to_thread(self.queue.requeue_expired)
+                if requeued:
+                    logger.info("Requeued interrupted render jobs", extra={"jobs": requeued})
+                    self.notify()
+                if last_purge is None or datetime.now() - last_purge > timedelta(hours=1):
+                    await asyncio.to_thread(self.queue.purge_finished, self.result_ttl)
+                    last_purge = datetime.now()
+            except Exception as e:
+                logger.warning("Render job maintenance failed", extra={"error": str(e)})
+            await asyncio.sleep(self.queue.lease_seconds / 2)
+
+    async def _renew_lease(self, job_id: str):
+        """Keep the job leased while it runs (chunks may take longer than the lease)"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                if not await asyncio.to_thread(self.queue.renew, job_id):
+                    return  # Lease lost: the result is not saved
+            except Exception as e:
+                logger.warning("Render job lease renewal failed", extra={"job_id": job_id, "error": str(e)})
+
+    async def _work(self):
+        backoff = 0.0
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim_next)
+                backoff = 0.0
+            except Exception as e:
+                # E.g. "database is locked": keep the worker alive and retry
+                backoff = min(max(backoff * 2, 1.0), 30.0)
+                logger.warning("Render job claim failed", extra={"error": str(e), "retry_in": backoff})
+                await asyncio.sleep(backoff)
+                continue
+
+            if job is None:
+                # Idle: wait for a new job (or poll in case another process queued one)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._process(job)
+
+    async def _process(self, job: Dict[str, Any]):
+        """Run a claimed job and store its result or error"""
+        job_id = job["job_id"]
+        lease = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            try:
+                result_path = await self._run_job(job)
+                owned = await asyncio.to_thread(self.queue.complete, job_id, result_path)
+            except asyncio.CancelledError:
+                # Process is stopping: job stays running until its lease expires, then it is requeued
+                raise
+            except Exception as e:
+                logger.warning("Render job failed", extra={"job_id": job_id, "error": str(e)})
+                owned = await asyncio.to_thread(self.queue.fail, job_id, str(e))
+            if not owned:
+                logger.warning("Render job lease lost, result dropped", extra={"job_id": job_id})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Render job update failed", extra={"job_id": job_id, "error": str(e)})
+        finally:
+            lease.cancel()
+
+    async def _run_job(self, job: Dict[str, Any]) -> Path:
+        template_id = job["template_id"]
+        template = await asyncio.to_thread(self.template_service.get_template, template_id)
+        if not template:
+            raise ValueError(f"Template {template_id} not found")
+
+        payload = job["payload"]
+        records = payload.get("records", [])
+        cache_plan = True
+        if payload.get("elements") is not None:
+            # Use temporary template (elements override, plan is not cached)
+            template = template.copy()
+            template["elements"] = payload["elements"]
+            cache_plan = False
+
+        output_format = job["format"]
+        chunks = []
+        for start in range(0, len(records), self.chunk_records):
+            chunk = records[start:start + self.chunk_records]
+            chunks.append(await self._render_chunk(template, chunk, template_id, output_format, cache_plan))
+            await asyncio.to_thread(self.queue.set_progress, job["job_id"], start + len(chunk))
+
+        suffix = "zip" if output_format == "zip" else "pdf"
+        result_path = self.queue.results_dir / f"{job['job_id']}.{suffix}"
+        await asyncio.to_thread(self._write_result, chunks, result_path, output_format, template_id)
+        return result_path
+
+    async def _render_chunk(self, template: Dict[str, Any], records: List[Dict[str, Any]], template_id: str,
+                            output_format: str, cache_plan: bool) -> bytes:
+        """Render one chunk of records (wait while the render pool is saturated)"""
+        while True:
+            try:
+                if output_format == "pdf" and len(records) == 1:
+                    return await self.executor.render(template, records[0], template_id, cache_plan)
+                return await self.executor.render_batch(template, records, template_id, output_format, cache_plan)
+            except RenderPoolSaturated as e:
+                await asyncio.sleep(e.retry_after)
+
+    @staticmethod
+    def _write_result(chunks: List[bytes], result_path: Path, output_format: str, template_id: str):
+        """Combine chunk outputs into the job result file"""
+        # Unique temp name: a process whose lease expired may still be writing the same job
+        tmp_path = result_path.with_suffix(f"{result_path.suffix}.{uuid.uuid4().hex[:8]}.tmp")
+        if len(chunks) == 1:
+            tmp_path.write_bytes(chunks[0])
+        elif output_format == "zip":
+            index = 0
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as out:
+                for chunk in chunks:
+                    with zipfile.ZipFile(io.BytesIO(chunk)) as zf:
+                        for name in zf.namelist():
+                            index += 1
+                            out.writestr(f"rendered_{template_id}_{index}.pdf", zf.read(name))
+        else:
+            doc = fitz.open()
+            try:
+                for chunk in chunks:
+                    with fitz.open("pdf", chunk) as chunk_doc:
+                        doc.insert_pdf(chunk_doc)
+                doc.save(str(tmp_path), garbage=3, deflate=True)
+            finally:
+                doc.close()
+        tmp_path.replace(result_path)
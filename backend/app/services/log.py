@@ -0,0 +1,73 @@
+import json
+import logging
+import sys
+from datetime import datetime
+
+# Log records of all app modules (module loggers are children: logging.getLogger(__name__))
+APP_LOGGER = "app"
+
+LOG_FORMATS = ("text", "json")
+
+# (level, format) of this process, passed on to render worker processes
+_config = ("INFO", "text")
+
+# Attributes every LogRecord has; anything else was passed with extra={...} and is a structured field
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """time LEVEL logger message key=value ..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (f"{datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')} "
+                f"{record.levelname} {record.name} {record.getMessage()}")
+        for key, value in _fields(record).items():
+            value = str(value)
+            line += f" {key}={json.dumps(value, ensure_ascii=False) if ' ' in value or not value else value}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line (for log collectors)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text"):
+    """Send app log records at or above level to stderr (call once per process)
+
+    Disabled levels cost one cached level check per call; hot paths
+    additionally check logger.isEnabledFor() before building their fields.
+    """
+    global _config
+    if log_format not in LOG_FORMATS:
+        log_format = "text"
+    logger = logging.getLogger(APP_LOGGER)
+    logger.setLevel(level.upper())
+    _config = (level.upper(), log_format)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if log_format == "json" else TextFormatter())
+    logger.handlers = [handler]
+    # Not passed on to the root logger (uvicorn configures its own handlers there)
+    logger.propagate = False
+
+
+def logging_config() -> tuple:
+    """(level, format) last passed to configure_logging()"""
+    return _config
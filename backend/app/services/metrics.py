@@ -0,0 +1,277 @@
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets (upper bounds)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]  # (name suffix, labels, value)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> Iterable[Sample]:
+        return ()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        return [("", self._labels(key), value) for key, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, List[float]] = {}  # Bucket counts..., +Inf count, sum
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(("_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(("_sum", labels, counts[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class Gauge(_Metric):
+    """Current value(s) read from a callback at scrape time
+
+    The callback returns a number, or a dict of label value tuples to numbers.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Any], label_names: Tuple[str, ...] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, help_text, label_names)
+        self.read = read
+        self.kind = kind  # "counter" for totals kept by another component
+
+    def samples(self) -> Iterable[Sample]:
+        value = self.read()
+        if isinstance(value, dict):
+            return [("", self._labels(key), v) for key, v in value.items()]
+        return [("", {}, value)]
+
+
+class MetricsRegistry:
+    """Process-local metrics, exposed in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric: _Metric) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Any], label_names: Tuple[str, ...] = (),
+              kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(name, help_text, read, label_names, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning("Metric failed", extra={"metric": metric.name, "error": str(e)})
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class RenderTimings:
+    """Stage durations and cache counters of one render call
+
+    Filled in the process that renders (a render worker or the API process)
+    and returned with the output, so the API process can record it.
+    """
+
+    def __init__(self, trace_elements: bool = False):
+        self.pid = os.getpid()
+        self.started_at = time.time()  # Wall clock: compared with the submit time in the API process
+        self.stages: Dict[str, float] = {}  # Stage -> seconds
+        self.elements: Dict[str, List[float]] = {}  # Element type -> [count, seconds]
+        self.cache_stats: Dict[str, Dict[str, Any]] = {}  # Cache -> stats() of the rendering process
+        # Every element with its duration (profiling only)
+        self.element_trace: Optional[List[Dict[str, Any]]] = [] if trace_elements else None
+
+    def add_stage(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - started)
+
+    def add_element(self, element_type: str, seconds: float, element_id: Optional[str] = None, page: int = 0):
+        if self.element_trace is not None:
+            self.element_trace.append({"id": element_id, "type": element_type, "page": page, "seconds": seconds})
+        entry = self.elements.get(element_type)
+        if entry is None:
+            self.elements[element_type] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+class RenderMetrics:
+    """Render metrics of the API process
+
+    Stage and element timings come from RenderTimings of every render. Cache
+    counters of worker processes are the latest snapshot each worker sent
+    (summed over workers); queue depth and result cache counters are read
+    when /metrics is scraped.
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self._lock = threading.Lock()
+        self._cache_stats: Dict[int, Dict[str, Dict[str, Any]]] = {}  # Rendering pid -> cache stats
+
+        r = self.registry
+        self.requests = r.counter(
+            "render_requests_total", "Render API requests by endpoint and result cache status",
+            ("endpoint", "cache"))
+        self.request_seconds = r.histogram(
+            "render_request_seconds", "Render API request latency (including queue wait)", ("endpoint",))
+        self.renders = r.counter("render_renders_total", "Renders run (single record or batch)", ("kind",))
+        self.errors = r.counter("render_errors_total", "Renders that raised an error", ("kind",))
+        self.records = r.counter("render_records_total", "Data records rendered")
+        self.queue_wait_seconds = r.histogram(
+            "render_queue_wait_seconds", "Time from submission until a worker started the render")
+        self.render_seconds = r.histogram("render_seconds", "Render duration in the rendering process", ("kind",))
+        self.stage_seconds = r.histogram("render_stage_seconds", "Time per render stage", ("stage",))
+        self.element_seconds = r.histogram(
+            "render_element_seconds", "Time spent on elements of one type in one render", ("type",))
+        self.elements = r.counter("render_elements_total", "Elements rendered", ("type",))
+        self.output_bytes = r.counter("render_output_bytes_total", "Bytes of rendered output", ("kind",))
+        self.output_size = r.histogram(
+            "render_output_bytes", "Size of one rendered output", ("kind",), buckets=BYTES_BUCKETS)
+        r.gauge("render_worker_cache_requests_total",
+                "Plan, template PDF and image cache lookups in rendering processes",
+                self._cache_requests, ("cache", "result"), kind="counter")
+
+    def observe_render(self, kind: str, timings: RenderTimings, submitted_at: float, output: bytes,
+                       records: int = 1):
+        """Record one finished render (kind: "single" or "batch")"""
+        self.renders.inc(kind=kind)
+        self.records.inc(records)
+        self.queue_wait_seconds.observe(max(0.0, timings.started_at - submitted_at))
+        total = 0.0
+        for stage, seconds in timings.stages.items():
+            self.stage_seconds.observe(seconds, stage=stage)
+            total += seconds
+        self.render_seconds.observe(total, kind=kind)
+        for element_type, (count, seconds) in timings.elements.items():
+            self.elements.inc(count, type=element_type)
+            self.element_seconds.observe(seconds, type=element_type)
+        self.output_bytes.inc(len(output), kind=kind)
+        self.output_size.observe(len(output), kind=kind)
+        if timings.cache_stats:
+            with self._lock:
+                self._cache_stats[timings.pid] = timings.cache_stats
+
+    def observe_request(self, endpoint: str, cache_status: str, seconds: float):
+        self.requests.inc(endpoint=endpoint, cache=cache_status)
+        self.request_seconds.observe(seconds, endpoint=endpoint)
+
+    def _cache_requests(self) -> Dict[Tuple[str, str], float]:
+        totals: Dict[Tuple[str, str], float] = {}
+        with self._lock:
+            snapshots = list(self._cache_stats.values())
+        for snapshot in snapshots:
+            for cache, stats in snapshot.items():
+                for result, field in (("hit", "hits"), ("miss", "misses")):
+                    totals[(cache, result)] = totals.get((cache, result), 0) + stats.get(field, 0)
+        return totals
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import bcrypt
+
+
+class PasswordHasherSaturated(Exception):
+    """Raised when too many password hashes are waiting (caller should retry later)"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many login requests")
+        self.retry_after = retry_after
+
+
+def _password_bytes(password: str) -> bytes:
+    """UTF-8 bytes, truncated to bcrypt's 72-byte limit"""
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > 72:
+        password_bytes = password_bytes[:72]
+    return password_bytes
+
+
+def hash_cost(hashed_password: str) -> Optional[int]:
+    """Cost factor (log2 rounds) of a bcrypt hash ("$2b$12$...")"""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """bcrypt hashing in a small dedicated thread pool
+
+    bcrypt is deliberately slow (~0.25 s at cost 12). Running it on the event
+    loop would stall every other request during a burst of logins, so hashes
+    run in at most `workers` threads (bcrypt releases the GIL). At most
+    `max_queue` more may wait; beyond that new requests are rejected with
+    PasswordHasherSaturated instead of piling up.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_queue: int = 32, retry_after: int = 2):
+        self.rounds = rounds
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._pending = 0  # Hashes running or waiting (event loop thread only)
+        self._stats_lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0  # Seconds spent waiting for a free thread
+        self.queue_wait_max = 0.0
+        self.hash_time_total = 0.0
+
+    @property
+    def capacity(self) -> int:
+        """Maximum hashes in flight (running + queued)"""
+        return self.workers + self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "pending": self._pending,
+                "capacity": self.capacity,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "queue_wait_avg": self.queue_wait_total / self.completed if self.completed else 0.0,
+                "queue_wait_max": self.queue_wait_max,
+                "hash_time_avg": self.hash_time_total / self.completed if self.completed else 0.0,
+            }
+
+    # ----- Synchronous (caller's thread) -----
+
+    def hash(self, password: str) -> str:
+        """Hash password with the configured cost"""
+        hashed = bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds=self.rounds))
+        # bcrypt hash is always ASCII
+        return hashed.decode('ascii')
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return bcrypt.checkpw(_password_bytes(password), hashed_password.encode('ascii'))
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """Hash was made with a different cost than the configured one"""
+        return hash_cost(hashed_password) != self.rounds
+
+    # ----- In the hashing pool -----
+
+    async def hash_async(self, password: str) -> str:
+        return await self._run(self.hash, password)
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.verify, password, hashed_password)
+
+    def _timed(self, submitted: float, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self.completed += 1
+                self.queue_wait_total += started - submitted
+                self.queue_wait_max = max(self.queue_wait_max, started - submitted)
+                self.hash_time_total += finished - started
+
+    async def _run(self, func, *args):
+        if self._pending >= self.capacity:
+            self.rejected += 1
+            raise PasswordHasherSaturated(self.retry_after)
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, self._timed, time.perf_counter(), func, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
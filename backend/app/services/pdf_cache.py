@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Tuple
+import fitz  # PyMuPDF
+
+
+class FileBytesCache:
+    """Bounded LRU cache of file bytes
+
+    Entries are keyed by file path and validated against the file version
+    (mtime + size), so a replaced file is reloaded automatically.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Any, int]]" = OrderedDict()  # (version, value, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _file_version(path: Path) -> Tuple[int, int]:
+        """File version (mtime in ns, size) - changes when the file is replaced"""
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size)
+
+    def get_bytes(self, path: Path) -> bytes:
+        """Return file bytes (from cache if file is unchanged)"""
+        return self._get(path)
+
+    def _load(self, path: Path) -> Tuple[Any, int]:
+        """Read the cached value of a file and its size in bytes (subclasses may cache derived data)"""
+        with open(path, "rb") as f:
+            data = f.read()
+        return data, len(data)
+
+    def _get(self, path: Path) -> Any:
+        key = str(path)
+        version = self._file_version(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value, size = self._load(path)
+
+        with self._lock:
+            self._remove(key)
+            # Files larger than the whole cache are never cached
+            if size <= self.max_bytes:
+                self._entries[key] = (version, value, size)
+                self._total_bytes += size
+                self._evict()
+        return value
+
+    def invalidate(self, path: Path):
+        """Drop cached file (call when the file is replaced or deleted)"""
+        with self._lock:
+            self._remove(str(path))
+
+    def clear(self):
+        """Drop all cached files"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+
+    def _evict(self):
+        """Evict least recently used entries until within count and size limits"""
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+
+
+class TemplatePDFCache(FileBytesCache):
+    """Bounded LRU cache of template PDF bytes
+
+    Entries are keyed by file path (uploads/{template_id}.pdf). Raw bytes are
+    cached rather than open documents, because rendering draws on (and
+    therefore mutates) the opened document.
+    """
+
+    def open(self, pdf_path: Path) -> fitz.Document:
+        """Open an in-memory copy of the PDF (safe to modify)"""
+        return fitz.open("pdf", self.get_bytes(pdf_path))
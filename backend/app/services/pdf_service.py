@@ -1,100 +1,296 @@
 import fitz  # PyMuPDF
 from pathlib import Path
-from PIL import Image
 import io
+import logging
+import math
+import threading
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.pdf_cache import TemplatePDFCache
+
+logger = logging.getLogger(__name__)
+
+# WebP encoding needs Pillow (PNG and JPEG are encoded by PyMuPDF)
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+# Preview sizes (DPI): template list thumbnail, editor canvas, zoomed view
+PREVIEW_SIZES = {"thumb": 36, "editor": 150, "zoom": 300}
+# Preview formats: file extension, media type
+PREVIEW_FORMATS = {
+    "png": ("png", "image/png"),
+    "jpeg": ("jpg", "image/jpeg"),
+    "webp": ("webp", "image/webp"),
+}
+# Zoom previews are also served as square tiles
+PREVIEW_TILED_SIZE = "zoom"
+PREVIEW_TILE_SIZE = 512
+# Rendered for every page right after upload (one rasterization pass per page)
+PREVIEW_BACKGROUND_TARGETS = [("editor", "png"), ("thumb", "webp" if HAS_PIL else "jpeg")]
 
 
 class PDFService:
     """PDF processing service (upload, info extraction, image conversion)"""
     
+    def __init__(self, pdf_cache: Optional[TemplatePDFCache] = None, jpeg_quality: int = 80, webp_quality: int = 80):
+        self.pdf_cache = pdf_cache
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+        self._page_locks = [threading.Lock() for _ in range(64)]  # Striped by (PDF, page)
+    
     def extract_info(self, pdf_path: Path) -> Dict[str, Any]:
-        """Extract PDF information (page count, page size, etc.)"""
-        doc = fitz.open(pdf_path)
+        """Analyze PDF (every page): page sizes, AcroForm fields, fonts and images
         
-        pages_info = []
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            rect = page.rect
-            
-            pages_info.append({
-                "page": page_num + 1,
-                "width": rect.width,
-                "height": rect.height,
-                "width_pt": rect.width,  # PyMuPDF uses point units
-                "height_pt": rect.height,
-            })
-        
-        first_page = doc[0]
-        first_rect = first_page.rect
-        
-        # Save page count (before doc.close())
-        page_count = len(doc)
-        
-        # Detect AcroForm fields
-        form_fields = []
+        Reads the whole document, so it runs in the background after upload.
+        """
+        doc = fitz.open(pdf_path)
         try:
-            for field in first_page.widgets():
-                form_fields.append({
-                    "name": field.field_name,
-                    "type": field.field_type_string,
-                    "rect": {
-                        "x": field.rect.x0,
-                        "y": field.rect.y0,
-                        "w": field.rect.width,
-                        "h": field.rect.height,
-                    }
+            pages_info = []
+            form_fields = []
+            fonts: Dict[Tuple[str, str], Dict[str, Any]] = {}  # (name, type) -> font info
+            images: Dict[int, Dict[str, Any]] = {}  # Image xref -> image info
+            
+            for page in doc:
+                page_no = page.number + 1
+                rect = page.rect
+                pages_info.append({
+                    "page": page_no,
+                    "width": rect.width,
+                    "height": rect.height,
+                    "width_pt": rect.width,  # PyMuPDF uses point units
+                    "height_pt": rect.height,
+                    "rotation": page.rotation,
                 })
-        except:
-            pass
-        
-        # Save page size
-        page_size_w = first_rect.width
-        page_size_h = first_rect.height
-        
-        doc.close()
-        
-        return {
-            "page_count": page_count,
-            "page_size": {
-                "w_pt": page_size_w,
-                "h_pt": page_size_h,
-            },
-            "pages": pages_info,
-            "form_fields": form_fields,
-            "has_acroform": len(form_fields) > 0,
-            "created_at": datetime.now().isoformat(),
-        }
-    
-    def render_page_as_image(self, pdf_path: Path, page_index: int = 0, dpi: int = 150) -> Path:
-        """Render PDF page as image (for GUI preview)"""
-        doc = fitz.open(pdf_path)
-        
-        if page_index >= len(doc):
-            page_index = 0
-        
-        page = doc[page_index]
+                
+                # AcroForm fields
+                try:
+                    for field in page.widgets():
+                        form_fields.append({
+                            "name": field.field_name,
+                            "type": field.field_type_string,
+                            "page": page_no,
+                            "rect": {
+                                "x": field.rect.x0,
+                                "y": field.rect.y0,
+                                "w": field.rect.width,
+                                "h": field.rect.height,
+                            }
+                        })
+                except Exception:
+                    pass
+                
+                # Fonts: (xref, ext, type, basefont, name, encoding)
+                for _, ext, font_type, basefont, _, _ in page.get_fonts():
+                    font = fonts.setdefault((basefont, font_type), {
+                        "name": basefont,
+                        "type": font_type,
+                        "embedded": ext != "n/a",
+                        "pages": [],
+                    })
+                    if font["pages"][-1:] != [page_no]:
+                        font["pages"].append(page_no)
+                
+                # Images: (xref, smask, width, height, bpc, colorspace, alt colorspace, name, filter, referencer)
+                for xref, _, width, height, bpc, colorspace, _, _, image_filter, _ in page.get_images(full=True):
+                    image = images.setdefault(xref, {
+                        "xref": xref,
+                        "width": width,
+                        "height": height,
+                        "bpc": bpc,
+                        "colorspace": colorspace,
+                        "filter": image_filter,
+                        "pages": [],
+                    })
+                    if image["pages"][-1:] != [page_no]:
+                        image["pages"].append(page_no)
+            
+            first = pages_info[0] if pages_info else {"width": 0, "height": 0}
+            return {
+                "page_count": len(pages_info),
+                "page_size": {
+                    "w_pt": first["width"],
+                    "h_pt": first["height"],
+                },
+                "pages": pages_info,
+                "form_fields": form_fields,
+                "has_acroform": len(form_fields) > 0,
+                "fonts": list(fonts.values()),
+                "images": list(images.values()),
+                "created_at": datetime.now().isoformat(),
+            }
+        finally:
+            doc.close()
+    
+    @staticmethod
+    def preview_path(pdf_path: Path, page_index: int, size: str = "editor", fmt: str = "png",
+                     tile: Optional[Tuple[int, int]] = None) -> Path:
+        """Cached preview image location (uploads/previews/{stem}_page{n}_{size}[_{col}_{row}].{ext})"""
+        if size == "editor" and fmt == "png":
+            name = f"{pdf_path.stem}_page{page_index + 1}"  # Original preview file name
+        elif tile is not None:
+            name = f"{pdf_path.stem}_page{page_index + 1}_{size}_{tile[0]}_{tile[1]}"
+        else:
+            name = f"{pdf_path.stem}_page{page_index + 1}_{size}"
+        return Path(pdf_path).parent / "previews" / f"{name}.{PREVIEW_FORMATS[fmt][0]}"
+    
+    @staticmethod
+    def preview_etag(pdf_path: Path, page_index: int, size: str = "editor", fmt: str = "png",
+                     tile: Optional[Tuple[int, int]] = None) -> str:
+        """ETag of a page preview (changes when the PDF file is replaced)"""
+        st = Path(pdf_path).stat()
+        tile_part = f"-{tile[0]}.{tile[1]}" if tile is not None else ""
+        return f'"{st.st_mtime_ns:x}-{st.st_size:x}-{page_index + 1}-{size}-{fmt}{tile_part}"'
+    
+    @staticmethod
+    def delete_previews(pdf_path: Path):
+        """Delete all cached previews of a PDF"""
+        preview_dir = Path(pdf_path).parent / "previews"
+        if preview_dir.exists():
+            for preview_file in preview_dir.glob(f"{pdf_path.stem}_page*"):
+                preview_file.unlink(missing_ok=True)
+    
+    def _is_fresh(self, image_path: Path, pdf_path: Path) -> bool:
+        """Preview exists and was rendered after the PDF was last written"""
+        try:
+            return image_path.stat().st_mtime_ns >= Path(pdf_path).stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+    
+    def _open(self, pdf_path: Path) -> fitz.Document:
+        return self.pdf_cache.open(pdf_path) if self.pdf_cache else fitz.open(pdf_path)
+    
+    def _encode(self, pix: fitz.Pixmap, fmt: str) -> bytes:
+        """Encode pixmap once in the requested format"""
+        if fmt == "png":
+            return pix.tobytes("png")
+        if fmt == "jpeg":
+            return pix.tobytes("jpg", jpg_quality=self.jpeg_quality)
+        if not HAS_PIL:
+            raise ValueError("WebP previews require Pillow")
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", (pix.width, pix.height), pix.samples).save(buffer, "WEBP", quality=self.webp_quality)
+        return buffer.getvalue()
+    
+    def _write(self, output_path: Path, data: bytes):
+        output_path.parent.mkdir(exist_ok=True)
+        # Write to temp file first so a concurrent request never serves a partial image
+        tmp_path = output_path.with_name(f"{output_path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(output_path)
+    
+    def _render_previews(self, pdf_path: Path, page: fitz.Page, targets: List[Tuple[str, str]]):
+        """Rasterize page once (at the largest target size) and write every target (size, format)
         
+        Smaller sizes are downscaled from the same pixmap; zoom images are also cut into tiles.
+        """
+        dpi = max(PREVIEW_SIZES[size] for size, _ in targets)
         # Render (scale setting: dpi/72)
-        mat = fitz.Matrix(dpi / 72, dpi / 72)
-        pix = page.get_pixmap(matrix=mat)
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
         
-        # Convert to PIL Image
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
+        scaled: Dict[str, fitz.Pixmap] = {}
+        for size, fmt in targets:
+            if size not in scaled:
+                ratio = PREVIEW_SIZES[size] / dpi
+                scaled[size] = pix if ratio == 1 else fitz.Pixmap(
+                    pix, max(1, round(pix.width * ratio)), max(1, round(pix.height * ratio)), None
+                )
+            size_pix = scaled[size]
+            self._write(self.preview_path(pdf_path, page.number, size, fmt), self._encode(size_pix, fmt))
+            
+            if size == PREVIEW_TILED_SIZE:
+                for row in range(math.ceil(size_pix.height / PREVIEW_TILE_SIZE)):
+                    for col in range(math.ceil(size_pix.width / PREVIEW_TILE_SIZE)):
+                        clip = fitz.IRect(col * PREVIEW_TILE_SIZE, row * PREVIEW_TILE_SIZE,
+                                          (col + 1) * PREVIEW_TILE_SIZE, (row + 1) * PREVIEW_TILE_SIZE)
+                        tile_pix = fitz.Pixmap(size_pix, size_pix.width, size_pix.height, clip)
+                        self._write(self.preview_path(pdf_path, page.number, size, fmt, (col, row)),
+                                    self._encode(tile_pix, fmt))
+    
+    def _page_lock(self, pdf_path: Path, page_index: int) -> threading.Lock:
+        """One rasterization per page at a time (concurrent requests wait and reuse the result)"""
+        return self._page_locks[hash((str(pdf_path), page_index)) % len(self._page_locks)]
+    
+    @staticmethod
+    def _tile_grid(page: fitz.Page) -> Tuple[int, int]:
+        scale = PREVIEW_SIZES[PREVIEW_TILED_SIZE] / 72
+        return (math.ceil(round(page.rect.width * scale) / PREVIEW_TILE_SIZE),
+                math.ceil(round(page.rect.height * scale) / PREVIEW_TILE_SIZE))
+    
+    def tile_grid(self, pdf_path: Path, page_index: int) -> Tuple[int, int]:
+        """Number of zoom tiles (columns, rows) of a page"""
+        doc = self._open(pdf_path)
+        try:
+            return self._tile_grid(doc[page_index if page_index < len(doc) else 0])
+        finally:
+            doc.close()
+    
+    def render_page_as_image(self, pdf_path: Path, page_index: int = 0, size: str = "editor", fmt: str = "png",
+                             tile: Optional[Tuple[int, int]] = None) -> Path:
+        """Render PDF page as image (for GUI preview) - cached until the PDF changes
         
-        # Save image
-        output_dir = Path(pdf_path).parent / "previews"
-        output_dir.mkdir(exist_ok=True)
+        A missing preview is rendered together with the smaller sizes still missing in the same
+        format, from one rasterization pass.
+        """
+        if size not in PREVIEW_SIZES or fmt not in PREVIEW_FORMATS:
+            raise ValueError(f"Unsupported preview: size={size}, format={fmt}")
+        if tile is not None and size != PREVIEW_TILED_SIZE:
+            raise ValueError(f"Tiles are only available for size={PREVIEW_TILED_SIZE}")
         
-        output_path = output_dir / f"{pdf_path.stem}_page{page_index + 1}.png"
-        img.save(output_path, "PNG")
+        output_path = self.preview_path(pdf_path, page_index, size, fmt, tile)
+        if self._is_fresh(output_path, pdf_path):
+            return output_path
         
-        doc.close()
+        doc = self._open(pdf_path)
+        try:
+            if page_index >= len(doc):
+                # Out of range: show first page
+                page_index = 0
+                output_path = self.preview_path(pdf_path, page_index, size, fmt, tile)
+            if tile is not None:
+                cols, rows = self._tile_grid(doc[page_index])
+                if tile[0] >= cols or tile[1] >= rows:
+                    raise ValueError(f"Tile {tile[0]},{tile[1]} out of range ({cols},{rows} tiles)")
+            
+            with self._page_lock(pdf_path, page_index):
+                if not self._is_fresh(output_path, pdf_path):
+                    targets = [
+                        (other, fmt) for other, dpi in PREVIEW_SIZES.items()
+                        if dpi <= PREVIEW_SIZES[size] and (
+                            other == size or not self._is_fresh(self.preview_path(pdf_path, page_index, other, fmt), pdf_path)
+                        )
+                    ]
+                    self._render_previews(pdf_path, doc[page_index], targets)
+        finally:
+            doc.close()
         
         return output_path
     
+    def generate_previews(self, pdf_path: Path, targets: Optional[List[Tuple[str, str]]] = None):
+        """Render previews of all pages (run in background after upload)"""
+        targets = targets or PREVIEW_BACKGROUND_TARGETS
+        try:
+            doc = self._open(pdf_path)
+        except Exception as e:
+            logger.warning("Preview generation failed", extra={"file": pdf_path.name, "error": str(e)})
+            return
+        try:
+            for page_index in range(len(doc)):
+                with self._page_lock(pdf_path, page_index):
+                    missing = [
+                        (size, fmt) for size, fmt in targets
+                        if not self._is_fresh(self.preview_path(pdf_path, page_index, size, fmt), pdf_path)
+                    ]
+                    if missing:
+                        self._render_previews(pdf_path, doc[page_index], missing)
+        except Exception as e:
+            logger.warning("Preview generation failed", extra={"file": pdf_path.name, "error": str(e)})
+        finally:
+            doc.close()
+    
     def get_page_count(self, pdf_path: Path) -> int:
         """Return PDF page count"""
         doc = fitz.open(pdf_path)
@@ -0,0 +1,260 @@
+import asyncio
+import cProfile
+import io
+import logging
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.log import configure_logging, logging_config
+from app.services.metrics import RenderMetrics, RenderTimings
+from app.services.render_service import RenderService
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in a profile report (by cumulative time)
+PROFILE_TOP_FUNCTIONS = 40
+
+
+class RenderPoolSaturated(Exception):
+    """Raised when the render queue is full (caller should retry later)"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Render queue is full")
+        self.retry_after = retry_after
+
+
+# ===== Worker process state =====
+# Each worker keeps one RenderService, so fonts, template PDFs and render plans stay warm
+_worker_service: Optional[RenderService] = None
+
+
+def _init_worker(templates_dir: str, uploads_dir: str, fonts_dir: str, pdf_cache_entries: int, pdf_cache_bytes: int,
+                 log_config: Tuple[str, str]):
+    """Worker process initializer (loads fonts once per worker)"""
+    global _worker_service
+    from app.services.pdf_cache import TemplatePDFCache
+
+    configure_logging(*log_config)
+
+    _worker_service = RenderService(
+        Path(templates_dir),
+        Path(uploads_dir),
+        fonts_dir=Path(fonts_dir),
+        pdf_cache=TemplatePDFCache(max_entries=pdf_cache_entries, max_bytes=pdf_cache_bytes),
+    )
+
+
+def _render(service: RenderService, template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+            cache_plan: bool) -> Tuple[bytes, RenderTimings]:
+    """Render one record, returning output with stage timings and cache counters of this process"""
+    timings = RenderTimings()
+    output = service.render_template_bytes(template, data, template_id, cache_plan, timings)
+    timings.cache_stats = service.cache_stats()
+    return output, timings
+
+
+def _render_batch(service: RenderService, template: Dict[str, Any], records: List[Dict[str, Any]], template_id: str,
+                  output_format: str, cache_plan: bool) -> Tuple[bytes, RenderTimings]:
+    timings = RenderTimings()
+    output = service.render_batch_bytes(template, records, template_id, output_format, cache_plan, timings)
+    timings.cache_stats = service.cache_stats()
+    return output, timings
+
+
+def _profile(service: RenderService, template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+             cache_plan: bool) -> Dict[str, Any]:
+    """Render one record under cProfile, return the report (the PDF itself is discarded)"""
+    timings = RenderTimings(trace_elements=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        output = service.render_template_bytes(template, data, template_id, cache_plan, timings)
+    finally:
+        profiler.disable()
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    return {
+        "pid": timings.pid,
+        "output_bytes": len(output),
+        "render_seconds": sum(timings.stages.values()),
+        "stages": timings.stages,
+        "element_types": {
+            element_type: {"count": count, "seconds": seconds}
+            for element_type, (count, seconds) in timings.elements.items()
+        },
+        "elements": timings.element_trace,
+        "profile": report.getvalue(),
+    }
+
+
+def _worker_render(template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+                   cache_plan: bool) -> Tuple[bytes, RenderTimings]:
+    return _render(_worker_service, template, data, template_id, cache_plan)
+
+
+def _worker_render_batch(template: Dict[str, Any], records: List[Dict[str, Any]], template_id: str,
+                         output_format: str, cache_plan: bool) -> Tuple[bytes, RenderTimings]:
+    return _render_batch(_worker_service, template, records, template_id, output_format, cache_plan)
+
+
+def _worker_profile(template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+                    cache_plan: bool) -> Dict[str, Any]:
+    return _profile(_worker_service, template, data, template_id, cache_plan)
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+class RenderExecutor:
+    """Runs CPU-bound renders in a pool of worker processes
+
+    Keeps the event loop free while PDFs are rendered. The number of renders
+    in flight (running + queued) is bounded; when the bound is reached new
+    renders are rejected immediately with RenderPoolSaturated.
+
+    With workers=0 renders run in a thread of the API process instead.
+    Workers send their stage timings back with each output; they are
+    recorded in metrics (if given) in the API process.
+    """
+
+    def __init__(self, render_service: RenderService, workers: int = 2, max_queue: int = 16, retry_after: int = 5,
+                 metrics: Optional[RenderMetrics] = None):
+        self.render_service = render_service
+        self.metrics = metrics
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._restart_lock = threading.Lock()
+        self._pending = 0  # Renders running or waiting (event loop thread only)
+        self.rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        """Maximum renders in flight (running + queued)"""
+        return max(self.workers, 1) + self.max_queue
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Start worker processes and load fonts in each of them"""
+        if self.workers <= 0 or self._pool is not None:
+            return
+        pdf_cache = self.render_service.pdf_cache
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # spawn: do not fork the running event loop and its threads
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                str(self.render_service.templates_dir),
+                str(self.render_service.uploads_dir),
+                str(self.render_service.font_registry.fonts_dir),
+                pdf_cache.max_entries,
+                pdf_cache.max_bytes,
+                logging_config(),
+            ),
+        )
+        # Spawn all workers now so the first requests don't pay for font loading
+        for _ in range(self.workers):
+            self._pool.submit(_worker_ping)
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace the broken pool (once: every render that was in it fails with BrokenProcessPool)"""
+        with self._restart_lock:
+            if self._pool is not broken:
+                return  # Already replaced by another caller
+            logger.warning("Render worker pool broken, restarting")
+            self.shutdown()
+            self.start()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "capacity": self.capacity,
+            "rejected": self.rejected,
+        }
+
+    async def render(self, template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+                     cache_plan: bool = False) -> bytes:
+        """Render one data record (see RenderService.render_template_bytes)"""
+        if self.workers <= 0:
+            return await self._observed("single", 1, self._run_inline(
+                _render, self.render_service, template, data, template_id, cache_plan))
+        return await self._observed("single", 1, self._run(_worker_render, template, data, template_id, cache_plan))
+
+    async def render_batch(self, template: Dict[str, Any], records: List[Dict[str, Any]], template_id: str,
+                           output_format: str = "pdf", cache_plan: bool = False) -> bytes:
+        """Render many data records (see RenderService.render_batch_bytes)"""
+        if self.workers <= 0:
+            return await self._observed("batch", len(records), self._run_inline(
+                _render_batch, self.render_service, template, records, template_id, output_format, cache_plan))
+        return await self._observed("batch", len(records), self._run(
+            _worker_render_batch, template, records, template_id, output_format, cache_plan))
+
+    async def profile(self, template: Dict[str, Any], data: Dict[str, Any], template_id: str,
+                      cache_plan: bool = False) -> Dict[str, Any]:
+        """Render one data record under the profiler and return its report (not recorded in metrics)"""
+        if self.workers <= 0:
+            return await self._run_inline(_profile, self.render_service, template, data, template_id, cache_plan)
+        return await self._run(_worker_profile, template, data, template_id, cache_plan)
+
+    async def _observed(self, kind: str, records: int, run) -> bytes:
+        """Await render, record its timings, return the output"""
+        submitted_at = time.time()
+        try:
+            output, timings = await run
+        except RenderPoolSaturated:
+            raise
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.errors.inc(kind=kind)
+            raise
+        if self.metrics is not None:
+            self.metrics.observe_render(kind, timings, submitted_at, output, records)
+        return output
+
+    def _acquire(self):
+        if self._pending >= self.capacity:
+            self.rejected += 1
+            raise RenderPoolSaturated(self.retry_after)
+        self._pending += 1
+
+    async def _run_inline(self, func, *args):
+        self._acquire()
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self._pending -= 1
+
+    async def _run(self, func, *args):
+        self._acquire()
+        try:
+            if self._pool is None:
+                self.start()
+            loop = asyncio.get_running_loop()
+            pool = self._pool
+            try:
+                return await loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory) - replace the pool for later requests
+                self._restart(pool)
+                raise RuntimeError("Render worker crashed, please retry")
+        finally:
+            self._pending -= 1
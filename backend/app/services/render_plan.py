@@ -0,0 +1,410 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from app.services.data_path import DataPath, compile_data_path
+from app.services.font_fallback import (
+    SCRIPT_JAPANESE, SCRIPT_KOREAN, SCRIPT_UNICODE, SCRIPT_ASCII, FontFallback, font_fallback,
+)
+from app.services.font_registry import FontRegistry
+
+# CJK fonts without a bold face (bold is simulated with a stroke pass)
+CJK_FONTS = ["MSGothic", "MSMincho", "NotoSansJP", "MalgunGothic", "NanumGothic", "NotoSansKR"]
+
+# Margins from field edges (in points)
+TOP_MARGIN = 5
+LEFT_MARGIN = 5
+
+# Template "form_fill" setting: elements may write their value into the template's AcroForm fields
+FORM_FILL_OFF = "off"  # Only elements with an explicit "form_field" name
+FORM_FILL = "fill"  # Also elements whose box matches a form field
+FORM_FILL_FLATTEN = "flatten"  # As "fill", then replace all form fields by their appearance
+FORM_FILL_MODES = (FORM_FILL_OFF, FORM_FILL, FORM_FILL_FLATTEN)
+
+# Largest distance (points) between element box and form field rect edges to match them
+FORM_FIELD_TOLERANCE = 4
+
+# Form field types (analysis "type") an element type can fill
+FORM_FIELD_TYPES = {"text": ("Text",), "checkbox": ("CheckBox",)}
+
+# Text fields: always use Noto Sans fonts based on language (bold variant first if requested)
+TEXT_FONT_PRIORITY = {
+    SCRIPT_JAPANESE: ["NotoSansJP"],
+    SCRIPT_KOREAN: ["NotoSansKR"],
+    # English/Other: Use Noto Sans JP as default (supports English), fallback to Noto Sans KR
+    SCRIPT_UNICODE: ["NotoSansJP", "NotoSansKR"],
+    SCRIPT_ASCII: ["NotoSansJP", "NotoSansKR"],
+}
+
+# Repeat tables: MS fonts first (common in government documents)
+TABLE_FONT_PRIORITY = {
+    SCRIPT_JAPANESE: ["MSGothic", "MSMincho", "NotoSansJP"],
+    SCRIPT_KOREAN: ["MalgunGothic", "NanumGothic", "NotoSansKR"],
+    SCRIPT_UNICODE: [],  # First available registered font
+    SCRIPT_ASCII: [],  # Default font (Helvetica)
+}
+
+
+def hex_to_rgb(hex_color: str) -> Tuple[float, float, float]:
+    """Convert hex color (#RRGGBB) to RGB tuple (0-1 range)"""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) == 6:
+        try:
+            r = int(hex_color[0:2], 16) / 255.0
+            g = int(hex_color[2:4], 16) / 255.0
+            b = int(hex_color[4:6], 16) / 255.0
+            return (r, g, b)
+        except ValueError:
+            pass
+    return (0, 0, 0)  # Default to black
+
+
+@dataclass(frozen=True)
+class TextPlan:
+    """Compiled text element"""
+    id: Optional[str]
+    path: DataPath
+    x: float
+    y: float
+    w: float
+    h: float
+    font_size: float
+    align: str
+    color: Tuple[float, float, float]
+    background: Optional[Tuple[float, float, float]]
+    underline: bool
+    strikethrough: bool
+    x_left: float  # Text x for left alignment
+    y_text: float  # Baseline y (vertical alignment applied)
+    fonts: FontFallback  # Per-script font choices + glyph fallback
+
+
+@dataclass(frozen=True)
+class CheckboxPlan:
+    """Compiled checkbox element (checkmark line segments)"""
+    id: Optional[str]
+    path: DataPath
+    lines: Tuple[Tuple[Tuple[float, float], Tuple[float, float]], ...]
+    line_width: float
+
+
+@dataclass(frozen=True)
+class ImagePlan:
+    """Compiled image element"""
+    id: Optional[str]
+    image_path: str
+    file_path: Path
+    rect: Tuple[float, float, float, float]
+
+
+@dataclass(frozen=True)
+class ColumnPlan:
+    """Compiled repeat table column"""
+    path: DataPath  # Value path within one item
+    x: float  # Absolute column x
+    w: float
+    align: str
+
+
+@dataclass(frozen=True)
+class RepeatPlan:
+    """Compiled repeat table element"""
+    id: Optional[str]
+    path: DataPath
+    x: float
+    y: float
+    columns: Tuple[ColumnPlan, ...]
+    row_height: float
+    font_size: float
+    baseline_offset: float  # Baseline y relative to row top
+    fonts: FontFallback  # Per-script font choices + glyph fallback
+
+
+@dataclass(frozen=True)
+class FieldPlan:
+    """Element filled into a template form field (drawn with the fallback plan if the field can't take it)"""
+    id: Optional[str]
+    field_name: str
+    path: DataPath
+    fallback: Union[TextPlan, CheckboxPlan]
+
+
+ElementPlan = Union[TextPlan, CheckboxPlan, ImagePlan, RepeatPlan, FieldPlan]
+
+
+@dataclass(frozen=True)
+class RenderPlan:
+    """Immutable render plan of one template version (elements pre-grouped by page)"""
+    template_id: str
+    version: int
+    pages: Tuple[Tuple[int, Tuple[ElementPlan, ...]], ...]  # (page number, elements), sorted by page
+    max_page: int
+    form_fill: str = FORM_FILL_OFF
+    analyzed_at: str = ""  # Analysis results compiled in (written without a version bump)
+
+
+def _resolve_fonts(priority: Dict[str, list], font_registry: FontRegistry, bold: bool) -> FontFallback:
+    """Resolve font for each script from registered fonts"""
+    resolved = {}
+    for script, candidates in priority.items():
+        font_name = None
+        if font_registry:
+            if not candidates and script == SCRIPT_UNICODE:
+                candidates = font_registry.names[:1]
+            for candidate in candidates:
+                # Try bold variant first if bold is requested
+                if bold and f"{candidate}-Bold" in font_registry:
+                    font_name = f"{candidate}-Bold"
+                    break
+                if candidate in font_registry:
+                    font_name = candidate
+                    break
+        simulate_bold = bool(bold and font_name in CJK_FONTS)
+        resolved[script] = (font_name, simulate_bold)
+    return font_fallback(font_registry, MappingProxyType(resolved))
+
+
+def _compile_text(elem: Dict[str, Any], font_registry: FontRegistry) -> TextPlan:
+    bbox = elem.get("bbox", {})
+    x = bbox.get("x", 0)
+    y_screen = bbox.get("y", 0)  # Screen coordinate system (top is 0)
+    w = bbox.get("w", 100)
+    h = bbox.get("h", 20)
+
+    style = elem.get("style", {})
+    font_size = style.get("size", 10)
+    vertical_align = style.get("vertical_align", "top")  # top, middle, bottom
+    background_color = style.get("background_color", None)
+
+    # insert_text's point is the text's baseline position
+    # (approximately 80% of font size is above baseline)
+    if vertical_align == "middle":
+        y_text = y_screen + h / 2 + font_size * 0.3
+    elif vertical_align == "bottom":
+        y_text = y_screen + h - font_size * 0.2 - TOP_MARGIN
+    else:  # top
+        y_text = y_screen + font_size * 0.8 + TOP_MARGIN
+
+    background = None
+    if background_color and background_color.lower() not in ['transparent', 'none', '']:
+        background = hex_to_rgb(background_color)
+
+    return TextPlan(
+        id=elem.get("id"),
+        path=compile_data_path(elem.get("data_path", "")),
+        x=x, y=y_screen, w=w, h=h,
+        font_size=font_size,
+        align=style.get("align", "left"),
+        color=hex_to_rgb(style.get("color", "#000000")),
+        background=background,
+        underline=bool(style.get("underline", False)),
+        strikethrough=bool(style.get("strikethrough", False)),
+        x_left=x + LEFT_MARGIN,
+        y_text=y_text,
+        fonts=_resolve_fonts(TEXT_FONT_PRIORITY, font_registry, style.get("weight", "normal") == "bold"),
+    )
+
+
+def _compile_checkbox(elem: Dict[str, Any]) -> Optional[CheckboxPlan]:
+    # Checkbox doesn't need value from request body - always render if defined in template
+    if not elem.get("data_path", ""):
+        return None
+
+    bbox = elem.get("bbox", {})
+    x = bbox.get("x", 0)
+    y_screen = bbox.get("y", 0)
+    size = min(bbox.get("w", 100), bbox.get("h", 20))  # Square area size
+
+    # Checkmark size proportional to area size (60% of area)
+    check_size = size * 0.6
+    center_x = x + size / 2
+    center_y = y_screen + size / 2
+    offset = check_size * 0.3
+
+    return CheckboxPlan(
+        id=elem.get("id"),
+        path=compile_data_path(elem["data_path"]),
+        lines=(
+            # From bottom-left to center
+            ((center_x - offset * 0.8, center_y), (center_x - offset * 0.2, center_y + offset * 0.6)),
+            # From center to top-right
+            ((center_x - offset * 0.2, center_y + offset * 0.6), (center_x + offset * 1.0, center_y - offset * 0.4)),
+        ),
+        # Check line width also proportional to size (min 1.5, max 4)
+        line_width=max(1.5, min(4, size / 8)),
+    )
+
+
+def _compile_image(elem: Dict[str, Any], uploads_dir: Path) -> Optional[ImagePlan]:
+    image_path = elem.get("image_path", "")
+    if not image_path:
+        return None
+
+    # Image path is relative (uploads/images/xxx.png)
+    if image_path.startswith("images/"):
+        file_path = uploads_dir / image_path
+    else:
+        file_path = uploads_dir / "images" / image_path
+
+    bbox = elem.get("bbox", {})
+    x = bbox.get("x", 0)
+    y_screen = bbox.get("y", 0)
+    return ImagePlan(
+        id=elem.get("id"),
+        image_path=image_path,
+        file_path=file_path,
+        rect=(x, y_screen, x + bbox.get("w", 100), y_screen + bbox.get("h", 20)),
+    )
+
+
+def _compile_repeat(elem: Dict[str, Any], font_registry: FontRegistry) -> RepeatPlan:
+    bbox = elem.get("bbox", {})
+    x = bbox.get("x", 0)
+    style = elem.get("style", {})
+    font_size = style.get("size", 10)
+
+    columns = tuple(
+        ColumnPlan(
+            path=compile_data_path(col.get("key", "")),
+            x=x + col.get("x", 0),
+            w=col.get("w", 100),
+            align=col.get("align", "left"),
+        )
+        for col in elem.get("columns", [])
+    )
+
+    return RepeatPlan(
+        id=elem.get("id"),
+        path=compile_data_path(elem.get("items_path", "")),
+        x=x,
+        y=bbox.get("y", 0),
+        columns=columns,
+        row_height=elem.get("row_height", 18),
+        font_size=font_size,
+        # Top of row + font_size * 0.8 + margin (baseline position)
+        baseline_offset=font_size * 0.8 + TOP_MARGIN,
+        fonts=_resolve_fonts(TABLE_FONT_PRIORITY, font_registry, False),
+    )
+
+
+def _match_form_field(elem: Dict[str, Any], form_fields: List[Dict[str, Any]]) -> Optional[str]:
+    """Name of the form field on the element's page whose rect matches the element box"""
+    bbox = elem.get("bbox", {})
+    x0, y0 = bbox.get("x", 0), bbox.get("y", 0)
+    edges = (x0, y0, x0 + bbox.get("w", 100), y0 + bbox.get("h", 20))
+    field_types = FORM_FIELD_TYPES.get(elem.get("type", "text"), ())
+    for field in form_fields:
+        if field.get("page") != elem.get("page", 1) or field.get("type") not in field_types:
+            continue
+        rect = field.get("rect") or {}
+        x, y, w, h = (rect.get(key) for key in ("x", "y", "w", "h"))
+        if not all(isinstance(value, (int, float)) for value in (x, y, w, h)):
+            continue  # No usable rect: can't be matched by position
+        field_edges = (x, y, x + w, y + h)
+        if all(abs(a - b) <= FORM_FIELD_TOLERANCE for a, b in zip(edges, field_edges)):
+            return field.get("name")
+    return None
+
+
+def _compile_field(elem: Dict[str, Any], plan: Optional[ElementPlan], form_fill: str,
+                   form_fields: List[Dict[str, Any]]) -> Optional[ElementPlan]:
+    """Wrap text/checkbox plan in a FieldPlan if the element maps to a form field"""
+    if not isinstance(plan, (TextPlan, CheckboxPlan)):
+        return plan
+    field_name = elem.get("form_field")
+    if not field_name and form_fill != FORM_FILL_OFF:
+        field_name = _match_form_field(elem, form_fields)
+    if not field_name:
+        return plan
+    return FieldPlan(id=plan.id, field_name=field_name, path=plan.path, fallback=plan)
+
+
+def analysis_revision(template: Dict[str, Any]) -> str:
+    """When the template's PDF analysis finished ("" if not yet)"""
+    return (template.get("analysis") or {}).get("finished_at") or ""
+
+
+def compile_plan(template: Dict[str, Any], template_id: str, font_registry: FontRegistry,
+                 uploads_dir: Path) -> RenderPlan:
+    """Compile template elements into an immutable render plan
+
+    template_id is the id the plan is cached under (the caller's, not the
+    template dict's: ad-hoc templates may have none).
+    """
+    pages_elements: Dict[int, list] = {}  # Group elements by page
+    form_fill = template.get("form_fill") or FORM_FILL_OFF
+    if form_fill not in FORM_FILL_MODES:
+        form_fill = FORM_FILL_OFF
+    # Field names and rects found by the upload analysis
+    form_fields = (template.get("analysis") or {}).get("form_fields", [])
+
+    for elem in template.get("elements", []):
+        elem_type = elem.get("type", "text")
+        if elem_type == "text":
+            plan = _compile_text(elem, font_registry)
+        elif elem_type == "checkbox":
+            plan = _compile_checkbox(elem)
+        elif elem_type == "image":
+            plan = _compile_image(elem, uploads_dir)
+        elif elem_type == "repeat":
+            plan = _compile_repeat(elem, font_registry)
+        else:
+            plan = None
+        plan = _compile_field(elem, plan, form_fill, form_fields)
+
+        page = elem.get("page", 1)
+        if page not in pages_elements:
+            pages_elements[page] = []
+        if plan is not None:
+            pages_elements[page].append(plan)
+
+    return RenderPlan(
+        template_id=template_id,
+        version=int(template.get("version", 0)),
+        pages=tuple((page, tuple(plans)) for page, plans in sorted(pages_elements.items()) if page >= 1),
+        max_page=max(pages_elements.keys()) if pages_elements else 1,
+        form_fill=form_fill,
+        analyzed_at=analysis_revision(template),
+    )
+
+
+class RenderPlanCache:
+    """Compiled render plans keyed by (template id, template version)"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._plans: "OrderedDict[Tuple[str, int], RenderPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template_id: str, version: int) -> Optional[RenderPlan]:
+        key = (template_id, version)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+    def put(self, plan: RenderPlan):
+        with self._lock:
+            self._plans[(plan.template_id, plan.version)] = plan
+            self._plans.move_to_end((plan.template_id, plan.version))
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def invalidate(self, template_id: str):
+        """Drop all plans of a template (call when template is saved or deleted)"""
+        with self._lock:
+            for key in [key for key in self._plans if key[0] == template_id]:
+                del self._plans[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._plans), "hits": self.hits, "misses": self.misses}
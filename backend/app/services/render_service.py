@@ -1,760 +1,553 @@
+import io
+import logging
+import time
+import zipfile
 from pathlib import Path
-from typing import Dict, Any, Optional
-from pypdf import PdfWriter, PdfReader
+from typing import Dict, Any, List, Optional, Tuple
 import fitz  # PyMuPDF
-from datetime import datetime
+
+from app.services.font_registry import FontRegistry, DocumentFonts
+from app.services.pdf_cache import TemplatePDFCache
+from app.services.document_images import DocumentImages, EncodedImageCache
+from app.services.render_plan import (
+    RenderPlan, RenderPlanCache, TextPlan, CheckboxPlan, ImagePlan, RepeatPlan, FieldPlan,
+    FORM_FILL_FLATTEN, LEFT_MARGIN, analysis_revision, compile_plan,
+)
+from app.services.form_fill import page_widgets, fill_text, fill_checkbox, flatten_form
+from app.services.metrics import RenderTimings
+from app.services.font_fallback import TextRun
+from app.services.data_path import MISSING
+
+logger = logging.getLogger(__name__)
+
+# Project font directory (CJK fonts)
+FONTS_DIR = Path(__file__).parent.parent.parent / "fonts"
+
+# Element type names in render timings
+ELEMENT_TYPES = {TextPlan: "text", CheckboxPlan: "checkbox", ImagePlan: "image", RepeatPlan: "repeat", FieldPlan: "field"}
+
+
+class _TemplatePages:
+    """Clean template pages for repeat table continuation (template opened on first use)"""
+    
+    def __init__(self, open_template, template_doc: Optional[fitz.Document] = None):
+        self._open_template = open_template
+        self._doc = template_doc
+        self._owned = False
+    
+    def insert(self, doc: fitz.Document, page_num: int, at: int) -> fitz.Page:
+        """Insert a copy of template page page_num (1-based) into doc at index at"""
+        if self._doc is None:
+            self._doc = self._open_template()
+            self._owned = True
+        # Pages beyond the template's last page are copies of its first page
+        src = page_num - 1 if page_num <= len(self._doc) else 0
+        doc.insert_pdf(self._doc, from_page=src, to_page=src, start_at=at)
+        return doc[at]
+    
+    def close(self):
+        if self._owned:
+            self._doc.close()
 
 
 class RenderService:
     """PDF rendering engine (template + data → completed PDF)"""
     
-    def __init__(self, templates_dir: Path, uploads_dir: Path):
+    def __init__(self, templates_dir: Path, uploads_dir: Path, fonts_dir: Path = FONTS_DIR,
+                 pdf_cache: Optional[TemplatePDFCache] = None, template_service=None):
+        from app.services.template_service import TemplateService
+        
         self.templates_dir = templates_dir
         self.uploads_dir = uploads_dir
+        # Fonts are found and loaded once per process
+        self.font_registry = FontRegistry(fonts_dir)
+        # Template PDF bytes are shared with PDFService when a cache is passed in
+        self.pdf_cache = pdf_cache if pdf_cache is not None else TemplatePDFCache()
+        # Image element files (stamps, signatures, logos) are read once per process
+        self.image_cache = EncodedImageCache(max_entries=128, max_bytes=64 * 1024 * 1024)
+        # Compiled render plans (one per saved template version)
+        self.plan_cache = RenderPlanCache()
+        self.template_service = template_service if template_service is not None else TemplateService(templates_dir)
+        self.template_service.add_change_listener(self.invalidate_template)
     
-    async def render(self, template_id: str, data: Dict[str, Any]) -> Path:
-        """Generate PDF from template and data"""
-        from app.services.template_service import TemplateService
-        
+    def invalidate_template(self, template_id: str):
+        """Drop cached render plans of a template"""
+        self.plan_cache.invalidate(template_id)
+    
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Counters of the caches used while rendering (of this process)"""
+        return {
+            "plan": self.plan_cache.stats(),
+            "template_pdf": self.pdf_cache.stats(),
+            "image": self.image_cache.stats(),
+        }
+    
+    def get_plan(self, template: Dict[str, Any], template_id: str, cache: bool = True) -> RenderPlan:
+        """Return compiled render plan (compiled once per saved template version)"""
+        if not cache:
+            return compile_plan(template, template_id, self.font_registry, self.uploads_dir)
+        
+        version = int(template.get("version", 0))
+        plan = self.plan_cache.get(template_id, version)
+        # Analysis results (form fields) may arrive after a plan of this version was compiled
+        if plan is None or plan.analyzed_at != analysis_revision(template):
+            plan = compile_plan(template, template_id, self.font_registry, self.uploads_dir)
+            self.plan_cache.put(plan)
+        return plan
+    
+    async def render(self, template_id: str, data: Dict[str, Any]) -> bytes:
+        """Generate PDF from template and data (returns PDF bytes)"""
         # Load template
-        template_service = TemplateService(self.templates_dir)
-        template = template_service.get_template(template_id)
+        template = self.template_service.get_template(template_id)
         if not template:
             raise ValueError(f"Template {template_id} not found")
         
-        return await self.render_with_template(template, data, template_id)
+        return await self.render_with_template(template, data, template_id, cache_plan=True)
+    
+    async def render_with_template(self, template: Dict[str, Any], data: Dict[str, Any], template_id: Optional[str] = None,
+                                   cache_plan: bool = False) -> bytes:
+        """Generate PDF by directly receiving template object (returns PDF bytes)
+        
+        cache_plan should only be set for saved templates - a template with
+        overridden elements has the same version as the saved one.
+        """
+        return self.render_template_bytes(template, data, template_id, cache_plan)
     
-    async def render_with_template(self, template: Dict[str, Any], data: Dict[str, Any], template_id: Optional[str] = None) -> Path:
-        """Generate PDF by directly receiving template object"""
+    async def render_batch(self, template_id: str, records: List[Dict[str, Any]], output_format: str = "pdf") -> bytes:
+        """Generate one document per data record from a saved template
+        
+        output_format: "pdf" (single concatenated PDF) or "zip" (one PDF per record)
+        """
+        template = self.template_service.get_template(template_id)
+        if not template:
+            raise ValueError(f"Template {template_id} not found")
+        
+        return await self.render_batch_with_template(template, records, template_id, output_format, cache_plan=True)
+    
+    async def render_batch_with_template(self, template: Dict[str, Any], records: List[Dict[str, Any]],
+                                         template_id: Optional[str] = None, output_format: str = "pdf",
+                                         cache_plan: bool = False) -> bytes:
+        """Generate one document per data record (template, plan, fonts and template resources are shared)"""
+        return self.render_batch_bytes(template, records, template_id, output_format, cache_plan)
+    
+    # ========== Synchronous Rendering (CPU-bound, called directly by render worker processes) ==========
+    
+    def render_template_bytes(self, template: Dict[str, Any], data: Dict[str, Any], template_id: Optional[str] = None,
+                              cache_plan: bool = False, timings: Optional[RenderTimings] = None) -> bytes:
+        """Render one data record and return PDF bytes (stage durations are added to timings)"""
         if template_id is None:
             template_id = template.get("template_id", "temp")
+        if timings is None:
+            timings = RenderTimings()
         
-        # Load original PDF
+        with timings.stage("plan"):
+            plan = self.get_plan(template, template_id, cache=cache_plan)
+        doc = self._render_document(plan, data, template_id, timings)
+        try:
+            with timings.stage("write"):
+                return doc.tobytes(garbage=3, deflate=True)
+        finally:
+            doc.close()
+    
+    def render_batch_bytes(self, template: Dict[str, Any], records: List[Dict[str, Any]],
+                           template_id: Optional[str] = None, output_format: str = "pdf",
+                           cache_plan: bool = False, timings: Optional[RenderTimings] = None) -> bytes:
+        """Render many data records and return PDF (or ZIP) bytes (stage durations are added to timings)"""
+        if template_id is None:
+            template_id = template.get("template_id", "temp")
+        if output_format not in ("pdf", "zip"):
+            raise ValueError(f"Unsupported batch output format: {output_format}")
+        if timings is None:
+            timings = RenderTimings()
+        
+        with timings.stage("plan"):
+            plan = self.get_plan(template, template_id, cache=cache_plan)
+        
+        if output_format == "zip":
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zf:
+                # PDF streams are already compressed
+                for index, record in enumerate(records):
+                    doc = self._render_document(plan, record, template_id, timings)
+                    try:
+                        with timings.stage("write"):
+                            zf.writestr(f"rendered_{template_id}_{index + 1}.pdf", doc.tobytes(garbage=3, deflate=True))
+                    finally:
+                        doc.close()
+            return buffer.getvalue()
+        
+        doc = self._render_batch_document(plan, records, template_id, timings)
+        try:
+            with timings.stage("write"):
+                return doc.tobytes(garbage=3, deflate=True)
+        finally:
+            doc.close()
+    
+    def _open_template(self, template_id: str) -> fitz.Document:
+        """Open in-memory copy of the original template PDF"""
         template_pdf_path = self.uploads_dir / f"{template_id}.pdf"
         if not template_pdf_path.exists():
             raise ValueError(f"Template PDF {template_id}.pdf not found")
         
-        # Create overlay PDF
-        page_size = template.get("page_size", {"w_pt": 595.28, "h_pt": 841.89})
-        overlay_path = self._create_overlay(template, data, page_size)
-        
-        # Merge original PDF and overlay PDF
-        output_path = self._merge_pdfs(template_pdf_path, overlay_path, template_id)
-        
-        # Delete temporary overlay file
-        overlay_path.unlink()
-        
-        return output_path
+        return self.pdf_cache.open(template_pdf_path)
     
-    def _create_overlay(self, template: Dict[str, Any], data: Dict[str, Any], page_size: Dict[str, float]) -> Path:
-        """Create overlay PDF from data - using PyMuPDF (excellent CJK text support)"""
-        w_pt = page_size.get("w_pt", 595.28)
-        h_pt = page_size.get("h_pt", 841.89)
-        
-        output_dir = self.uploads_dir / "rendered"
-        output_dir.mkdir(exist_ok=True)
-        
-        overlay_path = output_dir / f"overlay_{datetime.now().timestamp()}.pdf"
-        
-        # Create overlay PDF with PyMuPDF (excellent CJK text support)
-        doc = fitz.open()  # Create new PDF
-        
-        elements = template.get("elements", [])
-        pages_elements = {}  # Group elements by page
-        
-        # Classify elements by page
-        for elem in elements:
-            page = elem.get("page", 1)
-            if page not in pages_elements:
-                pages_elements[page] = []
-            pages_elements[page].append(elem)
-        
-        # Find and register font files from project font directory
-        project_font_dir = Path(__file__).parent.parent.parent / "fonts"
-        registered_fonts = {}  # Font file path -> font name mapping
-        
-        if project_font_dir.exists():
-            # Japanese fonts (priority: MS Gothic > MS Mincho > Noto Sans JP)
-            # MS Gothic (ゴシック体) - Most common in Japanese government documents
-            msgothic_path = project_font_dir / "msgothic.ttc"
-            if msgothic_path.exists():
-                registered_fonts[str(msgothic_path)] = "MSGothic"
-            else:
-                # Try alternative names
-                for alt_name in ["msgothic.ttf", "MS-Gothic.ttf", "msgothic.otf"]:
-                    alt_path = project_font_dir / alt_name
-                    if alt_path.exists():
-                        registered_fonts[str(alt_path)] = "MSGothic"
-                        break
-            
-            # MS Mincho (明朝体) - For formal documents
-            msmincho_path = project_font_dir / "msmincho.ttc"
-            if msmincho_path.exists():
-                registered_fonts[str(msmincho_path)] = "MSMincho"
-            else:
-                for alt_name in ["msmincho.ttf", "MS-Mincho.ttf", "msmincho.otf"]:
-                    alt_path = project_font_dir / alt_name
-                    if alt_path.exists():
-                        registered_fonts[str(alt_path)] = "MSMincho"
-                        break
-            
-            # Noto Sans JP (fallback for Japanese)
-            jp_font_path = project_font_dir / "NotoSansJP-VF.ttf"
-            if jp_font_path.exists():
-                registered_fonts[str(jp_font_path)] = "NotoSansJP"
-            # Noto Sans JP Bold (if available)
-            jp_bold_path = project_font_dir / "NotoSansJP-Bold.ttf"
-            if jp_bold_path.exists():
-                registered_fonts[str(jp_bold_path)] = "NotoSansJP-Bold"
+    def _render_document(self, plan: RenderPlan, data: Dict[str, Any], template_id: str,
+                         timings: RenderTimings) -> fitz.Document:
+        """Draw data directly onto an in-memory copy of the template PDF - using PyMuPDF (excellent CJK text support)"""
+        with timings.stage("template_load"):
+            doc = self._open_template(template_id)
             
-            # Korean fonts (priority: Malgun Gothic > Nanum Gothic > Noto Sans KR)
-            # Malgun Gothic (맑은 고딕) - Windows default, common in Korean documents
-            malgun_path = project_font_dir / "malgun.ttf"
-            if malgun_path.exists():
-                registered_fonts[str(malgun_path)] = "MalgunGothic"
-            else:
-                for alt_name in ["malgun.ttc", "malgun.otf", "Malgun-Gothic.ttf"]:
-                    alt_path = project_font_dir / alt_name
-                    if alt_path.exists():
-                        registered_fonts[str(alt_path)] = "MalgunGothic"
-                        break
-            
-            # Nanum Gothic (나눔고딕) - Common in public institutions
-            nanum_path = project_font_dir / "NanumGothic.ttf"
-            if nanum_path.exists():
-                registered_fonts[str(nanum_path)] = "NanumGothic"
-            else:
-                for alt_name in ["NanumGothic-Regular.ttf", "NanumGothic.otf"]:
-                    alt_path = project_font_dir / alt_name
-                    if alt_path.exists():
-                        registered_fonts[str(alt_path)] = "NanumGothic"
-                        break
-            
-            # Noto Sans KR (fallback for Korean)
-            kr_font_path = project_font_dir / "NotoSansKR-VF.ttf"
-            if kr_font_path.exists():
-                registered_fonts[str(kr_font_path)] = "NotoSansKR"
-            # Noto Sans KR Bold (if available)
-            kr_bold_path = project_font_dir / "NotoSansKR-Bold.ttf"
-            if kr_bold_path.exists():
-                registered_fonts[str(kr_bold_path)] = "NotoSansKR-Bold"
-            # Nanum Gothic Bold (if available)
-            nanum_bold_path = project_font_dir / "NanumGothic-Bold.ttf"
-            if nanum_bold_path.exists():
-                registered_fonts[str(nanum_bold_path)] = "NanumGothic-Bold"
-        
-        # Process each page
-        max_page = max(pages_elements.keys()) if pages_elements else 1
-        for page_num in range(1, max_page + 1):
-            # Add new page
-            page = doc.new_page(width=w_pt, height=h_pt)
-            
-            # Register fonts (register fonts on each page)
-            for font_file_path, font_name in registered_fonts.items():
-                try:
-                    page.insert_font(fontname=font_name, fontfile=font_file_path)
-                    print(f"✓ Font registered on page {page_num}: {font_name} ({font_file_path})")
-                except Exception as e:
-                    print(f"⚠ Font registration failed ({font_name}): {e}")
-            
-            page_elements = pages_elements.get(page_num, [])
-            
-            for elem in page_elements:
-                self._render_element_fitz(page, elem, data, w_pt, h_pt, registered_fonts)
-        
-        doc.save(str(overlay_path))
-        doc.close()
-        return overlay_path
-    
-    def _get_data_value(self, data: Dict[str, Any], path: str) -> Any:
-        """Get value from data path (e.g., "customer.name")"""
-        if not path:
-            return None
+            # Match page count (duplicate first template page for elements beyond the last page)
+            while len(doc) < plan.max_page:
+                doc.fullcopy_page(0)
         
-        parts = path.split(".")
-        value = data
+        # Fonts are embedded only on pages that draw text with them
+        registered_fonts = self.font_registry.for_document(doc)
         
-        for part in parts:
-            if isinstance(value, dict):
-                value = value.get(part)
-            else:
-                return None
-            
-            if value is None:
-                return None
+        images = DocumentImages(self.image_cache, doc)
+        template_pages = _TemplatePages(lambda: self._open_template(template_id))
+        try:
+            with timings.stage("draw"):
+                self._render_record(doc, plan, data, 0, registered_fonts, images, template_pages, timings)
+        finally:
+            template_pages.close()
         
-        return value
-    
-    def _merge_pdfs(self, base_pdf_path: Path, overlay_pdf_path: Path, template_id: str) -> Path:
-        """Merge original PDF and overlay PDF"""
-        output_dir = self.uploads_dir / "rendered"
-        output_dir.mkdir(exist_ok=True)
+        if plan.form_fill == FORM_FILL_FLATTEN:
+            with timings.stage("flatten"):
+                flatten_form(doc)
         
-        output_path = output_dir / f"rendered_{template_id}_{datetime.now().timestamp()}.pdf"
+        # Subset embedded fonts to the glyphs actually used
+        with timings.stage("font_subset"):
+            registered_fonts.subset()
         
-        # Merge with pypdf
-        base_reader = PdfReader(str(base_pdf_path))
-        overlay_reader = PdfReader(str(overlay_pdf_path))
+        return doc
+    
+    def _render_batch_document(self, plan: RenderPlan, records: List[Dict[str, Any]], template_id: str,
+                               timings: RenderTimings) -> fitz.Document:
+        """Render all records into one PDF (template pages appended once per record)"""
+        with timings.stage("template_load"):
+            template_doc = self._open_template(template_id)
+        doc = fitz.open()
+        # Fonts and images are embedded once for the whole batch
+        registered_fonts = self.font_registry.for_document(doc)
+        images = DocumentImages(self.image_cache, doc)
+        template_pages = _TemplatePages(None, template_doc)
         
-        writer = PdfWriter()
+        try:
+            for record in records:
+                first_page = len(doc)
+                with timings.stage("template_load"):
+                    # Template resources are copied once: PyMuPDF reuses its graft map for the same source document
+                    doc.insert_pdf(template_doc)
+                    # Match page count (duplicate first template page for elements beyond the last page)
+                    while len(doc) - first_page < plan.max_page:
+                        doc.fullcopy_page(first_page)
+                
+                with timings.stage("draw"):
+                    self._render_record(doc, plan, record, first_page, registered_fonts, images, template_pages,
+                                        timings)
+        finally:
+            template_doc.close()
         
-        # Match page count
-        max_pages = max(len(base_reader.pages), len(overlay_reader.pages))
+        # Subset embedded fonts to the glyphs actually used
+        with timings.stage("font_subset"):
+            registered_fonts.subset()
         
-        for i in range(max_pages):
-            if i < len(base_reader.pages):
-                base_page = base_reader.pages[i]
-            else:
-                base_page = base_reader.pages[0]  # Duplicate last page
-            
-            if i < len(overlay_reader.pages):
-                overlay_page = overlay_reader.pages[i]
-                base_page.merge_page(overlay_page)
+        return doc
+    
+    def _render_record(self, doc: fitz.Document, plan: RenderPlan, data: Dict[str, Any], first_page: int,
+                       registered_fonts: DocumentFonts, images: DocumentImages, template_pages: _TemplatePages,
+                       timings: RenderTimings):
+        """Draw one data record onto template pages starting at first_page
+        
+        Form field elements are written into the page's own widgets. Pages
+        copied with insert_pdf (batch PDFs) have no widgets, so there the
+        fields are drawn like other elements.
+        """
+        added_pages = 0  # Repeat table continuation pages inserted so far
+        for page_num, page_elements in plan.pages:
+            page_index = first_page + page_num - 1 + added_pages
+            page = doc[page_index]
+            # Isolate template graphics state from drawn content
+            page.wrap_contents()
+            widgets = None  # Looked up on first form field element
             
-            writer.add_page(base_page)
-        
-        with open(output_path, "wb") as f:
-            writer.write(f)
-        
-        return output_path
+            for elem in page_elements:
+                started = time.perf_counter()
+                if isinstance(elem, FieldPlan):
+                    if widgets is None:
+                        widgets = page_widgets(page)
+                    if self._fill_field(widgets.get(elem.field_name), elem, data):
+                        timings.add_element("field", time.perf_counter() - started, elem.id, page_num)
+                        continue
+                    elem = elem.fallback
+                if isinstance(elem, RepeatPlan):
+                    # Rows that don't fit continue on template page copies inserted after this page
+                    inserted = self._render_repeat_fitz(
+                        doc, page, page_num, elem, data, registered_fonts, template_pages,
+                        insert_at=first_page + page_num + added_pages,
+                    )
+                    if inserted:
+                        added_pages += inserted
+                        page = doc[page_index]  # Inserting pages invalidates page objects
+                else:
+                    self._render_element_fitz(page, elem, data, registered_fonts, images)
+                timings.add_element(ELEMENT_TYPES[type(elem)], time.perf_counter() - started, elem.id, page_num)
+    
+    def _fill_field(self, widget: Optional[fitz.Widget], elem: FieldPlan, data: Dict[str, Any]) -> bool:
+        """Write element value into its form field widget (False: draw the element instead)"""
+        if widget is None:
+            return False
+        try:
+            if isinstance(elem.fallback, CheckboxPlan):
+                return fill_checkbox(widget, elem.path.resolve(data, MISSING))
+            return fill_text(widget, elem.path.resolve(data))
+        except Exception as e:
+            logger.warning("Form field fill failed", extra={"field": elem.field_name, "error": str(e)})
+            return False
     
     # ========== PyMuPDF Rendering Methods (CJK text support) ==========
     
-    def _render_element_fitz(self, page: fitz.Page, elem: Dict[str, Any], data: Dict[str, Any], page_w: float, page_h: float, registered_fonts: Dict[str, str] = None):
-        """Render single element - using PyMuPDF"""
-        if registered_fonts is None:
-            registered_fonts = {}
-        
-        elem_type = elem.get("type", "text")
-        bbox = elem.get("bbox", {})
-        x = bbox.get("x", 0)
-        y_screen = bbox.get("y", 0)  # Screen coordinate system (top is 0)
-        w = bbox.get("w", 100)
-        h = bbox.get("h", 20)
-        
-        if elem_type == "text":
-            self._render_text_fitz(page, elem, data, x, y_screen, w, h, page_h, registered_fonts)
-        elif elem_type == "checkbox":
-            self._render_checkbox_fitz(page, elem, data, x, y_screen, w, h, page_h)
-        elif elem_type == "image":
-            self._render_image_fitz(page, elem, data, x, y_screen, w, h)
-        elif elem_type == "repeat":
-            self._render_repeat_fitz(page, elem, data, x, y_screen, w, h, page_w, page_h, registered_fonts)
+    def _render_element_fitz(self, page: fitz.Page, elem, data: Dict[str, Any], registered_fonts: DocumentFonts,
+                             images: DocumentImages):
+        """Render single compiled element (repeat tables are rendered by _render_record) - using PyMuPDF"""
+        if isinstance(elem, TextPlan):
+            self._render_text_fitz(page, elem, data, registered_fonts)
+        elif isinstance(elem, CheckboxPlan):
+            self._render_checkbox_fitz(page, elem)
+        elif isinstance(elem, ImagePlan):
+            self._render_image_fitz(page, elem, images)
     
-    def _render_text_fitz(self, page: fitz.Page, elem: Dict[str, Any], data: Dict[str, Any], 
-                         x: float, y_screen: float, w: float, h: float, page_h: float, registered_fonts: Dict[str, str] = None):
+    def _page_runs(self, page: fitz.Page, runs: Tuple[TextRun, ...], registered_fonts: DocumentFonts) -> List[TextRun]:
+        """Embed run fonts on page (first use only); runs whose font can't be embedded use the default font"""
+        return [
+            (run_text, font_name if font_name and registered_fonts.use(page, font_name, run_text) else None,
+             simulate_bold)
+            for run_text, font_name, simulate_bold in runs
+        ]
+    
+    def _render_text_fitz(self, page: fitz.Page, elem: TextPlan, data: Dict[str, Any], registered_fonts: DocumentFonts):
         """Text rendering - using PyMuPDF (excellent CJK text support)"""
-        data_path = elem.get("data_path", "")
-        value = self._get_data_value(data, data_path)
+        value = elem.path.resolve(data)
         
         if value is None:
             return
         
-        style = elem.get("style", {})
-        font_size = style.get("size", 10)
-        align = style.get("align", "left")
-        font_weight = style.get("weight", "normal")  # normal or bold
-        text_color = style.get("color", "#000000")  # Text color (hex format)
-        background_color = style.get("background_color", None)  # Background color (hex format or None)
-        underline = style.get("underline", False)  # Underline decoration
-        strikethrough = style.get("strikethrough", False)  # Strikethrough decoration
-        line_height = style.get("line_height", 1.2)  # Line height multiplier
-        letter_spacing = style.get("letter_spacing", 0)  # Letter spacing in points
-        vertical_align = style.get("vertical_align", "top")  # top, middle, bottom
-        
         text = str(value)
+        font_size = elem.font_size
+        text_color_rgb = elem.color
         
-        # Always use Noto Sans fonts (auto-detect language)
-        font_name_to_use = None
-        
-        # Check for Unicode characters in text
-        has_unicode = any(ord(c) > 127 for c in text)
-        
-        # Language detection (Korean/Japanese priority)
-        has_korean = any('\uAC00' <= c <= '\uD7A3' for c in text)
-        has_japanese = any('\u3040' <= c <= '\u309F' or '\u30A0' <= c <= '\u30FF' or '\u4E00' <= c <= '\u9FAF' for c in text)
-        
-        # Find fonts from project font directory
-        project_font_dir = Path(__file__).parent.parent.parent / "fonts"
-        
-        # Always use Noto Sans fonts based on language
-        if registered_fonts and project_font_dir.exists():
-            # Japanese: Noto Sans JP
-            if has_japanese:
-                # Try bold variant first if bold is requested
-                if font_weight == "bold":
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansJP-Bold":
-                            font_name_to_use = font_name
-                            print(f"✓ Using Noto Sans JP Bold")
-                            break
-                # Use regular if bold not found or not requested
-                if not font_name_to_use:
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansJP":
-                            font_name_to_use = font_name
-                            if font_weight == "bold":
-                                print(f"✓ Using Noto Sans JP (bold simulation)")
-                            else:
-                                print(f"✓ Using Noto Sans JP")
-                            break
-            # Korean: Noto Sans KR
-            elif has_korean:
-                # Try bold variant first if bold is requested
-                if font_weight == "bold":
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansKR-Bold":
-                            font_name_to_use = font_name
-                            print(f"✓ Using Noto Sans KR Bold")
-                            break
-                # Use regular if bold not found or not requested
-                if not font_name_to_use:
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansKR":
-                            font_name_to_use = font_name
-                            if font_weight == "bold":
-                                print(f"✓ Using Noto Sans KR (bold simulation)")
-                            else:
-                                print(f"✓ Using Noto Sans KR")
-                            break
-            # English/Other: Use Noto Sans JP as default (supports English)
-            else:
-                # Try bold variant first if bold is requested
-                if font_weight == "bold":
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansJP-Bold":
-                            font_name_to_use = font_name
-                            print(f"✓ Using Noto Sans JP Bold (English)")
-                            break
-                # Use regular if bold not found or not requested
-                if not font_name_to_use:
-                    for font_file_path, font_name in registered_fonts.items():
-                        if font_name == "NotoSansJP":
-                            font_name_to_use = font_name
-                            if font_weight == "bold":
-                                print(f"✓ Using Noto Sans JP (English, bold simulation)")
-                            else:
-                                print(f"✓ Using Noto Sans JP (English)")
-                            break
-                    # Fallback to Noto Sans KR if JP not available
-                    if not font_name_to_use:
-                        for font_file_path, font_name in registered_fonts.items():
-                            if font_name == "NotoSansKR":
-                                font_name_to_use = font_name
-                                print(f"✓ Using Noto Sans KR (fallback)")
-                                break
+        # Split into runs with a font that has the glyphs (fonts were resolved per language at compile time)
+        runs = self._page_runs(page, elem.fonts.runs(text), registered_fonts)
         
         # Warning if font not found
-        if has_unicode and not font_name_to_use:
-            print(f"⚠ Cannot find font for Unicode text: {text[:20]}...")
-            print(f"   Font directory: {project_font_dir}")
-        
-        # Convert hex color to RGB tuple
-        def hex_to_rgb(hex_color):
-            """Convert hex color (#RRGGBB) to RGB tuple (0-1 range)"""
-            hex_color = hex_color.lstrip('#')
-            if len(hex_color) == 6:
-                r = int(hex_color[0:2], 16) / 255.0
-                g = int(hex_color[2:4], 16) / 255.0
-                b = int(hex_color[4:6], 16) / 255.0
-                return (r, g, b)
-            return (0, 0, 0)  # Default to black
-        
-        text_color_rgb = hex_to_rgb(text_color)
+        for run_text, font_name, _ in runs:
+            if not font_name and not run_text.isascii():
+                logger.warning("No font for Unicode text", extra={
+                    "text": run_text[:20], "fonts_dir": str(self.font_registry.fonts_dir),
+                })
         
         # Draw background color if specified
-        if background_color and background_color.lower() not in ['transparent', 'none', '']:
-            bg_color_rgb = hex_to_rgb(background_color)
-            rect = fitz.Rect(x, y_screen, x + w, y_screen + h)
-            page.draw_rect(rect, color=bg_color_rgb, fill=bg_color_rgb, width=0)
-        
-        # PyMuPDF coordinate system: top-left is (0, 0)
-        # insert_text's point is the text's baseline position
-        # y_screen is screen coordinate system (top is 0)
-        # Place baseline at top of field area with margin (approximately 80% of font size is above baseline)
-        top_margin = 5  # Margin from top (in points)
-        
-        # Vertical alignment adjustment
-        if vertical_align == "middle":
-            # Center vertically: adjust y position to middle of field
-            y_text = y_screen + h / 2 + font_size * 0.3  # Approximate baseline position for middle
-        elif vertical_align == "bottom":
-            # Bottom alignment: place near bottom of field
-            y_text = y_screen + h - font_size * 0.2 - top_margin
-        else:  # top
-            y_text = y_screen + font_size * 0.8 + top_margin  # Place baseline near top of field area with margin
-        
-        # Left margin (only for left alignment)
-        left_margin = 5  # Margin from left (in points)
-        x_text = x  # Default to x position
+        if elem.background:
+            rect = fitz.Rect(elem.x, elem.y, elem.x + elem.w, elem.y + elem.h)
+            page.draw_rect(rect, color=elem.background, fill=elem.background, width=0)
         
-        # Alignment handling
-        if align == "center":
-            # Center alignment: adjust by calculating text width
-            try:
-                if font_name_to_use:
-                    text_width = page.get_text_length(text, fontsize=font_size, fontname=font_name_to_use)
-                else:
-                    text_width = page.get_text_length(text, fontsize=font_size)
-                x_text = x + (w - text_width) / 2
-            except:
-                x_text = x + left_margin
-        elif align == "right":
-            # Right alignment: adjust by calculating text width
+        # Baseline position (vertical alignment) was computed at compile time
+        y_text = elem.y_text
+        
+        # Run widths are needed for alignment, decorations and placing runs after each other
+        run_widths = None
+        if elem.align in ("center", "right") or elem.underline or elem.strikethrough or len(runs) > 1:
             try:
-                if font_name_to_use:
-                    text_width = page.get_text_length(text, fontsize=font_size, fontname=font_name_to_use)
-                else:
-                    text_width = page.get_text_length(text, fontsize=font_size)
-                x_text = x + w - text_width - left_margin
-            except:
-                x_text = x + w - left_margin
+                run_widths = [self.font_registry.text_length(run_text, font_name, font_size)
+                              for run_text, font_name, _ in runs]
+            except Exception:
+                run_widths = None
+        text_width = sum(run_widths) if run_widths is not None else None
+        
+        # Alignment handling
+        if elem.align == "center" and text_width is not None:
+            # Center alignment: adjust by calculated text width
+            x_text = elem.x + (elem.w - text_width) / 2
+        elif elem.align == "right":
+            # Right alignment: adjust by calculated text width
+            if text_width is not None:
+                x_text = elem.x + elem.w - text_width - LEFT_MARGIN
+            else:
+                x_text = elem.x + elem.w - LEFT_MARGIN
         else:
             # Left alignment: add left margin
-            x_text = x + left_margin
+            x_text = elem.x_left
         
         # Insert text (recognized as PDF text, selectable/searchable)
         try:
-            if font_name_to_use:
-                # For CJK fonts without bold variant, simulate bold using stroke
-                # Check if this is a CJK font and bold is requested but not available
-                is_cjk_font = font_name_to_use in ["MSGothic", "MSMincho", "NotoSansJP", "MalgunGothic", "NanumGothic", "NotoSansKR"]
-                use_bold_simulation = is_cjk_font and font_weight == "bold" and "-Bold" not in font_name_to_use
-                
-                if use_bold_simulation:
-                    # Simulate bold by drawing text with stroke
-                    # First draw with stroke (outline) to make it bolder
+            x_run = x_text
+            for i, (run_text, font_name, use_bold_simulation) in enumerate(runs):
+                if font_name:
+                    if use_bold_simulation:
+                        # CJK font without bold variant: simulate bold by drawing text with stroke
+                        # First draw with stroke (outline) to make it bolder
+                        page.insert_text(
+                            point=(x_run, y_text),
+                            text=run_text,
+                            fontsize=font_size,
+                            fontname=font_name,
+                            color=text_color_rgb,
+                            render_mode=2  # Stroke mode (outline)
+                        )
+                    # Insert text using registered font name (filled text on top of the stroke when simulating bold)
                     page.insert_text(
-                        point=(x_text, y_text),
-                        text=text,
+                        point=(x_run, y_text),
+                        text=run_text,
                         fontsize=font_size,
-                        fontname=font_name_to_use,
+                        fontname=font_name,
                         color=text_color_rgb,
-                        render_mode=2  # Stroke mode (outline)
-                    )
-                    # Then draw filled text on top
-                    page.insert_text(
-                        point=(x_text, y_text),
-                        text=text,
-                        fontsize=font_size,
-                        fontname=font_name_to_use,
-                        color=text_color_rgb,
-                        render_mode=0  # Fill mode
+                        render_mode=0  # Text mode (0=fill, 3=invisible)
                     )
                 else:
-                    # Insert text using registered font name (normal or bold variant available)
+                    # Use default font (English, etc.)
                     page.insert_text(
-                        point=(x_text, y_text),
-                        text=text,
+                        point=(x_run, y_text),
+                        text=run_text,
                         fontsize=font_size,
-                        fontname=font_name_to_use,
-                        color=text_color_rgb,
-                        render_mode=0  # Text mode (0=fill, 3=invisible)
+                        color=text_color_rgb
                     )
-            elif has_unicode:
-                # Unicode without font may cause errors
-                print(f"⚠ Warning: Unicode text without font, using default font (may break): {text[:20]}...")
-                page.insert_text(
-                    point=(x_text, y_text),
-                    text=text,
-                    fontsize=font_size,
-                    color=text_color_rgb
-                )
-            else:
-                # Use default font (English, etc.)
-                page.insert_text(
-                    point=(x_text, y_text),
-                    text=text,
-                    fontsize=font_size,
-                    color=text_color_rgb
-                )
+                if run_widths is not None:
+                    x_run += run_widths[i]
             
-            # Draw underline if specified
-            if underline:
-                try:
-                    if font_name_to_use:
-                        text_width = page.get_text_length(text, fontsize=font_size, fontname=font_name_to_use)
-                    else:
-                        text_width = page.get_text_length(text, fontsize=font_size)
-                    
+            # Draw underline / strikethrough if specified
+            if (elem.underline or elem.strikethrough) and text_width is not None:
+                line_thickness = max(0.5, font_size * 0.05)  # Thickness proportional to font size
+                
+                if elem.underline:
                     underline_y = y_text + 2  # Slightly below baseline
-                    underline_thickness = max(0.5, font_size * 0.05)  # Thickness proportional to font size
                     page.draw_line(
                         (x_text, underline_y),
                         (x_text + text_width, underline_y),
                         color=text_color_rgb,
-                        width=underline_thickness
+                        width=line_thickness
                     )
-                except:
-                    pass  # Skip underline if calculation fails
-            
-            # Draw strikethrough if specified
-            if strikethrough:
-                try:
-                    if font_name_to_use:
-                        text_width = page.get_text_length(text, fontsize=font_size, fontname=font_name_to_use)
-                    else:
-                        text_width = page.get_text_length(text, fontsize=font_size)
-                    
+                if elem.strikethrough:
                     # Strikethrough position: middle of text height
                     strikethrough_y = y_text - font_size * 0.3  # Approximate middle of text
-                    strikethrough_thickness = max(0.5, font_size * 0.05)
                     page.draw_line(
                         (x_text, strikethrough_y),
                         (x_text + text_width, strikethrough_y),
                         color=text_color_rgb,
-                        width=strikethrough_thickness
+                        width=line_thickness
                     )
-                except:
-                    pass  # Skip strikethrough if calculation fails
                     
-        except Exception as e:
-            print(f"⚠ PyMuPDF text insertion failed: {e}")
-            print(f"   Text: {text[:50]}...")
-            print(f"   Font name: {font_name_to_use}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Text insertion failed", extra={"element_id": elem.id, "text": text[:50]})
     
-    def _render_checkbox_fitz(self, page: fitz.Page, elem: Dict[str, Any], data: Dict[str, Any], 
-                             x: float, y_screen: float, w: float, h: float, page_h: float):
+    def _render_checkbox_fitz(self, page: fitz.Page, elem: CheckboxPlan):
         """Checkbox rendering - using PyMuPDF (display checkmark only, no box)
         
-        Checkbox doesn't require data from request body - it's always checked if defined in template.
+        Checkbox doesn't require data from request body - it's always checked if defined in template
+        (unchecked checkboxes are dropped when the plan is compiled).
         """
-        data_path = elem.get("data_path", "")
-        
-        # Checkbox doesn't need value from request body - always render if defined in template
-        # If data_path exists, the checkbox is meant to be checked
-        checked = bool(data_path) if data_path else False
-        
-        if not checked:
-            return  # Don't draw anything if not checked
-        
-        # Square area size
-        size = min(w, h)
-        
-        # Checkmark size proportional to area size (60% of area)
-        check_size = size * 0.6
-        center_x = x + size / 2
-        center_y = y_screen + size / 2
-        
-        # Check line width also proportional to size (min 1.5, max 4)
-        line_width = max(1.5, min(4, size / 8))
-        
-        # Checkmark (bolder and clearer ✓ shape)
-        offset = check_size * 0.3
-        
-        # From bottom-left to center
-        page.draw_line(
-            (center_x - offset * 0.8, center_y), 
-            (center_x - offset * 0.2, center_y + offset * 0.6), 
-            color=(0, 0, 0), width=line_width  # Black
-        )
-        # From center to top-right
-        page.draw_line(
-            (center_x - offset * 0.2, center_y + offset * 0.6), 
-            (center_x + offset * 1.0, center_y - offset * 0.4), 
-            color=(0, 0, 0), width=line_width  # Black
-        )
+        for start, end in elem.lines:
+            page.draw_line(start, end, color=(0, 0, 0), width=elem.line_width)  # Black
     
-    def _render_image_fitz(self, page: fitz.Page, elem: Dict[str, Any], data: Dict[str, Any], 
-                          x: float, y_screen: float, w: float, h: float):
-        """Image rendering - using PyMuPDF"""
-        image_path = elem.get("image_path", "")
-        
-        if not image_path:
-            return
-        
-        # Image path is relative (uploads/images/xxx.png)
-        # Convert to absolute path
-        if image_path.startswith("images/"):
-            image_file_path = self.uploads_dir / image_path
-        else:
-            image_file_path = self.uploads_dir / "images" / image_path
+    def _render_image_fitz(self, page: fitz.Page, elem: ImagePlan, images: DocumentImages):
+        """Image rendering - using PyMuPDF (each image is embedded once per document)"""
+        image_file_path = elem.file_path
         
         if not image_file_path.exists():
-            print(f"⚠ Image file not found: {image_file_path}")
+            logger.warning("Image file not found", extra={"element_id": elem.id, "path": str(image_file_path)})
             return
         
         try:
             # Load and insert image
-            rect = fitz.Rect(x, y_screen, x + w, y_screen + h)
-            page.insert_image(rect, filename=str(image_file_path))
-            print(f"✓ Image insertion completed: {image_path} at ({x}, {y_screen}) size ({w}, {h})")
-        except Exception as e:
-            print(f"⚠ PyMuPDF image insertion failed: {e}")
-            print(f"   Image path: {image_file_path}")
-            import traceback
-            traceback.print_exc()
+            rect = fitz.Rect(*elem.rect)
+            images.insert(page, rect, image_file_path)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Image inserted", extra={
+                    "element_id": elem.id, "image": elem.image_path,
+                    "rect": f"{rect.x0},{rect.y0},{rect.width}x{rect.height}",
+                })
+        except Exception:
+            logger.exception("Image insertion failed", extra={"element_id": elem.id, "path": str(image_file_path)})
     
-    def _render_repeat_fitz(self, page: fitz.Page, elem: Dict[str, Any], data: Dict[str, Any], 
-                           x: float, y_screen: float, w: float, h: float, page_w: float, page_h: float, registered_fonts: Dict[str, str] = None):
-        """Repeat table rendering - using PyMuPDF"""
-        if registered_fonts is None:
-            registered_fonts = {}
-        items_path = elem.get("items_path", "")
-        items = self._get_data_value(data, items_path)
+    def _render_repeat_fitz(self, doc: fitz.Document, page: fitz.Page, page_num: int, elem: RepeatPlan,
+                            data: Dict[str, Any], registered_fonts: DocumentFonts, template_pages: _TemplatePages,
+                            insert_at: int) -> int:
+        """Repeat table rendering - using PyMuPDF
+        
+        Items are consumed one row at a time. Rows that pass the page bottom continue on copies of
+        the template page inserted at insert_at; drawing commands are buffered for one page only.
+        Returns the number of pages inserted.
+        """
+        items = elem.path.resolve(data)
         
         if not isinstance(items, list):
-            return
-        
-        columns = elem.get("columns", [])
-        row_height = elem.get("row_height", 18)
+            return 0
         
-        # Find project fonts (CJK support)
-        project_font_dir = Path(__file__).parent.parent.parent / "fonts"
-        font_file = None
+        font_size = elem.font_size
+        page_h = page.rect.height
+        if elem.y + elem.row_height > page_h:
+            return 0  # Not even one row fits
         
-        # Language detection from all texts
-        all_texts = []
+        inserted = 0
+        shape = page.new_shape()
+        current_y = elem.y
         for item in items:
-            for col in columns:
-                col_key = col.get("key", "")
-                value = item.get(col_key, "") if isinstance(item, dict) else ""
-                if value:
-                    all_texts.append(str(value))
-        
-        combined_text = "".join(all_texts)
-        has_korean = any('\uAC00' <= c <= '\uD7A3' for c in combined_text)
-        has_japanese = any('\u3040' <= c <= '\u309F' or '\u30A0' <= c <= '\u30FF' or '\u4E00' <= c <= '\u9FAF' for c in combined_text)
-        has_unicode = any(ord(c) > 127 for c in combined_text)
-        
-        if project_font_dir.exists():
-            if has_japanese:
-                font_path = project_font_dir / "NotoSansJP-VF.ttf"
-                if font_path.exists():
-                    font_file = str(font_path)
-            elif has_korean:
-                font_path = project_font_dir / "NotoSansKR-VF.ttf"
-                if font_path.exists():
-                    font_file = str(font_path)
-            elif has_unicode:
-                for font_name in ["NotoSansKR-VF.ttf", "NotoSansJP-VF.ttf", "NotoSans-Regular.ttf"]:
-                    font_path = project_font_dir / font_name
-                    if font_path.exists():
-                        font_file = str(font_path)
-                        break
-        
-        current_y = y_screen
-        for item in items:
-            if current_y + row_height > page_h:
-                break  # Out of page range
+            if current_y + elem.row_height > page_h:
+                # Page full: write its rows and continue on a fresh copy of the template page
+                shape.commit()
+                page = template_pages.insert(doc, page_num, insert_at + inserted)
+                page.wrap_contents()
+                inserted += 1
+                page_h = page.rect.height
+                shape = page.new_shape()
+                current_y = elem.y
             
-            for col in columns:
-                col_x = x + col.get("x", 0)
-                col_w = col.get("w", 100)
-                col_key = col.get("key", "")
-                col_align = col.get("align", "left")
-                
-                value = item.get(col_key, "") if isinstance(item, dict) else ""
+            # Baseline position: top of row + font_size * 0.8 + margin
+            text_y = current_y + elem.baseline_offset
+            
+            for col in elem.columns:
+                value = col.path.resolve(item, "")
                 
                 if value:
-                    style = elem.get("style", {})
-                    font_size = style.get("size", 10)
                     text = str(value)
-                    # Calculate text Y position: top of row + font_size * 0.8 + margin (baseline position)
-                    top_margin = 5  # Margin from top (in points)
-                    text_y = current_y + font_size * 0.8 + top_margin
                     
-                    # Language detection and font selection for each text
-                    item_has_korean = any('\uAC00' <= c <= '\uD7A3' for c in text)
-                    item_has_japanese = any('\u3040' <= c <= '\u309F' or '\u30A0' <= c <= '\u30FF' or '\u4E00' <= c <= '\u9FAF' for c in text)
-                    item_has_unicode = any(ord(c) > 127 for c in text)
-                    
-                    # Select from registered fonts (same priority as text rendering)
-                    item_font_name_to_use = None
-                    if registered_fonts and project_font_dir.exists():
-                        # Japanese: MS Gothic > MS Mincho > Noto Sans JP
-                        if item_has_japanese:
-                            for font_file_path, font_name in registered_fonts.items():
-                                if font_name == "MSGothic":
-                                    item_font_name_to_use = font_name
-                                    break
-                            if not item_font_name_to_use:
-                                for font_file_path, font_name in registered_fonts.items():
-                                    if font_name == "MSMincho":
-                                        item_font_name_to_use = font_name
-                                        break
-                            if not item_font_name_to_use:
-                                for font_file_path, font_name in registered_fonts.items():
-                                    if font_name == "NotoSansJP":
-                                        item_font_name_to_use = font_name
-                                        break
-                        # Korean: Malgun Gothic > Nanum Gothic > Noto Sans KR
-                        elif item_has_korean:
-                            for font_file_path, font_name in registered_fonts.items():
-                                if font_name == "MalgunGothic":
-                                    item_font_name_to_use = font_name
-                                    break
-                            if not item_font_name_to_use:
-                                for font_file_path, font_name in registered_fonts.items():
-                                    if font_name == "NanumGothic":
-                                        item_font_name_to_use = font_name
-                                        break
-                            if not item_font_name_to_use:
-                                for font_file_path, font_name in registered_fonts.items():
-                                    if font_name == "NotoSansKR":
-                                        item_font_name_to_use = font_name
-                                        break
-                        # Other Unicode: use first available CJK font
-                        elif item_has_unicode:
-                            if registered_fonts:
-                                item_font_name_to_use = list(registered_fonts.values())[0]
-                    
-                    # Left margin (only for left alignment)
-                    left_margin = 5  # Margin from left (in points)
-                    text_x = col_x  # Default to column x position
+                    # Runs with a covering font (memoized per distinct value)
+                    runs = self._page_runs(page, elem.fonts.runs(text), registered_fonts)
                     
                     # Alignment handling
-                    if col_align == "center" or col_align == "right":
+                    run_widths = None
+                    text_x = col.x + LEFT_MARGIN  # Left alignment: add left margin
+                    if col.align == "center" or col.align == "right" or len(runs) > 1:
                         try:
-                            if item_font_name_to_use:
-                                text_width = page.get_text_length(text, fontsize=font_size, fontname=item_font_name_to_use)
-                            else:
-                                text_width = page.get_text_length(text, fontsize=font_size)
+                            run_widths = [self.font_registry.text_length(run_text, font_name, font_size)
+                                          for run_text, font_name, _ in runs]
+                            text_width = sum(run_widths)
                             
-                            if col_align == "right":
-                                text_x = col_x + col_w - text_width - left_margin
-                            elif col_align == "center":
-                                text_x = col_x + (col_w - text_width) / 2
-                        except:
-                            text_x = col_x + left_margin
-                    else:
-                        # Left alignment: add left margin
-                        text_x = col_x + left_margin
-                    
-                    # Insert text (use appropriate font for each text)
-                    # Y coordinate: text_y already set above to start from top (current_y + font_size * 0.8)
+                            if col.align == "right":
+                                text_x = col.x + col.w - text_width - LEFT_MARGIN
+                            elif col.align == "center":
+                                text_x = col.x + (col.w - text_width) / 2
+                        except Exception:
+                            run_widths = None
                     
-                    try:
-                        if item_font_name_to_use:
-                            page.insert_text(
-                                point=(text_x, text_y),
-                                text=text,
+                    # Insert text (use covering font for each run, default font if none)
+                    for i, (run_text, font_name, _) in enumerate(runs):
+                        try:
+                            shape.insert_text(
+                                (text_x, text_y),
+                                run_text,
                                 fontsize=font_size,
-                                fontname=item_font_name_to_use,
+                                fontname=font_name or "helv",
                                 color=(0, 0, 0),
-                                render_mode=0
-                            )
-                        elif item_has_unicode:
-                            # Use default font if Unicode without font (may break)
-                            page.insert_text(
-                                point=(text_x, text_y),
-                                text=text,
-                                fontsize=font_size,
-                                color=(0, 0, 0)
                             )
-                        else:
-                            # Use default font (English, etc.)
-                            page.insert_text(
-                                point=(text_x, text_y),
-                                text=text,
-                                fontsize=font_size,
-                                color=(0, 0, 0)
-                            )
-                    except Exception as e:
-                        print(f"⚠ PyMuPDF repeat text insertion failed: {e}")
-                        print(f"   Text: {text[:50]}...")
-                        print(f"   Font name: {item_font_name_to_use}")
+                        except Exception as e:
+                            logger.warning("Repeat text insertion failed", extra={
+                                "element_id": elem.id, "text": run_text[:50], "font": font_name, "error": str(e),
+                            })
+                        if run_widths is not None:
+                            text_x += run_widths[i]
             
-            current_y += row_height
\ No newline at end of file
+            current_y += elem.row_height
+        
+        shape.commit()
+        return inserted
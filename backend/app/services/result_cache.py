@@ -0,0 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def result_cache_key(template: Dict[str, Any], template_pdf_path: Path, data: Any,
+                     elements_override: Optional[List[Dict[str, Any]]] = None, output_format: str = "pdf") -> str:
+    """Cache key: {template_id}/{content hash}
+
+    The hash covers everything that determines the rendered document: saved
+    template version, PDF analysis results, template PDF file version,
+    canonicalized request data and any _elements override.
+    """
+    try:
+        st = template_pdf_path.stat()
+        pdf_version = [st.st_mtime_ns, st.st_size]
+    except FileNotFoundError:
+        pdf_version = None  # Render reports the missing PDF
+    canonical = json.dumps(
+        {
+            "version": template.get("version", 0),
+            # Analysis results are saved without a version bump
+            "analysis": (template.get("analysis") or {}).get("finished_at"),
+            "pdf": pdf_version,
+            "data": data,
+            "elements": elements_override,
+            "format": output_format,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{template['template_id']}/{digest}"
+
+
+class RenderResultCache:
+    """Content-addressed cache of rendered documents
+
+    Disk tier: one file per result under cache_dir/{template_id}/, bounded by
+    total size with least-recently-used eviction. Memory tier (optional): small results kept
+    in process memory, also LRU.
+    """
+
+    def __init__(self, cache_dir: Path, max_disk_bytes: int = 512 * 1024 * 1024,
+                 max_memory_bytes: int = 64 * 1024 * 1024, max_memory_item_bytes: int = 256 * 1024):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_memory_item_bytes = max_memory_item_bytes
+        self._lock = threading.Lock()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # Key -> file size (LRU order)
+        self._disk_bytes = 0
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_disk_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _load_index(self):
+        """Rebuild LRU order from files on disk (oldest access first)"""
+        entries = []
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, f"{path.parent.name}/{path.name}", st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached result or None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # Keep LRU order across restarts
+        except FileNotFoundError:
+            with self._lock:
+                self._remove_disk(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store rendered result (best effort: failures are logged, not raised)"""
+        if not self.enabled or len(data) > self.max_disk_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Unique temp file per call: concurrent puts of the same key must not share it
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            tmp_path = Path(tmp_name)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            tmp_path.replace(path)
+        except OSError as e:
+            # E.g. the template directory was removed by invalidate_template() meanwhile
+            logger.warning("Result cache write failed", extra={"key": key, "error": str(e)})
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._remove_disk(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._put_memory(key, data)
+            self._evict_disk()
+
+    def invalidate_template(self, template_id: str):
+        """Drop all cached results of a template (call when the template is deleted)"""
+        prefix = f"{template_id}/"
+        with self._lock:
+            for key in [k for k in self._disk if k.startswith(prefix)]:
+                self._remove_disk(key)
+            for key in [k for k in self._memory if k.startswith(prefix)]:
+                self._memory_bytes -= len(self._memory.pop(key))
+        shutil.rmtree(self.cache_dir / template_id, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.max_memory_item_bytes or self.max_memory_bytes <= 0:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _remove_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        """Delete least recently used results until within size limit"""
+        while self._disk and self._disk_bytes > self.max_disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            self._path(key).unlink(missing_ok=True)
+            evicted = self._memory.pop(key, None)
+            if evicted is not None:
+                self._memory_bytes -= len(evicted)
@@ -0,0 +1,754 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Template summary index of the file backend (JSON lines journal; not matched by the *.json template glob)
+INDEX_FILE_NAME = "_index.jsonl"
+
+
+def template_summary(template: Dict[str, Any]) -> Dict[str, Any]:
+    """Template list entry"""
+    return {
+        "template_id": template.get("template_id"),
+        "filename": template.get("filename", ""),
+        "created_at": template.get("created_at", ""),
+        "element_count": len(template.get("elements", [])),
+    }
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+# Element operations of a template patch
+ELEMENT_OPS = ("add", "update", "remove")
+
+
+class VersionConflict(Exception):
+    """Template was changed since the version a patch is based on"""
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Template was modified (current version: {current_version})")
+        self.current_version = current_version
+
+
+def check_element_op(op: Dict[str, Any]):
+    """Validate one element operation
+
+    {"op": "add", "element": {...}}              append element (its id must be new)
+    {"op": "update", "id": "...", "element": {...}}  merge the given fields into the element
+    {"op": "remove", "id": "..."}                 remove element
+    """
+    kind = op.get("op")
+    if kind not in ELEMENT_OPS:
+        raise ValueError(f"Unknown element operation: {kind}")
+    if kind in ("add", "update") and not isinstance(op.get("element"), dict):
+        raise ValueError(f"'{kind}' operation requires an element object")
+    if kind == "add" and not op["element"].get("id"):
+        raise ValueError("Added element requires an id")
+    if kind in ("update", "remove") and not op.get("id"):
+        raise ValueError(f"'{kind}' operation requires an element id")
+
+
+def merge_element(element: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Element with changed fields replaced (the element id cannot change)"""
+    merged = {**element, **changes}
+    merged["id"] = element.get("id")
+    return merged
+
+
+def apply_element_ops(elements: List[Dict[str, Any]], ops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply element operations to an element list (ValueError on unknown or duplicate ids)"""
+    elements = list(elements)
+    positions = {}
+    for i, element in enumerate(elements):
+        positions.setdefault(element.get("id"), i)
+    for op in ops:
+        check_element_op(op)
+        if op["op"] == "add":
+            if op["element"]["id"] in positions:
+                raise ValueError(f"Element already exists: {op['element']['id']}")
+            positions[op["element"]["id"]] = len(elements)
+            elements.append(op["element"])
+            continue
+        i = positions.get(op["id"])
+        if i is None:
+            raise ValueError(f"Element not found: {op['id']}")
+        if op["op"] == "update":
+            elements[i] = merge_element(elements[i], op["element"])
+        else:
+            elements[i] = None  # Removed (keeps positions of later elements)
+            del positions[op["id"]]
+    return [element for element in elements if element is not None]
+
+
+class TemplateStore:
+    """Template storage interface (used by TemplateService)"""
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def put(self, template_id: str, template: Dict[str, Any]):
+        raise NotImplementedError
+
+    def delete(self, template_id: str):
+        raise NotImplementedError
+
+    def list(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Template summaries of one user (all users if user_id is None)"""
+        raise NotImplementedError
+
+    def owner(self, template_id: str) -> Optional[str]:
+        """user_id of a template ("" if it has none, None if the template does not exist)"""
+        template = self.get(template_id)
+        return None if template is None else template.get("user_id") or ""
+
+    def patch(self, template_id: str, base_version: int, ops: List[Dict[str, Any]],
+              fields: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Apply element operations and replace top-level fields, returns new version
+
+        None if the template does not exist; VersionConflict if its version is
+        not base_version. Backends that can store single elements override
+        this; the default loads and saves the whole template.
+        """
+        template = self.get(template_id)
+        if template is None:
+            return None
+        current_version = int(template.get("version", 0))
+        if current_version != base_version:
+            raise VersionConflict(current_version)
+        template["elements"] = apply_element_ops(template.get("elements", []), ops)
+        template.update(fields or {})
+        template["version"] = current_version + 1
+        self.put(template_id, template)
+        return template["version"]
+
+    def update_fields(self, template_id: str, fields: Dict[str, Any]) -> bool:
+        """Replace top-level fields keeping the version (False if the template does not exist)"""
+        template = self.get(template_id)
+        if template is None:
+            return False
+        template.update(fields)
+        self.put(template_id, template)
+        return True
+
+
+class UserStore:
+    """User storage interface (used by AuthService)"""
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def add_user(self, user: Dict[str, Any]):
+        """Add user (ValueError if username or email already exists)"""
+        raise NotImplementedError
+
+    def update_password(self, username: str, hashed_password: str):
+        raise NotImplementedError
+
+    def users_version(self) -> Any:
+        """Cheap value that changes whenever users are added or changed"""
+        raise NotImplementedError
+
+
+# ===== File backend (one JSON file per template, all users in users.json) =====
+
+class TemplateIndex:
+    """Template summaries by user, persisted as an append-only journal
+
+    save/delete append one line; the journal is compacted when it grows to
+    twice the number of live entries. If the journal is missing (or does not
+    match the template files on disk) it is rebuilt from the template files.
+    Every access checks the journal file version (inode, mtime, size), so
+    lines appended by other processes are replayed; a journal compacted by
+    another process has a new generation line at its start and is reloaded.
+    """
+
+    def __init__(self, templates_dir: Path):
+        self.templates_dir = templates_dir
+        self.index_path = templates_dir / INDEX_FILE_NAME
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._user_ids: Dict[str, str] = {}  # Template id -> user id
+        self._by_user: Dict[str, Dict[str, Dict[str, Any]]] = {}  # User id -> template id -> summary
+        self._journal_lines = 0
+        self._offset = 0  # Journal bytes replayed so far
+        self._version: Optional[Tuple[int, int, int]] = None  # Journal (inode, mtime, size) when last read
+        self._generation: Optional[str] = None  # Generation line of the journal (written by _compact)
+
+    def _journal_version(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.index_path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _ensure_loaded(self):
+        version = self._journal_version()
+        if self._loaded and version == self._version:
+            return
+        if (self._loaded and version is not None and self._version is not None
+                and version[0] == self._version[0] and version[2] >= self._offset):
+            # Same journal file, appended to by another process: replay the new lines
+            if self._load():
+                return
+        initial = not self._loaded
+        self._clear()
+        if not self._load() or (initial and len(self._user_ids) != self._count_template_files()):
+            self._rebuild()
+        self._loaded = True
+
+    def _clear(self):
+        self._user_ids.clear()
+        self._by_user.clear()
+        self._journal_lines = 0
+        self._offset = 0
+        self._version = None
+        self._generation = None
+
+    def _count_template_files(self) -> int:
+        with os.scandir(self.templates_dir) as entries:
+            return sum(1 for entry in entries if entry.name.endswith(".json"))
+
+    def _load(self) -> bool:
+        """Replay journal from the last replayed line (False if missing or unreadable)"""
+        try:
+            with open(self.index_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if self._offset:
+                    # Replaying appended lines: the journal must not have been compacted since
+                    if json.loads(f.readline()).get("generation") != self._generation:
+                        return False
+                    f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Still being written by another process
+                    self._offset += len(line)
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if "generation" in entry:
+                        self._generation = entry["generation"]
+                        continue
+                    self._journal_lines += 1
+                    if entry.get("deleted"):
+                        self._remove(entry["template_id"])
+                    else:
+                        self._put(entry.pop("user_id", None), entry)
+            self._version = (st.st_ino, st.st_mtime_ns, st.st_size)
+            return True
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError) as e:
+            logger.warning("Template index is corrupt, rebuilding", extra={"error": str(e)})
+            return False
+
+    def _rebuild(self):
+        """Rebuild index from template files"""
+        self._clear()
+        for file_path in self.templates_dir.glob("*.json"):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    template = json.load(f)
+                self._put(template.get("user_id"), template_summary(template))
+            except Exception:
+                pass
+        self._compact()
+        logger.info("Template index rebuilt", extra={"templates": len(self._user_ids)})
+
+    def _compact(self):
+        """Rewrite journal with live entries only"""
+        tmp_path = self.index_path.with_suffix(".tmp")
+        generation = uuid.uuid4().hex
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_compact_json({"generation": generation}) + "\n")
+            for user_id, summaries in self._by_user.items():
+                for summary in summaries.values():
+                    f.write(_compact_json({"user_id": user_id, **summary}) + "\n")
+        tmp_path.replace(self.index_path)
+        self._journal_lines = len(self._user_ids)
+        self._generation = generation
+        self._version = self._journal_version()
+        self._offset = self._version[2] if self._version else 0
+
+    def _append(self, entry: Dict[str, Any]):
+        line = (_compact_json(entry) + "\n").encode("utf-8")
+        with open(self.index_path, "ab") as f:
+            f.write(line)
+            end = f.tell()
+            st = os.fstat(f.fileno())
+        self._journal_lines += 1
+        if end - len(line) == self._offset and st.st_size == end:
+            # Nothing appended by other processes in between (otherwise the next access replays from _offset)
+            self._offset = end
+            self._version = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._journal_lines > 2 * len(self._user_ids) + 64:
+            self._compact()
+
+    def _put(self, user_id: Optional[str], summary: Dict[str, Any]):
+        template_id = summary["template_id"]
+        self._remove(template_id)
+        user_key = user_id or ""
+        self._user_ids[template_id] = user_key
+        self._by_user.setdefault(user_key, {})[template_id] = summary
+
+    def _remove(self, template_id: str):
+        user_key = self._user_ids.pop(template_id, None)
+        if user_key is not None:
+            summaries = self._by_user.get(user_key, {})
+            summaries.pop(template_id, None)
+            if not summaries:
+                self._by_user.pop(user_key, None)
+
+    def update(self, template: Dict[str, Any]):
+        """Record saved template"""
+        with self._lock:
+            self._ensure_loaded()
+            summary = template_summary(template)
+            self._put(template.get("user_id"), summary)
+            self._append({"user_id": template.get("user_id"), **summary})
+
+    def remove(self, template_id: str):
+        """Record deleted template"""
+        with self._lock:
+            self._ensure_loaded()
+            if template_id in self._user_ids:
+                self._remove(template_id)
+                self._append({"template_id": template_id, "deleted": True})
+
+    def owner(self, template_id: str) -> Optional[str]:
+        """user_id of a template ("" if it has none, None if unknown)"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._user_ids.get(template_id)
+
+    def list(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Template summaries of one user (all users if user_id is None)"""
+        with self._lock:
+            self._ensure_loaded()
+            if user_id:
+                return [dict(summary) for summary in self._by_user.get(user_id, {}).values()]
+            return [dict(summary) for summaries in self._by_user.values() for summary in summaries.values()]
+
+
+class FileTemplateStore(TemplateStore):
+    """Templates as templates/{template_id}.json (original layout)"""
+
+    def __init__(self, templates_dir: Path):
+        self.templates_dir = templates_dir
+        self.templates_dir.mkdir(parents=True, exist_ok=True)
+        # Summaries for listing (loaded on first use)
+        self.index = TemplateIndex(templates_dir)
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        file_path = self.templates_dir / f"{template_id}.json"
+        if not file_path.exists():
+            return None
+
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, template_id: str, template: Dict[str, Any]):
+        file_path = self.templates_dir / f"{template_id}.json"
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(template, f, ensure_ascii=False, indent=2)
+        self.index.update(template)
+
+    def delete(self, template_id: str):
+        file_path = self.templates_dir / f"{template_id}.json"
+        if file_path.exists():
+            file_path.unlink()
+        self.index.remove(template_id)
+
+    def list(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.index.list(user_id)
+
+    def owner(self, template_id: str) -> Optional[str]:
+        return self.index.owner(template_id)
+
+    def iter_templates(self) -> Iterator[Dict[str, Any]]:
+        """All template files (for migration)"""
+        for file_path in self.templates_dir.glob("*.json"):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    yield json.load(f)
+            except Exception as e:
+                logger.warning("Template file skipped", extra={"file": file_path.name, "error": str(e)})
+
+
+class FileUserStore(UserStore):
+    """All users in users/users.json keyed by username (original layout)"""
+
+    def __init__(self, users_dir: Path):
+        self.users_dir = users_dir
+        self.users_dir.mkdir(parents=True, exist_ok=True)
+        self.users_file = users_dir / "users.json"
+        self._lock = threading.Lock()
+        self._ensure_users_file()
+
+    def _ensure_users_file(self):
+        """Create users file if it doesn't exist"""
+        if not self.users_file.exists():
+            with open(self.users_file, "w", encoding="utf-8") as f:
+                json.dump({}, f)
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        """Load user list"""
+        with open(self.users_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_users(self, users: Dict):
+        """Save user list"""
+        with open(self.users_file, "w", encoding="utf-8") as f:
+            json.dump(users, f, ensure_ascii=False, indent=2)
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self.load_users().get(username)
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        for user in self.load_users().values():
+            if user.get("email") == email:
+                return user
+        return None
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        for user in self.load_users().values():
+            if user.get("user_id") == user_id:
+                return user
+        return None
+
+    def add_user(self, user: Dict[str, Any]):
+        with self._lock:
+            users = self.load_users()
+            if user["username"] in users:
+                raise ValueError("Username already exists")
+            for user_data in users.values():
+                if user_data.get("email") == user["email"]:
+                    raise ValueError("Email already exists")
+            users[user["username"]] = user
+            self._save_users(users)
+
+    def update_password(self, username: str, hashed_password: str):
+        with self._lock:
+            users = self.load_users()
+            if username in users:
+                users[username]["hashed_password"] = hashed_password
+                self._save_users(users)
+
+    def users_version(self) -> Any:
+        # Also notices edits of users.json made outside this process
+        st = self.users_file.stat()
+        return (st.st_mtime_ns, st.st_size)
+
+
+# ===== SQLite backend =====
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    template_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    filename TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT '',
+    element_count INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_templates_user ON templates (user_id);
+CREATE TABLE IF NOT EXISTS template_elements (
+    template_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    element_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (template_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_template_elements_id ON template_elements (template_id, element_id);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    hashed_password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email);
+CREATE TABLE IF NOT EXISTS storage_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_USER_COLUMNS = ("user_id", "username", "email", "hashed_password", "created_at")
+
+
+class SQLiteStore(TemplateStore, UserStore):
+    """Templates and users in one SQLite database
+
+    Lookups by template id, user id, username and email use indexes. A
+    template row holds its summary columns and the other template fields as
+    compact JSON; each element is a row of compact JSON, so listing never
+    decodes elements and a patch writes only the elements it touches.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._user_writes = 0
+
+    def _transaction(self, work):
+        """Run work() in one write transaction (caller holds the lock)"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return result
+
+    # ----- Templates -----
+
+    def _write_template(self, template_id: str, template: Dict[str, Any]):
+        """Replace template row and all its element rows (inside a transaction)"""
+        meta = {key: value for key, value in template.items() if key not in ("elements", "version")}
+        elements = template.get("elements", [])
+        summary = template_summary(template)
+        # Upsert keeps the row (and its list position) when a template is saved again
+        self._conn.execute(
+            "INSERT INTO templates (template_id, user_id, filename, created_at, element_count, version, meta) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (template_id) DO UPDATE SET user_id = excluded.user_id, "
+            "filename = excluded.filename, created_at = excluded.created_at, "
+            "element_count = excluded.element_count, version = excluded.version, meta = excluded.meta",
+            (template_id, template.get("user_id"), summary["filename"], summary["created_at"],
+             summary["element_count"], int(template.get("version", 0)), _compact_json(meta)),
+        )
+        self._conn.execute("DELETE FROM template_elements WHERE template_id = ?", (template_id,))
+        self._conn.executemany(
+            "INSERT INTO template_elements (template_id, position, element_id, data) VALUES (?, ?, ?, ?)",
+            [(template_id, i, element.get("id"), _compact_json(element)) for i, element in enumerate(elements)],
+        )
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, meta FROM templates WHERE template_id = ?", (template_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            element_rows = self._conn.execute(
+                "SELECT data FROM template_elements WHERE template_id = ? ORDER BY position", (template_id,)
+            ).fetchall()
+        template = json.loads(row["meta"])
+        template["version"] = row["version"]
+        # Element rows are JSON objects: decode them as one array
+        template["elements"] = json.loads("[" + ",".join(element["data"] for element in element_rows) + "]")
+        return template
+
+    def put(self, template_id: str, template: Dict[str, Any]):
+        with self._lock:
+            self._transaction(lambda: self._write_template(template_id, template))
+
+    def delete(self, template_id: str):
+        with self._lock:
+            def work():
+                self._conn.execute("DELETE FROM template_elements WHERE template_id = ?", (template_id,))
+                self._conn.execute("DELETE FROM templates WHERE template_id = ?", (template_id,))
+            self._transaction(work)
+
+    def list(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT template_id, filename, created_at, element_count FROM templates"
+        with self._lock:
+            if user_id:
+                rows = self._conn.execute(query + " WHERE user_id = ? ORDER BY rowid", (user_id,)).fetchall()
+            else:
+                rows = self._conn.execute(query + " ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def owner(self, template_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT user_id FROM templates WHERE template_id = ?", (template_id,)).fetchone()
+        return None if row is None else row["user_id"] or ""
+
+    def _find_element(self, template_id: str, element_id: str) -> sqlite3.Row:
+        row = self._conn.execute(
+            "SELECT position, data FROM template_elements WHERE template_id = ? AND element_id = ? "
+            "ORDER BY position LIMIT 1",
+            (template_id, element_id),
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Element not found: {element_id}")
+        return row
+
+    def _patch(self, template_id: str, base_version: int, ops: List[Dict[str, Any]],
+               fields: Dict[str, Any]) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT version, meta FROM templates WHERE template_id = ?", (template_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row["version"] != base_version:
+            raise VersionConflict(row["version"])
+
+        count_change = 0
+        for op in ops:
+            check_element_op(op)
+            if op["op"] == "add":
+                element_id = op["element"]["id"]
+                if self._conn.execute(
+                    "SELECT 1 FROM template_elements WHERE template_id = ? AND element_id = ?", (template_id, element_id)
+                ).fetchone():
+                    raise ValueError(f"Element already exists: {element_id}")
+                self._conn.execute(
+                    "INSERT INTO template_elements (template_id, position, element_id, data) "
+                    "SELECT ?, COALESCE(MAX(position), -1) + 1, ?, ? FROM template_elements WHERE template_id = ?",
+                    (template_id, element_id, _compact_json(op["element"]), template_id),
+                )
+                count_change += 1
+            elif op["op"] == "update":
+                element_row = self._find_element(template_id, op["id"])
+                element = merge_element(json.loads(element_row["data"]), op["element"])
+                self._conn.execute(
+                    "UPDATE template_elements SET data = ? WHERE template_id = ? AND position = ?",
+                    (_compact_json(element), template_id, element_row["position"]),
+                )
+            else:
+                element_row = self._find_element(template_id, op["id"])
+                self._conn.execute(
+                    "DELETE FROM template_elements WHERE template_id = ? AND position = ?",
+                    (template_id, element_row["position"]),
+                )
+                count_change -= 1
+
+        version = base_version + 1
+        if fields:
+            meta = json.loads(row["meta"])
+            meta.update(fields)
+            self._conn.execute(
+                "UPDATE templates SET version = ?, element_count = element_count + ?, meta = ? WHERE template_id = ?",
+                (version, count_change, _compact_json(meta), template_id),
+            )
+        else:
+            self._conn.execute(
+                "UPDATE templates SET version = ?, element_count = element_count + ? WHERE template_id = ?",
+                (version, count_change, template_id),
+            )
+        return version
+
+    def patch(self, template_id: str, base_version: int, ops: List[Dict[str, Any]],
+              fields: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        with self._lock:
+            return self._transaction(lambda: self._patch(template_id, base_version, ops, fields or {}))
+
+    def update_fields(self, template_id: str, fields: Dict[str, Any]) -> bool:
+        with self._lock:
+            def work() -> bool:
+                row = self._conn.execute("SELECT meta FROM templates WHERE template_id = ?", (template_id,)).fetchone()
+                if row is None:
+                    return False
+                meta = json.loads(row["meta"])
+                meta.update(fields)
+                self._conn.execute(
+                    "UPDATE templates SET meta = ? WHERE template_id = ?", (_compact_json(meta), template_id)
+                )
+                return True
+            return self._transaction(work)
+
+    # ----- Users -----
+
+    def _get_user_where(self, column: str, value: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_USER_COLUMNS)} FROM users WHERE {column} = ?", (value,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self._get_user_where("username", username)
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return self._get_user_where("email", email)
+
+    def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._get_user_where("user_id", user_id)
+
+    def add_user(self, user: Dict[str, Any]):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    f"INSERT INTO users ({', '.join(_USER_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                    tuple(user[column] for column in _USER_COLUMNS),
+                )
+                self._user_writes += 1
+            except sqlite3.IntegrityError:
+                if self._conn.execute("SELECT 1 FROM users WHERE username = ?", (user["username"],)).fetchone():
+                    raise ValueError("Username already exists")
+                raise ValueError("Email already exists")
+
+    def update_password(self, username: str, hashed_password: str):
+        with self._lock:
+            self._conn.execute("UPDATE users SET hashed_password = ? WHERE username = ?", (hashed_password, username))
+            self._user_writes += 1
+
+    def users_version(self) -> Any:
+        with self._lock:
+            # data_version changes when another connection (e.g. another process) commits
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return (self._user_writes, data_version)
+
+    # ----- Migration -----
+
+    def migrate_from_files(self, templates: FileTemplateStore, users: FileUserStore):
+        """Import templates/*.json and users/users.json once (the files are left in place)"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM storage_meta WHERE key = 'files_migrated'").fetchone():
+                return
+            user_rows = [
+                tuple(user.get(column, "") for column in _USER_COLUMNS)
+                for user in users.load_users().values()
+            ]
+
+            def work() -> int:
+                count = 0
+                for template in templates.iter_templates():
+                    template_id = template.get("template_id")
+                    if not template_id or self._conn.execute(
+                        "SELECT 1 FROM templates WHERE template_id = ?", (template_id,)
+                    ).fetchone():
+                        continue
+                    self._write_template(template_id, template)
+                    count += 1
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO users ({', '.join(_USER_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                    user_rows,
+                )
+                self._conn.execute(
+                    "INSERT INTO storage_meta (key, value) VALUES ('files_migrated', ?)",
+                    (datetime.now().isoformat(),),
+                )
+                return count
+            templates_migrated = self._transaction(work)
+        logger.info("Migrated template and user files", extra={
+            "templates": templates_migrated, "users": len(user_rows), "db": self.db_path.name,
+        })
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
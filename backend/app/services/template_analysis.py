@@ -0,0 +1,112 @@
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.services.pdf_service import PDFService
+from app.services.template_service import TemplateService
+
+logger = logging.getLogger(__name__)
+
+# Analysis status values (template["analysis"]["status"])
+ANALYSIS_PENDING = "pending"
+ANALYSIS_RUNNING = "running"
+ANALYSIS_DONE = "done"
+ANALYSIS_FAILED = "failed"
+
+# Analysis results kept at the top level of the template (read by the editor and renderer)
+TEMPLATE_FIELDS = ("page_size", "pages", "has_acroform")
+
+
+class TemplateAnalyzer:
+    """Full-document analysis of uploaded template PDFs
+
+    Upload stores the PDF and a template marked "pending"; run() then reads
+    every page (sizes, AcroForm fields, fonts, images) in the background and
+    saves the results with the template. Only the analysis fields are
+    written and the template version is kept, so mapping edits made
+    meanwhile are kept and editors don't get a version conflict. The
+    "running" status lives in this process only.
+    """
+
+    def __init__(self, pdf_service: PDFService, template_service: TemplateService, uploads_dir: Path):
+        self.pdf_service = pdf_service
+        self.template_service = template_service
+        self.uploads_dir = uploads_dir
+        self._lock = threading.Lock()
+        self._active: Dict[str, Optional[str]] = {}  # Template ids being analyzed here -> started_at
+
+    @staticmethod
+    def pending() -> Dict[str, Any]:
+        """Analysis entry of a newly uploaded template"""
+        return {"status": ANALYSIS_PENDING, "queued_at": datetime.now().isoformat()}
+
+    def claim(self, template_id: str) -> bool:
+        """Reserve template for analysis (False if it is already being analyzed here)"""
+        with self._lock:
+            if template_id in self._active:
+                return False
+            self._active[template_id] = None
+            return True
+
+    def needs_restart(self, template: Dict[str, Any]) -> bool:
+        """Analysis was queued but is not running (e.g. interrupted by a restart)"""
+        status = (template.get("analysis") or {}).get("status")
+        return status in (ANALYSIS_PENDING, ANALYSIS_RUNNING) and template.get("template_id") not in self._active
+
+    def _update(self, template_id: str, fields: Dict[str, Any]) -> bool:
+        """Replace top-level template fields (without a version bump)"""
+        return self.template_service.update_fields(template_id, fields)
+
+    def run(self, template_id: str):
+        """Analyze template PDF and save results (call claim() first)"""
+        try:
+            started_at = datetime.now().isoformat()
+            with self._lock:
+                self._active[template_id] = started_at
+            pdf_path = self.uploads_dir / f"{template_id}.pdf"
+            try:
+                info = self.pdf_service.extract_info(pdf_path)
+            except Exception as e:
+                logger.warning("Template analysis failed", extra={"template_id": template_id, "error": str(e)})
+                self._update(template_id, {"analysis": {
+                    "status": ANALYSIS_FAILED,
+                    "started_at": started_at,
+                    "finished_at": datetime.now().isoformat(),
+                    "error": str(e),
+                }})
+                return
+
+            fields = {key: info[key] for key in TEMPLATE_FIELDS}
+            fields["analysis"] = {
+                "status": ANALYSIS_DONE,
+                "started_at": started_at,
+                "finished_at": datetime.now().isoformat(),
+                "page_count": info["page_count"],
+                "form_fields": info["form_fields"],
+                "fonts": info["fonts"],
+                "images": info["images"],
+            }
+            self._update(template_id, fields)
+        finally:
+            with self._lock:
+                self._active.pop(template_id, None)
+
+    def status(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        """Analysis status (and results once done) of a template"""
+        analysis = template.get("analysis")
+        if analysis is None:
+            # Uploaded before background analysis existed: analyzed at upload
+            return {"status": ANALYSIS_DONE, "page_count": len(template.get("pages", []))}
+        if analysis.get("status") == ANALYSIS_PENDING:
+            with self._lock:
+                started_at = self._active.get(template.get("template_id"))
+            if started_at is not None:
+                return {"status": ANALYSIS_RUNNING, "started_at": started_at}
+        return dict(analysis)
+
+    def run_with_previews(self, template_id: str):
+        """Upload background task: analysis first (the editor waits for it), then page previews"""
+        self.run(template_id)
+        self.pdf_service.generate_previews(self.uploads_dir / f"{template_id}.pdf")
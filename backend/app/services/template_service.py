@@ -1,52 +1,80 @@
-import json
+import logging
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable
+
+from app.services.storage import FileTemplateStore, TemplateStore
+
+logger = logging.getLogger(__name__)
 
 
 class TemplateService:
     """Template save/load service"""
     
-    def __init__(self, templates_dir: Path):
+    def __init__(self, templates_dir: Path, store: Optional[TemplateStore] = None):
         self.templates_dir = templates_dir
         self.templates_dir.mkdir(parents=True, exist_ok=True)
+        # Storage backend (default: one JSON file per template in templates_dir)
+        self.store = store if store is not None else FileTemplateStore(templates_dir)
+        self._change_listeners: List[Callable[[str], None]] = []
+        # Version check and write of one save/patch happen together
+        self._write_lock = threading.Lock()
+    
+    def add_change_listener(self, listener: Callable[[str], None]):
+        """Register callback called with template_id when a template is saved or deleted"""
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, template_id: str):
+        for listener in self._change_listeners:
+            try:
+                listener(template_id)
+            except Exception as e:
+                logger.warning("Template change listener failed", extra={"template_id": template_id, "error": str(e)})
     
     def save_template(self, template_id: str, template: Dict[str, Any]):
-        """Save template JSON"""
-        file_path = self.templates_dir / f"{template_id}.json"
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(template, f, ensure_ascii=False, indent=2)
+        """Save template (increments template version)"""
+        with self._write_lock:
+            template["version"] = int(template.get("version", 0)) + 1
+            self.store.put(template_id, template)
+        self._notify_change(template_id)
     
     def get_template(self, template_id: str) -> Optional[Dict[str, Any]]:
-        """Load template JSON"""
-        file_path = self.templates_dir / f"{template_id}.json"
-        if not file_path.exists():
-            return None
+        """Load template"""
+        return self.store.get(template_id)
+    
+    def get_template_owner(self, template_id: str) -> Optional[str]:
+        """user_id of a template without loading its elements (None if not found)"""
+        return self.store.owner(template_id)
+    
+    def patch_template(self, template_id: str, base_version: int, ops: List[Dict[str, Any]],
+                       fields: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Apply element add/update/remove operations (see storage.check_element_op)
         
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        Only the changed elements are written (SQLite backend). Returns the new
+        version, None if the template does not exist; raises VersionConflict if
+        the template is no longer at base_version.
+        """
+        with self._write_lock:
+            version = self.store.patch(template_id, base_version, ops, fields)
+        if version is not None:
+            self._notify_change(template_id)
+        return version
+    
+    def update_fields(self, template_id: str, fields: Dict[str, Any]) -> bool:
+        """Store results derived from the template PDF (e.g. analysis) next to the mapping
+        
+        Not an edit: the version is kept, so editors holding it can still
+        patch, and change listeners are not notified. Returns False if the
+        template does not exist.
+        """
+        with self._write_lock:
+            return self.store.update_fields(template_id, fields)
     
     def delete_template(self, template_id: str):
         """Delete template"""
-        file_path = self.templates_dir / f"{template_id}.json"
-        if file_path.exists():
-            file_path.unlink()
+        self.store.delete(template_id)
+        self._notify_change(template_id)
     
     def list_templates(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Return template list (basic info only) - filter by user"""
-        templates = []
-        for file_path in self.templates_dir.glob("*.json"):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    template = json.load(f)
-                    # If user_id is provided, return only that user's templates
-                    if user_id and template.get("user_id") != user_id:
-                        continue
-                    templates.append({
-                        "template_id": template.get("template_id"),
-                        "filename": template.get("filename", ""),
-                        "created_at": template.get("created_at", ""),
-                        "element_count": len(template.get("elements", [])),
-                    })
-            except:
-                pass
-        return templates
+        return self.store.list(user_id)
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import os
+
+from app.services.auth_service import AuthService
+from app.services.password_hasher import PasswordHasher
+from app.services.storage import FileUserStore
+
+
+class CountingUserStore(FileUserStore):
+    def __init__(self, users_dir):
+        super().__init__(users_dir)
+        self.lookups = 0
+
+    def get_user(self, username):
+        self.lookups += 1
+        return super().get_user(username)
+
+
+def _auth(tmp_path, rounds=4, **kwargs):
+    store = CountingUserStore(tmp_path / "users")
+    return AuthService(tmp_path / "users", store=store, hasher=PasswordHasher(rounds=rounds), **kwargs), store
+
+
+def _edit_users_file(store, username, **fields):
+    """Change users.json like another process would (new mtime)"""
+    users = json.loads(store.users_file.read_text(encoding="utf-8"))
+    users[username].update(fields)
+    st = store.users_file.stat()
+    store.users_file.write_text(json.dumps(users), encoding="utf-8")
+    os.utime(store.users_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+
+def test_identity_is_cached_until_users_version_changes(tmp_path):
+    auth, store = _auth(tmp_path)
+    asyncio.run(auth.register_user("alice", "alice@example.com", "pw"))
+
+    store.lookups = 0
+    assert auth.get_identity("alice")["email"] == "alice@example.com"
+    assert auth.get_identity("alice")["email"] == "alice@example.com"
+    assert store.lookups == 1
+
+    version = store.users_version()
+    _edit_users_file(store, "alice", email="alice@new.example.com")
+    assert store.users_version() != version
+
+    assert auth.get_identity("alice")["email"] == "alice@new.example.com"
+    assert store.lookups == 2
+
+
+def test_identity_cache_is_bounded(tmp_path):
+    auth, store = _auth(tmp_path, max_cached_identities=1)
+    for name in ("alice", "bob"):
+        asyncio.run(auth.register_user(name, f"{name}@example.com", "pw"))
+    auth.get_identity("alice")
+    auth.get_identity("bob")
+    assert len(auth._identities) == 1
+    assert auth.get_identity("nobody") is None
@@ -0,0 +1,75 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from app.services.blob_store import BlobStore, UploadTooLarge
+
+
+def _store(tmp_path):
+    return BlobStore(tmp_path / "blobs")
+
+
+def test_identical_uploads_share_one_blob(tmp_path):
+    store = _store(tmp_path)
+    data = b"%PDF-1.7 same content"
+    sha, size, deduplicated = store.store(io.BytesIO(data), tmp_path / "uploads" / "a.pdf")
+    assert sha == hashlib.sha256(data).hexdigest()
+    assert size == len(data) and not deduplicated
+
+    _, _, deduplicated = store.store(io.BytesIO(data), tmp_path / "uploads" / "b.pdf")
+    assert deduplicated
+    blob = store.blob_path(sha)
+    assert blob.stat().st_nlink == 3
+    assert os.path.samefile(blob, tmp_path / "uploads" / "b.pdf")
+    assert (tmp_path / "uploads" / "a.pdf").read_bytes() == data
+
+
+def test_release_deletes_blob_with_last_reference(tmp_path):
+    store = _store(tmp_path)
+    a, b = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    sha, _, _ = store.store(io.BytesIO(b"content"), a)
+    store.store(io.BytesIO(b"content"), b)
+
+    store.release(a, sha)
+    assert not a.exists()
+    assert store.blob_path(sha).exists()
+
+    store.release(b)  # Without the hash: computed from the file
+    assert not b.exists()
+    assert not store.blob_path(sha).exists()
+
+
+def test_collect_deletes_unreferenced_blobs(tmp_path):
+    store = _store(tmp_path)
+    used, orphan = tmp_path / "used.pdf", tmp_path / "orphan.pdf"
+    used_sha, _, _ = store.store(io.BytesIO(b"used"), used)
+    orphan_sha, _, _ = store.store(io.BytesIO(b"orphan"), orphan)
+    orphan.unlink()  # E.g. a delete interrupted before release()
+
+    assert store.collect() == 1
+    assert store.blob_path(used_sha).exists()
+    assert not store.blob_path(orphan_sha).exists()
+
+
+def test_upload_over_size_cap_is_rejected(tmp_path):
+    store = _store(tmp_path)
+    target = tmp_path / "big.pdf"
+    with pytest.raises(UploadTooLarge):
+        store.store(io.BytesIO(b"x" * 2048), target, max_bytes=1024)
+    assert not target.exists()
+    assert list(store.blobs_dir.iterdir()) == []
+
+
+def test_adopt_moves_blobs_of_old_location(tmp_path):
+    old = BlobStore(tmp_path / "uploads" / "blobs")
+    target = tmp_path / "uploads" / "a.pdf"
+    sha, _, _ = old.store(io.BytesIO(b"content"), target)
+
+    store = _store(tmp_path)
+    store.adopt(old.blobs_dir)
+    assert not old.blobs_dir.exists()
+    assert os.path.samefile(store.blob_path(sha), target)
+    store.release(target, sha)
+    assert not store.blob_path(sha).exists()
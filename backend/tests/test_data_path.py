@@ -0,0 +1,73 @@
+import pytest
+
+from app.services.data_path import MISSING, DataPath, _parse, compile_data_path
+
+DATA = {
+    "customer": {"name": "Alice", "address": None},
+    "items": [{"price": 10}, {"price": 20}, {"price": 30}],
+    "meta": {"a.b": "dotted", "x[0]": "bracketed"},
+    "codes": {"0": "numeric key"},
+    "empty": "",
+}
+
+
+@pytest.mark.parametrize("path, steps", [
+    ("customer.name", ("customer", "name")),
+    ("items[0].price", ("items", 0, "price")),
+    ("items.1.price", ("items", 1, "price")),
+    ("items[-1].price", ("items", -1, "price")),
+    ('meta["a.b"]', ("meta", "a.b")),
+    ("meta['x[0]']", ("meta", "x[0]")),
+])
+def test_parse(path, steps):
+    assert _parse(path) == steps
+
+
+@pytest.mark.parametrize("path", ["items[", "items[0", "items[abc]", 'meta["a.b]', "a..b", "a]"])
+def test_parse_rejects_malformed_paths(path):
+    with pytest.raises(ValueError):
+        _parse(path)
+
+
+@pytest.mark.parametrize("path, value", [
+    ("customer.name", "Alice"),
+    ("items[0].price", 10),
+    ("items.2.price", 30),
+    ("items[-1].price", 30),
+    ("items[-3].price", 10),
+    ('meta["a.b"]', "dotted"),
+    ("meta['x[0]']", "bracketed"),
+    ("codes[0]", "numeric key"),
+    ("empty", ""),
+])
+def test_resolve(path, value):
+    assert DataPath(path).resolve(DATA) == value
+
+
+@pytest.mark.parametrize("path", ["items[3].price", "items[-4].price", "customer.name.first", "items.price", "nope"])
+def test_resolve_missing_returns_default(path):
+    assert DataPath(path).resolve(DATA) is None
+    assert DataPath(path).resolve(DATA, MISSING) is MISSING
+
+
+def test_resolve_none_segment():
+    # None at the end of the path is a present value
+    assert DataPath("customer.address").resolve(DATA, MISSING) is None
+    # None on the way: the rest of the path does not exist
+    assert DataPath("customer.address.city").resolve(DATA, MISSING) is MISSING
+
+
+def test_malformed_path_resolves_to_default():
+    path = DataPath("items[0")
+    assert path
+    assert path.resolve(DATA, MISSING) is MISSING
+
+
+def test_empty_path():
+    assert not DataPath("")
+    assert DataPath("").resolve(DATA, "default") == "default"
+
+
+def test_compiled_paths_are_shared():
+    assert compile_data_path("items[0].price") is compile_data_path("items[0].price")
+    assert compile_data_path(None) == DataPath("")
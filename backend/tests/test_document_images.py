@@ -0,0 +1,75 @@
+import os
+
+import fitz  # PyMuPDF
+
+from app.services.document_images import DocumentImages, EncodedImageCache
+
+RECT = fitz.Rect(20, 20, 220, 170)
+
+
+def _write_png(path, alpha=True, color=(200, 40, 40)):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 24), alpha)
+    for y in range(24):
+        for x in range(32):
+            pixel = (color[0], x * 8, y * 10)
+            pix.set_pixel(x, y, pixel + ((x + y) * 4,) if alpha else pixel)
+    path.write_bytes(pix.tobytes("png"))
+
+
+def _render(doc):
+    saved = fitz.open("pdf", doc.tobytes(garbage=3))
+    return saved[0].get_pixmap().samples
+
+
+def test_copied_image_renders_like_insert_image(tmp_path):
+    for alpha in (True, False):
+        path = tmp_path / f"stamp-{alpha}.png"
+        _write_png(path, alpha=alpha)
+
+        expected = fitz.open()
+        expected.new_page().insert_image(RECT, filename=str(path))
+
+        doc = fitz.open()
+        DocumentImages(EncodedImageCache(), doc).insert(doc.new_page(), RECT, path)
+        assert _render(doc) == _render(expected)
+
+
+def test_image_is_embedded_once_per_document(tmp_path):
+    path = tmp_path / "logo.png"
+    _write_png(path)
+    doc = fitz.open()
+    images = DocumentImages(EncodedImageCache(), doc)
+    doc.new_page()
+    doc.new_page()
+    first, second = doc[0], doc[1]
+    xref = images.insert(first, RECT, path)
+    assert images.insert(first, RECT + (0, 200, 0, 200), path) == xref
+    assert images.insert(second, RECT, path) == xref
+    assert {img[0] for page in doc for img in page.get_images()} == {xref}
+
+
+def test_encoded_image_is_shared_across_documents(tmp_path):
+    path = tmp_path / "logo.png"
+    _write_png(path)
+    cache = EncodedImageCache()
+    for _ in range(3):
+        doc = fitz.open()
+        DocumentImages(cache, doc).insert(doc.new_page(), RECT, path)
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["entries"]) == (1, 2, 1)
+    assert stats["bytes"] > 0
+
+
+def test_replaced_image_file_is_encoded_again(tmp_path):
+    path = tmp_path / "logo.png"
+    _write_png(path)
+    cache = EncodedImageCache()
+    before = cache.get_image(path)
+
+    _write_png(path, color=(10, 200, 10))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    after = cache.get_image(path)
+
+    assert after is not before
+    assert cache.stats()["misses"] == 2
@@ -0,0 +1,100 @@
+import time
+
+from app.services.job_queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, RenderJobQueue
+
+
+def _queue(tmp_path, lease_seconds=60.0):
+    return RenderJobQueue(tmp_path / "jobs.db", tmp_path / "results", lease_seconds=lease_seconds)
+
+
+def test_submit_and_claim(tmp_path):
+    queue = _queue(tmp_path)
+    first = queue.create("u1", "t1", [{"a": 1}, {"a": 2}], "zip")
+    second = queue.create("u1", "t1", [{"a": 3}])
+    assert first["status"] == JOB_QUEUED
+    assert first["total"] == 2 and first["format"] == "zip"
+
+    job = queue.claim_next()
+    assert job["job_id"] == first["job_id"]
+    assert job["status"] == JOB_RUNNING
+    assert job["payload"]["records"] == [{"a": 1}, {"a": 2}]
+    assert queue.claim_next()["job_id"] == second["job_id"]
+    assert queue.claim_next() is None
+
+
+def test_progress_and_result(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.create("u1", "t1", [{}, {}, {}, {}])["job_id"]
+    queue.claim_next()
+
+    assert queue.set_progress(job_id, 1)
+    assert queue.get(job_id)["progress"] == 0.25
+
+    result_path = tmp_path / "results" / f"{job_id}.pdf"
+    assert queue.complete(job_id, result_path)
+    job = queue.get(job_id)
+    assert job["status"] == JOB_DONE
+    assert job["done"] == 4 and job["result_path"] == str(result_path)
+
+
+def test_fail(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.create("u1", "t1", [{}])["job_id"]
+    queue.claim_next()
+    assert queue.fail(job_id, "boom")
+    job = queue.get(job_id)
+    assert job["status"] == JOB_FAILED and job["error"] == "boom"
+
+
+def test_running_job_of_live_process_is_not_requeued(tmp_path):
+    worker = _queue(tmp_path)
+    job_id = worker.create("u1", "t1", [{}])["job_id"]
+    worker.claim_next()
+
+    # Another process starting up
+    sibling = _queue(tmp_path)
+    assert sibling.requeue_expired() == 0
+    assert sibling.claim_next() is None
+    assert sibling.get(job_id)["status"] == JOB_RUNNING
+
+
+def test_requeue_after_restart(tmp_path):
+    stopped = _queue(tmp_path, lease_seconds=0.05)
+    job_id = stopped.create("u1", "t1", [{}, {}])["job_id"]
+    stopped.claim_next()
+    stopped.set_progress(job_id, 1)
+    stopped.close()
+    time.sleep(0.1)
+
+    restarted = _queue(tmp_path)
+    assert restarted.requeue_expired() == 1
+    job = restarted.get(job_id)
+    assert job["status"] == JOB_QUEUED and job["done"] == 0
+    assert restarted.claim_next()["job_id"] == job_id
+
+
+def test_updates_after_lost_lease_are_ignored(tmp_path):
+    old = _queue(tmp_path, lease_seconds=0.05)
+    job_id = old.create("u1", "t1", [{}])["job_id"]
+    old.claim_next()
+    time.sleep(0.1)
+
+    new = _queue(tmp_path)
+    new.requeue_expired()
+    new.claim_next()
+
+    assert not old.renew(job_id)
+    assert not old.complete(job_id, tmp_path / "stale.pdf")
+    assert new.get(job_id)["status"] == JOB_RUNNING
+    assert new.complete(job_id, tmp_path / "result.pdf")
+    assert new.get(job_id)["result_path"] == str(tmp_path / "result.pdf")
+
+
+def test_renew_extends_lease(tmp_path):
+    worker = _queue(tmp_path, lease_seconds=0.2)
+    job_id = worker.create("u1", "t1", [{}])["job_id"]
+    worker.claim_next()
+    time.sleep(0.12)
+    assert worker.renew(job_id)
+    time.sleep(0.12)
+    assert _queue(tmp_path).requeue_expired() == 0
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from app.services.auth_service import AuthService
+from app.services.password_hasher import PasswordHasher, PasswordHasherSaturated, hash_cost
+from app.services.storage import FileUserStore
+
+
+def test_password_is_rehashed_when_cost_changes(tmp_path):
+    store = FileUserStore(tmp_path / "users")
+    auth = AuthService(tmp_path / "users", store=store, hasher=PasswordHasher(rounds=5))
+    asyncio.run(auth.register_user("alice", "alice@example.com", "secret"))
+    old_hash = store.get_user("alice")["hashed_password"]
+    assert hash_cost(old_hash) == 5
+
+    # Same cost: hash is kept
+    assert asyncio.run(auth.authenticate_user("alice", "secret"))["username"] == "alice"
+    assert store.get_user("alice")["hashed_password"] == old_hash
+
+    auth.hasher = PasswordHasher(rounds=4)
+    assert asyncio.run(auth.authenticate_user("alice", "wrong")) is None
+    assert store.get_user("alice")["hashed_password"] == old_hash  # Not rehashed on a failed login
+
+    assert asyncio.run(auth.authenticate_user("alice", "secret"))["username"] == "alice"
+    new_hash = store.get_user("alice")["hashed_password"]
+    assert hash_cost(new_hash) == 4
+    assert auth.hasher.verify("secret", new_hash)
+
+
+def test_hasher_rejects_requests_when_full():
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+
+    async def burst():
+        hashed = hasher.hash("pw")
+        running = [asyncio.ensure_future(hasher.verify_async("pw", hashed)) for _ in range(hasher.capacity)]
+        await asyncio.sleep(0)  # Both are now in flight
+        with pytest.raises(PasswordHasherSaturated) as excinfo:
+            await hasher.verify_async("pw", hashed)
+        assert excinfo.value.retry_after == hasher.retry_after
+        assert all(await asyncio.gather(*running))
+        # Capacity is released once they finish
+        assert await hasher.verify_async("pw", hashed)
+
+    try:
+        asyncio.run(burst())
+    finally:
+        hasher.shutdown()
+    stats = hasher.stats()
+    assert stats["rejected"] == 1 and stats["pending"] == 0 and stats["completed"] == 3
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from app.services.font_registry import FontRegistry
+from app.services.render_plan import FieldPlan, TextPlan, compile_plan
+
+
+def _template(form_fields):
+    return {
+        "template_id": "t1",
+        "version": 1,
+        "form_fill": "fill",
+        "analysis": {"status": "done", "form_fields": form_fields},
+        "elements": [
+            {"id": "e1", "type": "text", "page": 1, "bbox": {"x": 10, "y": 100, "w": 190, "h": 20},
+             "data_path": "name"},
+        ],
+    }
+
+
+def _element(template, tmp_path: Path):
+    plan = compile_plan(template, "t1", FontRegistry(tmp_path / "fonts"), tmp_path)
+    (_, elements), = plan.pages
+    return elements[0]
+
+
+def test_form_field_matched_by_rect(tmp_path):
+    fields = [{"name": "name", "type": "Text", "page": 1, "rect": {"x": 11, "y": 99, "w": 190, "h": 21}}]
+    element = _element(_template(fields), tmp_path)
+    assert isinstance(element, FieldPlan)
+    assert element.field_name == "name"
+
+
+def test_form_field_without_rect_is_skipped(tmp_path):
+    fields = [
+        {"name": "no_rect", "type": "Text", "page": 1},
+        {"name": "partial", "type": "Text", "page": 1, "rect": {"x": 10, "y": 100}},
+        {"name": "name", "type": "Text", "page": 1, "rect": {"x": 10, "y": 100, "w": 190, "h": 20}},
+    ]
+    element = _element(_template(fields), tmp_path)
+    assert isinstance(element, FieldPlan)
+    assert element.field_name == "name"
+
+
+def test_no_usable_rect_draws_element(tmp_path):
+    element = _element(_template([{"name": "name", "type": "Text", "page": 1, "rect": None}]), tmp_path)
+    assert isinstance(element, TextPlan)
@@ -0,0 +1,93 @@
+import os
+
+from app.services.result_cache import RenderResultCache, result_cache_key
+
+
+def _template(**fields):
+    template = {"template_id": "t1", "version": 1, "analysis": {"finished_at": "2024-01-01T00:00:00"}}
+    template.update(fields)
+    return template
+
+
+def test_key_changes_with_everything_that_determines_the_output(tmp_path):
+    pdf = tmp_path / "t1.pdf"
+    pdf.write_bytes(b"%PDF-1.7 one")
+    data = {"name": "A", "items": [1, 2]}
+    key = result_cache_key(_template(), pdf, data)
+    assert key.startswith("t1/")
+    # Same inputs (data key order does not matter)
+    assert result_cache_key(_template(), pdf, {"items": [1, 2], "name": "A"}) == key
+
+    changed = [
+        result_cache_key(_template(version=2), pdf, data),
+        result_cache_key(_template(analysis={"finished_at": "2024-01-02T00:00:00"}), pdf, data),
+        result_cache_key(_template(), pdf, {"name": "B", "items": [1, 2]}),
+        result_cache_key(_template(), pdf, data, elements_override=[{"id": "e1"}]),
+        result_cache_key(_template(), pdf, data, output_format="zip"),
+    ]
+    st = pdf.stat()
+    os.utime(pdf, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    changed.append(result_cache_key(_template(), pdf, data))
+
+    assert key not in changed
+    assert len(set(changed)) == len(changed)
+
+
+def test_put_and_get_across_tiers(tmp_path):
+    cache = RenderResultCache(tmp_path / "cache", max_memory_item_bytes=4)
+    cache.put("t1/small", b"abc")
+    cache.put("t1/large", b"0123456789")
+    assert cache.get("t1/small") == b"abc"
+    assert cache.get("t1/large") == b"0123456789"
+    assert cache.get("t1/missing") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["memory_hits"], stats["misses"]) == (2, 1, 1)
+
+    # The disk tier survives a restart
+    assert RenderResultCache(tmp_path / "cache").get("t1/large") == b"0123456789"
+
+
+def test_invalidate_template_removes_its_entries(tmp_path):
+    cache = RenderResultCache(tmp_path / "cache")
+    cache.put("t1/a", b"one")
+    cache.put("t1/b", b"two")
+    cache.put("t2/a", b"other")
+
+    cache.invalidate_template("t1")
+
+    assert cache.get("t1/a") is None and cache.get("t1/b") is None
+    assert cache.get("t2/a") == b"other"
+    assert not (tmp_path / "cache" / "t1").exists()
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["disk_bytes"] == len(b"other")
+
+
+def test_lru_eviction_keeps_disk_within_byte_cap(tmp_path):
+    cache = RenderResultCache(tmp_path / "cache", max_disk_bytes=30, max_memory_bytes=0)
+    for name in ("a", "b", "c"):
+        cache.put(f"t1/{name}", name.encode() * 10)
+    assert cache.get("t1/a") == b"a" * 10  # a is now the most recently used
+
+    cache.put("t1/d", b"d" * 10)
+
+    assert cache.get("t1/b") is None
+    assert [cache.get(f"t1/{name}") is not None for name in ("a", "c", "d")] == [True, True, True]
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 30 and stats["evictions"] == 1
+    assert not (tmp_path / "cache" / "t1" / "b").exists()
+
+    # Results larger than the whole cache are not stored
+    cache.put("t1/huge", b"x" * 31)
+    assert cache.get("t1/huge") is None
+
+
+def test_memory_tier_respects_its_byte_cap(tmp_path):
+    cache = RenderResultCache(tmp_path / "cache", max_memory_bytes=8, max_memory_item_bytes=8)
+    cache.put("t1/a", b"aaaa")
+    cache.put("t1/b", b"bbbb")
+    cache.put("t1/c", b"cccc")
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2 and stats["memory_bytes"] == 8
+    # Evicted from memory only: still served from disk
+    assert cache.get("t1/a") == b"aaaa"
+    assert cache.stats()["memory_hits"] == 0
@@ -0,0 +1,65 @@
+from app.services.storage import FileTemplateStore, INDEX_FILE_NAME
+
+
+def _template(template_id, user_id="u1", elements=0):
+    return {
+        "template_id": template_id,
+        "user_id": user_id,
+        "filename": f"{template_id}.pdf",
+        "created_at": "2024-01-01T00:00:00",
+        "elements": [{"id": f"e{i}"} for i in range(elements)],
+    }
+
+
+def _ids(store, user_id=None):
+    return sorted(summary["template_id"] for summary in store.list(user_id))
+
+
+def test_index_sees_templates_saved_by_another_process(tmp_path):
+    first, second = FileTemplateStore(tmp_path), FileTemplateStore(tmp_path)
+    first.put("a", _template("a"))
+    assert _ids(second) == ["a"]
+
+    # Appended after second loaded its index
+    first.put("b", _template("b", user_id="u2"))
+    first.delete("a")
+    assert _ids(second) == ["b"]
+    assert second.owner("b") == "u2" and second.owner("a") is None
+
+    # Both keep appending to the same journal
+    second.put("c", _template("c"))
+    first.put("b", _template("b", user_id="u2", elements=3))
+    assert _ids(first) == _ids(second) == ["b", "c"]
+    assert [s["element_count"] for s in second.list("u2")] == [3]
+
+
+def test_index_reloads_journal_compacted_by_another_process(tmp_path):
+    first, second = FileTemplateStore(tmp_path), FileTemplateStore(tmp_path)
+    first.put("keep", _template("keep"))
+    assert _ids(second) == ["keep"]
+
+    index_path = tmp_path / INDEX_FILE_NAME
+    generation = index_path.read_text(encoding="utf-8").splitlines()[0]
+    for i in range(80):
+        first.put(f"t{i}", _template(f"t{i}"))
+        first.delete(f"t{i}")
+    first.put("late", _template("late"))
+    # Journal was compacted (the new file may even reuse the old inode)
+    assert index_path.read_text(encoding="utf-8").splitlines()[0] != generation
+
+    assert _ids(second) == ["keep", "late"]
+
+
+def test_index_ignores_partially_written_line(tmp_path):
+    first, second = FileTemplateStore(tmp_path), FileTemplateStore(tmp_path)
+    first.put("a", _template("a"))
+    assert _ids(second) == ["a"]
+
+    index_path = tmp_path / INDEX_FILE_NAME
+    with open(index_path, "a", encoding="utf-8") as f:
+        f.write('{"user_id":"u1","template_id":"b"')
+    assert _ids(second) == ["a"]
+
+    with open(index_path, "a", encoding="utf-8") as f:
+        f.write(',"filename":"b.pdf","created_at":"","element_count":0}\n')
+    assert _ids(second) == ["a", "b"]
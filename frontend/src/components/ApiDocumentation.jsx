@@ -98,8 +98,7 @@ function ApiDocumentation() {
         schema: {
           template_id: 'uuid-here',
           filename: 'template.pdf',
-          page_count: 1,
-          page_size: { w_pt: 595.28, h_pt: 841.89 }
+          analysis_status: 'pending'
         }
       },
       example: `curl -X POST ${apiBase}/templates \\
@@ -214,7 +214,15 @@ function TemplateEditor({ templateId, onBack }) {
 
   const loadTemplate = async () => {
     try {
-      const response = await axios.get(`${API_BASE}/templates/${templateId}`)
+      let response = await axios.get(`${API_BASE}/templates/${templateId}`)
+      // Just uploaded: page sizes arrive with the background analysis (wait up to 30s)
+      for (let attempt = 0; attempt < 30 && ['pending', 'running'].includes(response.data.analysis?.status); attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        const analysis = await axios.get(`${API_BASE}/templates/${templateId}/analysis`)
+        if (!['pending', 'running'].includes(analysis.data.status)) {
+          response = await axios.get(`${API_BASE}/templates/${templateId}`)
+        }
+      }
       setTemplate(response.data)
     } catch (error) {
       alert(t('templateEditor.alerts.loadFailed') + ': ' + (error.response?.data?.detail || error.message))